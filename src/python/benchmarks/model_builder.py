@@ -0,0 +1,91 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import itertools
+from typing import List
+
+# my libs
+from system import SystemFile
+from lftp import LftpJobStatus
+from model import ModelDiffUtil
+from controller import ModelBuilder
+from benchmarks.utils import BenchmarkUtils
+
+
+def build_roots(num_roots: int, num_files: int) -> List[SystemFile]:
+    """
+    Returns num_roots directories, each with num_files files
+    """
+    roots = []
+    for i in range(num_roots):
+        root = SystemFile("dir{:05d}".format(i), 1000 * num_files, True)
+        for j in range(num_files):
+            root.add_child(SystemFile("file{:05d}.bin".format(j), 1000, False))
+        roots.append(root)
+    return roots
+
+
+def build_statuses(names: List[str], speed: int) -> List[LftpJobStatus]:
+    """
+    Returns running statuses of the given roots, all at the given speed
+    """
+    statuses = []
+    for job_id, name in enumerate(names):
+        status = LftpJobStatus(job_id, LftpJobStatus.Type.MIRROR, LftpJobStatus.State.RUNNING, name, "")
+        status.total_transfer_state = LftpJobStatus.TransferState(None, None, None, speed, None)
+        status.add_active_file_transfer_state("file00000.bin",
+                                              LftpJobStatus.TransferState(500, 1000, 50, speed, 1))
+        statuses.append(status)
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time a model update while a few roots are downloading")
+    parser.add_argument("--roots", type=int, default=5000, help="Number of roots")
+    parser.add_argument("--files", type=int, default=10, help="Number of files in each root")
+    parser.add_argument("--downloads", type=int, default=3, help="Number of downloading roots")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of timed updates")
+    args = parser.parse_args()
+
+    remote_files = build_roots(args.roots, args.files)
+    local_files = build_roots(args.roots, args.files)
+    downloading_names = [root.name for root in remote_files[:args.downloads]]
+    speeds = itertools.count(1000)
+
+    def update(builder: ModelBuilder, model_before):
+        """
+        One controller tick: only the download speeds changed
+        """
+        builder.set_lftp_statuses(build_statuses(downloading_names, next(speeds)))
+        model_after = builder.build_model()
+        ModelDiffUtil.diff_models(model_before, model_after)
+        return model_after
+
+    def full_update():
+        # Every root is rebuilt, as with a builder that drops the whole model
+        builder = ModelBuilder()
+        builder.set_remote_files(remote_files)
+        builder.set_local_files(local_files)
+        update(builder, full_model)
+
+    full_builder = ModelBuilder()
+    full_builder.set_remote_files(remote_files)
+    full_builder.set_local_files(local_files)
+    full_model = full_builder.build_model()
+
+    incremental_builder = ModelBuilder()
+    incremental_builder.set_remote_files(remote_files)
+    incremental_builder.set_local_files(local_files)
+    incremental_model = incremental_builder.build_model()
+
+    def incremental_update():
+        global incremental_model
+        incremental_model = update(incremental_builder, incremental_model)
+
+    print("{} roots of {} files, {} downloading".format(args.roots, args.files, args.downloads))
+    full_time = BenchmarkUtils.time_it(full_update, args.repeat)
+    incremental_time = BenchmarkUtils.time_it(incremental_update, args.repeat)
+    print("Full rebuild:         {:8.4f}s".format(full_time))
+    print("Incremental rebuild:  {:8.4f}s  ({:.1f}x faster)".format(
+        incremental_time, full_time / incremental_time
+    ))
@@ -0,0 +1,66 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+
+# my libs
+from system import SystemFile
+from lftp import LftpJobStatus
+from controller import ModelBuilder
+from benchmarks.utils import BenchmarkUtils
+
+
+def build_mirror(num_dirs: int, num_files_per_dir: int, local_fraction: float) -> (SystemFile, SystemFile):
+    """
+    Returns the remote and local trees of a single root
+    The local tree holds the first local_fraction of the files of every directory.
+    """
+    remote = SystemFile("mirror", 1000 * num_dirs * num_files_per_dir, True)
+    local = SystemFile("mirror", 1000 * int(num_dirs * num_files_per_dir * local_fraction), True)
+    for i in range(num_dirs):
+        remote_dir = SystemFile("dir{:05d}".format(i), 1000 * num_files_per_dir, True)
+        local_dir = SystemFile("dir{:05d}".format(i), 1000 * int(num_files_per_dir * local_fraction), True)
+        for j in range(num_files_per_dir):
+            name = "file{:06d}.bin".format(j)
+            remote_dir.add_child(SystemFile(name, 1000, False))
+            if j < num_files_per_dir * local_fraction:
+                local_dir.add_child(SystemFile(name, 1000, False))
+        remote.add_child(remote_dir)
+        local.add_child(local_dir)
+    return remote, local
+
+
+def build_status(num_dirs: int, num_files_per_dir: int, num_active: int) -> LftpJobStatus:
+    """
+    Returns a running mirror job of the root, with num_active files downloading
+    """
+    status = LftpJobStatus(0, LftpJobStatus.Type.MIRROR, LftpJobStatus.State.RUNNING, "mirror", "")
+    status.total_transfer_state = LftpJobStatus.TransferState(None, None, None, 1000, None)
+    for i in range(num_active):
+        path = "dir{:05d}/file{:06d}.bin".format(i % num_dirs, num_files_per_dir - 1 - i // num_dirs)
+        status.add_active_file_transfer_state(path, LftpJobStatus.TransferState(500, 1000, 50, 100, 5))
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the model build of a single large mirror job")
+    parser.add_argument("--dirs", type=int, default=20, help="Number of directories in the root")
+    parser.add_argument("--files", type=int, default=10000, help="Number of files in each directory")
+    parser.add_argument("--active", type=int, default=50, help="Number of files downloading")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed builds")
+    args = parser.parse_args()
+
+    remote_root, local_root = build_mirror(args.dirs, args.files, 0.5)
+    job_status = build_status(args.dirs, args.files, args.active)
+
+    def build():
+        # A new builder, so that the root is always rebuilt
+        builder = ModelBuilder()
+        builder.set_remote_files([remote_root])
+        builder.set_local_files([local_root])
+        builder.set_lftp_statuses([job_status])
+        builder.build_model()
+
+    print("Mirror job of {} files in {} directories, {} downloading".format(
+        args.dirs * args.files, args.dirs, args.active
+    ))
+    print("Build: {:8.3f}s".format(BenchmarkUtils.time_it(build, args.repeat)))
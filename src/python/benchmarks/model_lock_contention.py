@@ -0,0 +1,179 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import logging
+import threading
+import time
+from typing import List, Sequence
+
+# my libs
+from common import overrides
+from model import Model, ModelFile, ModelDiff, ModelDiffUtil, IModelListener
+
+
+class CountingListener(IModelListener):
+    def __init__(self):
+        self.count = 0
+
+    @overrides(IModelListener)
+    def file_added(self, file: ModelFile):
+        self.count += 1
+
+    @overrides(IModelListener)
+    def file_removed(self, file: ModelFile):
+        self.count += 1
+
+    @overrides(IModelListener)
+    def file_updated(self, old_file: ModelFile, new_file: ModelFile):
+        self.count += 1
+
+
+class LockedModel:
+    """
+    Model access as the controller did it before snapshots: one lock for the
+    writer's whole update and for every reader
+    """
+    def __init__(self, model: Model):
+        self.model = model
+        self.__lock = threading.Lock()
+
+    def apply(self, new_model: Model):
+        with self.__lock:
+            apply_diff(self.model, new_model)
+
+    def get_model_files_and_add_listener(self, listener: IModelListener) -> Sequence[ModelFile]:
+        with self.__lock:
+            self.model.add_listener(listener)
+            return tuple(self.model.get_file(name) for name in self.model.get_file_names())
+
+    def remove_listener(self, listener: IModelListener):
+        with self.__lock:
+            self.model.remove_listener(listener)
+
+
+class SnapshotModel:
+    """
+    Model access with published snapshots
+    """
+    def __init__(self, model: Model):
+        self.model = model
+
+    def apply(self, new_model: Model):
+        apply_diff(self.model, new_model)
+        self.model.publish_snapshot()
+
+    def get_model_files_and_add_listener(self, listener: IModelListener) -> Sequence[ModelFile]:
+        return self.model.get_snapshot_and_add_listener(listener).files
+
+    def remove_listener(self, listener: IModelListener):
+        self.model.remove_listener(listener)
+
+
+def apply_diff(model: Model, new_model: Model):
+    for diff in ModelDiffUtil.diff_models(model, new_model):
+        if diff.change == ModelDiff.Change.ADDED:
+            model.add_file(diff.new_file)
+        elif diff.change == ModelDiff.Change.REMOVED:
+            model.remove_file(diff.old_file.name)
+        elif diff.change == ModelDiff.Change.UPDATED:
+            model.update_file(diff.new_file)
+
+
+def build_file(name: str, num_files: int, speed: int) -> ModelFile:
+    root = ModelFile(name, True)
+    root.downloading_speed = speed
+    for i in range(num_files):
+        root.add_child(ModelFile("file{:03d}".format(i), False))
+    root.freeze()
+    return root
+
+
+def new_model(files: dict) -> Model:
+    model = Model()
+    model.set_base_logger(logging.getLogger("dummy"))
+    for file in files.values():
+        model.add_file(file)
+    return model
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(access_class, num_roots: int, num_files: int, num_clients: int, num_downloads: int, duration: float):
+    """
+    Run a writer and the stream clients for duration seconds
+    :return: (writer pass latencies, client setup latencies)
+    """
+    files = {"root{:05d}".format(i): build_file("root{:05d}".format(i), num_files, 0) for i in range(num_roots)}
+    model = Model()
+    model.set_base_logger(logging.getLogger("dummy"))
+    access = access_class(model)
+    access.apply(new_model(files))
+
+    stop = threading.Event()
+    writer_latencies = []
+    client_latencies = [[] for _ in range(num_clients)]
+
+    def writer():
+        speed = 0
+        while not stop.is_set():
+            # Only the downloads change, as in a typical controller tick
+            speed += 1
+            for i in range(num_downloads):
+                name = "root{:05d}".format(i)
+                files[name] = build_file(name, num_files, speed)
+            next_model = new_model(files)
+            start = time.perf_counter()
+            access.apply(next_model)
+            writer_latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    def client(latencies: List[float]):
+        while not stop.is_set():
+            # A stream that connects, reads the model and disconnects
+            listener = CountingListener()
+            start = time.perf_counter()
+            model_files = access.get_model_files_and_add_listener(listener)
+            latencies.append(time.perf_counter() - start)
+            assert len(model_files) == num_roots
+            access.remove_listener(listener)
+            # Serializing and sending the model, outside of any lock
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=writer)]
+    threads += [threading.Thread(target=client, args=(latencies,)) for latencies in client_latencies]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return writer_latencies, [latency for latencies in client_latencies for latency in latencies]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the contention of a locked model and model snapshots")
+    parser.add_argument("--roots", type=int, default=10000, help="Number of roots in the model")
+    parser.add_argument("--files", type=int, default=10, help="Number of files in each root")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="Numbers of stream clients")
+    parser.add_argument("--downloads", type=int, default=3, help="Number of roots changed by each update")
+    parser.add_argument("--duration", type=float, default=5.0, help="Duration of each run in seconds")
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        print("{} roots, {} clients".format(args.roots, clients))
+        for label, access_class in (("locked", LockedModel), ("snapshot", SnapshotModel)):
+            writer_latencies, client_latencies = run(access_class, args.roots, args.files, clients,
+                                                     args.downloads, args.duration)
+            print("  {:8s}: {:5d} updates, update p50 {:7.2f}ms p99 {:7.2f}ms | "
+                  "{:6d} client setups, setup p50 {:7.3f}ms p99 {:7.3f}ms".format(
+                      label,
+                      len(writer_latencies),
+                      1000 * percentile(writer_latencies, 0.5),
+                      1000 * percentile(writer_latencies, 0.99),
+                      len(client_latencies),
+                      1000 * percentile(client_latencies, 0.5),
+                      1000 * percentile(client_latencies, 0.99)
+                  ))
@@ -0,0 +1,95 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import logging
+import time
+from unittest.mock import MagicMock
+
+import bottle
+
+# my libs
+from model import Model, ModelFile, ModelJournal
+from web.handler.stream_model import ModelStreamHandler, ModelStreamBroadcaster
+
+
+def build_file(name: str, num_files: int, speed: int) -> ModelFile:
+    root = ModelFile(name, True)
+    root.downloading_speed = speed
+    for i in range(num_files):
+        child = ModelFile("file{:03d}".format(i), False)
+        child.remote_size = 1000
+        root.add_child(child)
+    root.freeze()
+    return root
+
+
+def drain(handler: ModelStreamHandler) -> int:
+    """
+    Send everything the stream has, as the web app does on every poll
+    :return: number of bytes sent
+    """
+    num_bytes = 0
+    while True:
+        value = handler.get_value()
+        if not value:
+            return num_bytes
+        num_bytes += len(value)
+
+
+def run(shared: bool, num_roots: int, num_files: int, num_clients: int, num_updates: int):
+    """
+    Connect the clients, then stream the updates to all of them
+    :return: (connect time, update time, bytes per client)
+    """
+    model = Model()
+    model.set_base_logger(logging.getLogger("dummy"))
+    journal = ModelJournal(model)
+    model.add_listener(journal)
+    controller = MagicMock()
+    controller.get_model_snapshot.side_effect = model.get_snapshot
+    controller.get_model_journal.return_value = journal
+    for i in range(num_roots):
+        model.add_file(build_file("root{:05d}".format(i), num_files, 0))
+    model.publish_snapshot()
+
+    broadcaster = ModelStreamBroadcaster(controller)
+    bottle.request.bind({})
+    handlers = []
+    for _ in range(num_clients):
+        # Without sharing, every stream serializes on its own
+        handler = ModelStreamHandler(controller, broadcaster if shared else ModelStreamBroadcaster(controller))
+        handler.setup()
+        handlers.append(handler)
+
+    start = time.perf_counter()
+    num_bytes = 0
+    for handler in handlers:
+        num_bytes += drain(handler)
+    connect_time = time.perf_counter() - start
+
+    update_time = 0
+    for speed in range(1, num_updates + 1):
+        model.update_file(build_file("root{:05d}".format(speed % num_roots), num_files, speed))
+        model.publish_snapshot()
+        start = time.perf_counter()
+        for handler in handlers:
+            num_bytes += drain(handler)
+        update_time += time.perf_counter() - start
+    return connect_time, update_time, num_bytes // num_clients
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the model streams of many clients")
+    parser.add_argument("--roots", type=int, default=2000, help="Number of roots in the model")
+    parser.add_argument("--files", type=int, default=10, help="Number of files in each root")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50], help="Numbers of clients")
+    parser.add_argument("--updates", type=int, default=500, help="Number of model updates")
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        print("{} roots, {} clients, {} updates".format(args.roots, clients, args.updates))
+        for label, shared in (("per-client", False), ("shared", True)):
+            connect_time, update_time, client_bytes = run(shared, args.roots, args.files, clients, args.updates)
+            print("  {:10s}: connect {:7.3f}s, updates {:7.3f}s, {:.2f} MB per client".format(
+                label, connect_time, update_time, client_bytes / 1e6
+            ))
@@ -0,0 +1,89 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import multiprocessing
+import pickle
+import time
+from datetime import datetime
+from typing import Optional
+
+# my libs
+from controller import ScannerResult, SharedScanFiles
+from benchmarks.wire_format import build_tree
+
+
+def send_results(files: list, encoding: Optional[str], repeat: int,
+                 result_queue: multiprocessing.Queue, go: multiprocessing.Event, send_time: multiprocessing.Value):
+    """
+    Scanner process side: publish the same result repeat times, each when the reader is ready
+    :param encoding: encoding of the shared memory segment, None to send the files through the queue
+    """
+    for generation in range(1, repeat + 1):
+        go.wait()
+        go.clear()
+        send_time.value = time.monotonic()
+        if encoding is not None:
+            result = ScannerResult(timestamp=datetime.now(),
+                                   files=None,
+                                   shared_files=SharedScanFiles.create(files, generation, encoding))
+        else:
+            result = ScannerResult(timestamp=datetime.now(), files=files)
+        result_queue.put(result)
+
+
+def run(files: list, encoding: Optional[str], repeat: int):
+    """
+    Controller side: time the reception of each result
+    :return: best (latency, reader time, bytes through the queue)
+    """
+    result_queue = multiprocessing.Queue()
+    go = multiprocessing.Event()
+    send_time = multiprocessing.Value('d', 0.0)
+    process = multiprocessing.Process(target=send_results,
+                                      args=(files, encoding, repeat, result_queue, go, send_time))
+    process.start()
+    best_latency = None
+    best_reader_time = None
+    queue_size = 0
+    try:
+        for _ in range(repeat):
+            go.set()
+            # Wait for the result without counting the wait as reader time
+            while result_queue.empty():
+                time.sleep(0.001)
+            get_start = time.monotonic()
+            result = result_queue.get()
+            get_end = time.monotonic()
+            # Measured outside of the timed sections
+            queue_size = len(pickle.dumps(result))
+            decode_start = time.monotonic()
+            received = result.files
+            reader_end = time.monotonic()
+            assert len(received) == len(files)
+            reader_time = (get_end - get_start) + (reader_end - decode_start)
+            latency = reader_end - send_time.value - (decode_start - get_end)
+            best_latency = latency if best_latency is None else min(best_latency, latency)
+            best_reader_time = reader_time if best_reader_time is None else min(best_reader_time, reader_time)
+    finally:
+        process.join()
+    return best_latency, best_reader_time, queue_size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the transports of scan results between processes")
+    parser.add_argument("--entries", type=int, nargs="+", default=[100000, 1000000],
+                        help="Tree sizes to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs")
+    args = parser.parse_args()
+
+    SharedScanFiles.prepare()
+    for num_entries in args.entries:
+        files = build_tree(num_entries)
+        print("Tree of {} entries".format(num_entries))
+        for label, encoding in (("queue", None),
+                                ("shared", SharedScanFiles.ENCODING_PICKLE),
+                                ("shared-wire", SharedScanFiles.ENCODING_WIRE)):
+            latency, reader_time, queue_size = run(files, encoding, args.repeat)
+            print("  {:11s}: latency {:.3f}s, reader {:.3f}s, {:.2f} MB through the queue".format(
+                label, latency, reader_time, queue_size / 1e6
+            ))
@@ -0,0 +1,39 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import shutil
+import tempfile
+
+# my libs
+from system import SystemScanner
+from benchmarks.utils import BenchmarkUtils
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full and steady-state incremental local scans")
+    parser.add_argument("--dirs", type=int, default=200, help="Number of root directories")
+    parser.add_argument("--files", type=int, default=100, help="Number of files per directory")
+    parser.add_argument("--depth", type=int, default=2, help="Directory depth below each root")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed scans")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="benchmark_scanner_incremental")
+    try:
+        num_files = BenchmarkUtils.create_tree(temp_dir, args.dirs, args.files, args.depth)
+        print("Created {} files in {} directories".format(num_files, args.dirs * (args.depth + 1)))
+
+        full_scanner = SystemScanner(temp_dir)
+        full_time = BenchmarkUtils.time_it(full_scanner.scan, args.repeat)
+
+        incremental_scanner = SystemScanner(temp_dir)
+        incremental_scanner.set_incremental(True)
+        first_time = BenchmarkUtils.time_it(incremental_scanner.scan, 1)
+        steady_time = BenchmarkUtils.time_it(incremental_scanner.scan, args.repeat)
+
+        print("Full scan:                  {:8.3f}s".format(full_time))
+        print("Incremental scan (cold):    {:8.3f}s".format(first_time))
+        print("Incremental scan (steady):  {:8.3f}s  ({:.1f}x faster)".format(
+            steady_time, full_time / steady_time
+        ))
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,78 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+# my libs
+from system import SystemScanner
+from benchmarks.utils import BenchmarkUtils
+
+
+class SlowDirEntry:
+    """
+    Wraps a DirEntry to add a fixed latency to its first stat, like network storage would
+    """
+    def __init__(self, entry: os.DirEntry, latency_in_s: float):
+        self.__entry = entry
+        self.__latency_in_s = latency_in_s
+        self.__stat = None
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self):
+        return self.__entry.is_dir()
+
+    def stat(self):
+        if self.__stat is None:
+            time.sleep(self.__latency_in_s)
+            self.__stat = self.__entry.stat()
+        return self.__stat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure scan wall-clock time against the number of workers")
+    parser.add_argument("--dirs", type=int, default=50, help="Number of root directories")
+    parser.add_argument("--files", type=int, default=20, help="Number of files per directory")
+    parser.add_argument("--depth", type=int, default=4, help="Directory depth below each root")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="Worker counts to run")
+    parser.add_argument("--latency-us", type=int, default=0,
+                        help="Simulated latency added to every stat, to model network storage")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed scans per worker count")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="benchmark_scanner_parallel")
+    real_scandir = os.scandir
+    real_stat = os.stat
+    try:
+        num_files = BenchmarkUtils.create_tree(temp_dir, args.dirs, args.files, args.depth)
+        print("Created {} files in {} directories".format(num_files, args.dirs * (args.depth + 1)))
+
+        if args.latency_us > 0:
+            latency_in_s = args.latency_us / 1e6
+
+            def slow_scandir(path):
+                time.sleep(latency_in_s)
+                return [SlowDirEntry(e, latency_in_s) for e in real_scandir(path)]
+
+            def slow_stat(path, *a, **kw):
+                time.sleep(latency_in_s)
+                return real_stat(path, *a, **kw)
+            os.scandir = slow_scandir
+            os.stat = slow_stat
+            print("Simulating {}us of latency per stat".format(args.latency_us))
+
+        baseline = None
+        for num_workers in args.workers:
+            scanner = SystemScanner(temp_dir)
+            scanner.set_num_workers(num_workers)
+            elapsed = BenchmarkUtils.time_it(scanner.scan, args.repeat)
+            baseline = baseline or elapsed
+            print("{:3d} workers: {:8.3f}s  ({:.2f}x)".format(num_workers, elapsed, baseline / elapsed))
+            scanner.set_num_workers(1)
+    finally:
+        os.scandir = real_scandir
+        os.stat = real_stat
+        shutil.rmtree(temp_dir)
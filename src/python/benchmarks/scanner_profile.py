@@ -0,0 +1,68 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import cProfile
+import os
+import pstats
+import shutil
+import tempfile
+
+# my libs
+from system import SystemScanner
+from benchmarks.utils import BenchmarkUtils
+
+
+class CallCounter:
+    """
+    Wraps a function to count the number of times it is called
+    """
+    def __init__(self, func):
+        self.func = func
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.func(*args, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the per-file cost of a full scan")
+    parser.add_argument("--dirs", type=int, default=100, help="Number of root directories")
+    parser.add_argument("--files", type=int, default=200, help="Number of files per directory")
+    parser.add_argument("--depth", type=int, default=4, help="Directory depth below each root")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed scans")
+    parser.add_argument("--profile", type=int, default=0, metavar="N",
+                        help="Profile one scan and print the N most expensive functions")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="benchmark_scanner_profile")
+    real_stat = os.stat
+    real_isfile = os.path.isfile
+    try:
+        num_files = BenchmarkUtils.create_tree(temp_dir, args.dirs, args.files, args.depth)
+        print("Created {} files in {} directories".format(num_files, args.dirs * (args.depth + 1)))
+
+        scanner = SystemScanner(temp_dir)
+        elapsed = BenchmarkUtils.time_it(scanner.scan, args.repeat)
+        print("Full scan: {:.3f}s, {:.3f}s per 100k files".format(elapsed, elapsed * 100000 / num_files))
+
+        # Count the path-based calls that go to the file system, on top of the
+        # one scandir per directory and the stat cached by each DirEntry
+        os.stat = CallCounter(real_stat)
+        os.path.isfile = CallCounter(real_isfile)
+        scanner.scan()
+        print("Path-based calls per 100k files: os.stat={:.0f}, os.path.isfile={:.0f}".format(
+            os.stat.count * 100000 / num_files,
+            os.path.isfile.count * 100000 / num_files
+        ))
+        os.stat = real_stat
+        os.path.isfile = real_isfile
+
+        if args.profile > 0:
+            profiler = cProfile.Profile()
+            profiler.runcall(scanner.scan)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.profile)
+    finally:
+        os.stat = real_stat
+        os.path.isfile = real_isfile
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,88 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import gc
+import pickle
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable
+
+# my libs
+from system import SystemFile
+
+
+class LegacySystemFile:
+    """
+    The previous SystemFile layout: a __dict__ per object, a children list
+    for every file and two datetime objects
+    """
+    def __init__(self, name: str, size: int, is_dir: bool = False,
+                 time_created: datetime = None, time_modified: datetime = None):
+        self.__name = name
+        self.__size = size
+        self.__is_dir = is_dir
+        self.__timestamp_created = time_created
+        self.__timestamp_modified = time_modified
+        self.__children = []
+
+    def add_child(self, file: "LegacySystemFile"):
+        self.__children.append(file)
+
+
+def build_legacy(num_dirs: int, num_files_per_dir: int):
+    now = time.time()
+    roots = []
+    for i in range(num_dirs):
+        d = LegacySystemFile("dir{:05d}".format(i), 0, True,
+                             time_modified=datetime.fromtimestamp(now))
+        for j in range(num_files_per_dir):
+            d.add_child(LegacySystemFile("file{:05d}.bin".format(j), 1024, False,
+                                         time_modified=datetime.fromtimestamp(now)))
+        roots.append(d)
+    return roots
+
+
+def build_current(num_dirs: int, num_files_per_dir: int):
+    now_ns = time.time_ns()
+    roots = []
+    for i in range(num_dirs):
+        d = SystemFile("dir{:05d}".format(i), 0, True, time_modified_ns=now_ns)
+        for j in range(num_files_per_dir):
+            d.add_child(SystemFile("file{:05d}.bin".format(j), 1024, False, time_modified_ns=now_ns))
+        roots.append(d)
+    return roots
+
+
+def measure(label: str, build: Callable, num_dirs: int, num_files_per_dir: int):
+    gc.collect()
+    tracemalloc.start()
+    roots = build(num_dirs, num_files_per_dir)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    data = pickle.dumps(roots)
+    dump_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pickle.loads(data)
+    load_time = time.perf_counter() - start
+
+    num_entries = num_dirs * (num_files_per_dir + 1)
+    print("{:8s}: memory {:8.1f} MB ({:5.0f} B/entry), pickle {:8.1f} MB ({:5.0f} B/entry), "
+          "dumps {:.3f}s, loads {:.3f}s".format(
+              label,
+              memory / 1e6, memory / num_entries,
+              len(data) / 1e6, len(data) / num_entries,
+              dump_time, load_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure memory and pickle size of SystemFile trees")
+    parser.add_argument("--dirs", type=int, default=1000, help="Number of directories")
+    parser.add_argument("--files", type=int, default=1000, help="Number of files per directory")
+    args = parser.parse_args()
+
+    print("Tree of {} entries".format(args.dirs * (args.files + 1)))
+    measure("legacy", build_legacy, args.dirs, args.files)
+    measure("current", build_current, args.dirs, args.files)
@@ -0,0 +1,53 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import os
+import time
+from typing import Callable
+
+
+class BenchmarkUtils:
+    @staticmethod
+    def create_tree(root: str, num_dirs: int, num_files_per_dir: int, depth: int = 2, file_size: int = 16):
+        """
+        Create a synthetic directory tree
+        Each root directory contains a chain of depth nested directories, and
+        every directory in the chain contains num_files_per_dir files.
+        Files are dated a day in the past, so they look settled to the scanner.
+        :param root: path of the existing directory to populate
+        :param num_dirs: number of root directories
+        :param num_files_per_dir: number of files in each directory
+        :param depth: number of directory levels below each root directory
+        :param file_size: size of each file in bytes
+        :return: total number of files created
+        """
+        content = bytearray([0xff] * file_size)
+        file_time = time.time() - 24*60*60
+        num_files = 0
+        for i in range(num_dirs):
+            path = os.path.join(root, "dir{:05d}".format(i))
+            for level in range(depth + 1):
+                os.mkdir(path)
+                for j in range(num_files_per_dir):
+                    file_path = os.path.join(path, "file{:05d}.bin".format(j))
+                    with open(file_path, "wb") as f:
+                        f.write(content)
+                    os.utime(file_path, (file_time, file_time))
+                    num_files += 1
+                path = os.path.join(path, "sub{}".format(level))
+        return num_files
+
+    @staticmethod
+    def time_it(func: Callable, repeat: int) -> float:
+        """
+        Returns the best wall-clock time (in seconds) of repeat calls to func
+        :param func:
+        :param repeat:
+        :return:
+        """
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,89 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import argparse
+import pickle
+import random
+import time
+from typing import List
+
+# my libs
+from system import SystemFile, WireFormat
+from benchmarks.utils import BenchmarkUtils
+
+
+def build_tree(num_entries: int) -> List[SystemFile]:
+    """
+    Build a tree that looks like a seedbox: release directories holding
+    sub-directories of split archives, with ns-precision timestamps
+    """
+    rng = random.Random(0)
+    base_ns = time.time_ns() - 30*24*60*60*10**9
+    roots = []
+    count = 0
+    i = 0
+    while count < num_entries:
+        sub_dirs = []
+        for s in range(5):
+            parts = [
+                SystemFile(
+                    "some.release.name.{:06d}.s{:02d}.part{:03d}.rar".format(i, s, p),
+                    rng.randrange(50 * 1024 * 1024),
+                    False,
+                    time_modified_ns=base_ns + rng.randrange(10**15)
+                ) for p in range(40)
+            ]
+            sub_dir = SystemFile("Season.{:02d}".format(s), sum(f.size for f in parts), True,
+                                 time_modified_ns=base_ns + rng.randrange(10**15))
+            for part in parts:
+                sub_dir.add_child(part)
+            sub_dirs.append(sub_dir)
+        release = SystemFile("Some.Release.Name.{:06d}.1080p.WEB-DL.x264-GROUP".format(i),
+                             sum(d.size for d in sub_dirs), True,
+                             time_modified_ns=base_ns + rng.randrange(10**15))
+        for sub_dir in sub_dirs:
+            release.add_child(sub_dir)
+        roots.append(release)
+        count += 1 + 5 * 41
+        i += 1
+    return roots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the scan wire format against pickle")
+    parser.add_argument("--entries", type=int, nargs="+", default=[100000, 1000000],
+                        help="Tree sizes to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs")
+    parser.add_argument("--compression-level", type=int, default=6, help="Level of the compressed runs")
+    args = parser.parse_args()
+
+    for num_entries in args.entries:
+        files = build_tree(num_entries)
+        print("Tree of {} entries".format(num_entries))
+
+        pickled = pickle.dumps(files)
+        wire = WireFormat.encode(files)
+        assert WireFormat.decode(wire) == files
+
+        results = [
+            ("pickle", pickled,
+             BenchmarkUtils.time_it(lambda: pickle.dumps(files), args.repeat),
+             BenchmarkUtils.time_it(lambda: pickle.loads(pickled), args.repeat)),
+            ("wire", wire,
+             BenchmarkUtils.time_it(lambda: WireFormat.encode(files), args.repeat),
+             BenchmarkUtils.time_it(lambda: WireFormat.decode(wire), args.repeat)),
+        ]
+        for compression in WireFormat.supported_compressions()[1:]:
+            def encode_compressed():
+                return b"".join(WireFormat.iter_compress(WireFormat.iter_encode(files),
+                                                         compression,
+                                                         args.compression_level))
+            compressed = encode_compressed()
+            results.append((
+                "wire+{}".format(compression), compressed,
+                BenchmarkUtils.time_it(encode_compressed, args.repeat),
+                BenchmarkUtils.time_it(lambda: WireFormat.decode(compressed), args.repeat)
+            ))
+        for label, data, encode_time, decode_time in results:
+            print("  {:9s}: {:8.2f} MB ({:5.1f} B/entry), encode {:.3f}s, decode {:.3f}s".format(
+                label, len(data) / 1e6, len(data) / num_entries, encode_time, decode_time
+            ))
@@ -117,6 +117,11 @@ class Status(BaseStatus):
         latest_remote_scan_time = StatusComponent._create_property("latest_remote_scan_time")
         latest_remote_scan_failed = StatusComponent._create_property("latest_remote_scan_failed")
         latest_remote_scan_error = StatusComponent._create_property("latest_remote_scan_error")
+        # Current intervals of the scanner processes' schedules
+        local_scan_interval_in_ms = StatusComponent._create_property("local_scan_interval_in_ms")
+        remote_scan_interval_in_ms = StatusComponent._create_property("remote_scan_interval_in_ms")
+        active_scan_interval_in_ms = StatusComponent._create_property("active_scan_interval_in_ms")
+        remote_active_scan_interval_in_ms = StatusComponent._create_property("remote_active_scan_interval_in_ms")
 
         def __init__(self):
             super().__init__()
@@ -124,6 +129,10 @@ class Status(BaseStatus):
             self.latest_remote_scan_time = None
             self.latest_remote_scan_failed = None
             self.latest_remote_scan_error = None
+            self.local_scan_interval_in_ms = None
+            self.remote_scan_interval_in_ms = None
+            self.active_scan_interval_in_ms = None
+            self.remote_active_scan_interval_in_ms = None
 
     # ----- End of component definition -----
 
@@ -5,4 +5,5 @@ from .controller_job import ControllerJob
 from .controller_persist import ControllerPersist
 from .model_builder import ModelBuilder
 from .auto_queue import AutoQueue, AutoQueuePersist, IAutoQueuePersistListener, AutoQueuePattern
-from .scan import IScanner, ScannerResult, ScannerProcess, ScannerError
+from .scan import IScanner, IWatchingScanner, ScannerResult, ScannerProcess, ScannerError, \
+    IScanSchedule, FixedScanSchedule, AdaptiveScanSchedule, SharedScanFiles, SharedFilesError
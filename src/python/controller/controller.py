@@ -1,18 +1,18 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
 from abc import ABC, abstractmethod
-from typing import List, Callable
-from threading import Lock
+from typing import List, Callable, Optional, Dict, Set, Sequence
 from queue import Queue
 from enum import Enum
-import copy
 
 # my libs
-from .scan import ScannerProcess, ActiveScanner, LocalScanner, RemoteScanner
+from .scan import ScannerProcess, ActiveScanner, LocalScanner, RemoteScanner, RemoteActiveScanner, \
+    FixedScanSchedule, AdaptiveScanSchedule
 from .extract import ExtractProcess, ExtractStatus
 from .model_builder import ModelBuilder
 from common import Context, AppError, MultiprocessingLogger, AppOneShotProcess, Constants
-from model import ModelError, ModelFile, Model, ModelDiff, ModelDiffUtil, IModelListener
+from model import ModelError, ModelFile, Model, ModelDiff, ModelDiffUtil, IModelListener, ModelSnapshot, \
+    ModelJournal
 from lftp import Lftp, LftpError, LftpJobStatus
 from .controller_persist import ControllerPersist
 from .delete import DeleteLocalProcess, DeleteRemoteProcess
@@ -71,6 +71,11 @@ class Controller:
             self.process = process
             self.post_callback = post_callback
 
+    # The full scans back off to this multiple of their configured interval
+    __MAX_SCAN_INTERVAL_FACTOR = 8
+    # Fraction of the scan intervals that the scanner processes randomly wait more or less
+    __SCAN_JITTER = 0.1
+
     def __init__(self,
                  context: Context,
                  persist: ControllerPersist):
@@ -87,12 +92,17 @@ class Controller:
         # The model
         self.__model = Model()
         self.__model.set_base_logger(self.logger)
-        # Lock for the model
         # Note: While the scanners are in a separate process, the rest of the application
         #       is threaded in a single process. (The webserver is bottle+paste which is
-        #       multi-threaded). Therefore it is safe to use a threading Lock for the model
-        #       (the scanner processes never try to access the model)
-        self.__model_lock = Lock()
+        #       multi-threaded). Only the controller thread changes the model. The web
+        #       threads read its published snapshots and add or remove listeners, neither
+        #       of which waits for the controller thread.
+        #       Model files are frozen by the model builder, so the snapshots share them
+        #       without copies.
+
+        # Recent model events, for the streams to catch up from
+        self.__model_journal = ModelJournal(self.__model)
+        self.__model.add_listener(self.__model_journal)
 
         # Model builder
         self.__model_builder = ModelBuilder()
@@ -122,9 +132,21 @@ class Controller:
         self.__active_scanner = ActiveScanner(self.__context.config.lftp.local_path)
         self.__local_scanner = LocalScanner(
             local_path=self.__context.config.lftp.local_path,
-            use_temp_file=self.__context.config.lftp.use_temp_file
+            use_temp_file=self.__context.config.lftp.use_temp_file,
+            watch=True
         )
         self.__remote_scanner = RemoteScanner(
+            remote_address=self.__context.config.lftp.remote_address,
+            remote_username=self.__context.config.lftp.remote_username,
+            remote_password=self.__password,
+            remote_port=self.__context.config.lftp.remote_port,
+            remote_path_to_scan=self.__context.config.lftp.remote_path,
+            local_path_to_scan_script=self.__context.args.local_path_to_scanfs,
+            remote_path_to_scan_script=self.__context.config.lftp.remote_path_to_scan_script,
+            watch=True,
+            watch_poll_interval_in_ms=self.__context.config.controller.interval_ms_remote_scan
+        )
+        self.__remote_active_scanner = RemoteActiveScanner(
             remote_address=self.__context.config.lftp.remote_address,
             remote_username=self.__context.config.lftp.remote_username,
             remote_password=self.__password,
@@ -134,18 +156,49 @@ class Controller:
             remote_path_to_scan_script=self.__context.config.lftp.remote_path_to_scan_script
         )
 
+        # The full scans back off while nothing changes, the local active scans
+        # track downloads at a steady rate
+        # The remote active scans back off as the active roots settle, up to
+        # the rate of the full remote scans, so that roots that do not change
+        # are not scanned on the remote server every second
+        # The large results of the full scans are passed through shared memory
         self.__active_scan_process = ScannerProcess(
             scanner=self.__active_scanner,
-            interval_in_ms=self.__context.config.controller.interval_ms_downloading_scan,
+            schedule=FixedScanSchedule(
+                interval_in_ms=self.__context.config.controller.interval_ms_downloading_scan,
+                jitter=Controller.__SCAN_JITTER
+            ),
             verbose=False
         )
         self.__local_scan_process = ScannerProcess(
             scanner=self.__local_scanner,
-            interval_in_ms=self.__context.config.controller.interval_ms_local_scan,
+            schedule=AdaptiveScanSchedule(
+                min_interval_in_ms=self.__context.config.controller.interval_ms_local_scan,
+                max_interval_in_ms=self.__context.config.controller.interval_ms_local_scan *
+                Controller.__MAX_SCAN_INTERVAL_FACTOR,
+                jitter=Controller.__SCAN_JITTER
+            ),
+            shared_memory=True
         )
         self.__remote_scan_process = ScannerProcess(
             scanner=self.__remote_scanner,
-            interval_in_ms=self.__context.config.controller.interval_ms_remote_scan,
+            schedule=AdaptiveScanSchedule(
+                min_interval_in_ms=self.__context.config.controller.interval_ms_remote_scan,
+                max_interval_in_ms=self.__context.config.controller.interval_ms_remote_scan *
+                Controller.__MAX_SCAN_INTERVAL_FACTOR,
+                jitter=Controller.__SCAN_JITTER
+            ),
+            shared_memory=True
+        )
+        self.__remote_active_scan_process = ScannerProcess(
+            scanner=self.__remote_active_scanner,
+            schedule=AdaptiveScanSchedule(
+                min_interval_in_ms=self.__context.config.controller.interval_ms_downloading_scan,
+                max_interval_in_ms=max(self.__context.config.controller.interval_ms_downloading_scan,
+                                       self.__context.config.controller.interval_ms_remote_scan),
+                jitter=Controller.__SCAN_JITTER
+            ),
+            verbose=False
         )
 
         # Setup extract process
@@ -163,11 +216,18 @@ class Controller:
         self.__active_scan_process.set_multiprocessing_logger(self.__mp_logger)
         self.__local_scan_process.set_multiprocessing_logger(self.__mp_logger)
         self.__remote_scan_process.set_multiprocessing_logger(self.__mp_logger)
+        self.__remote_active_scan_process.set_multiprocessing_logger(self.__mp_logger)
         self.__extract_process.set_multiprocessing_logger(self.__mp_logger)
 
         # Keep track of active files
         self.__active_downloading_file_names = []
         self.__active_extracting_file_names = []
+        self.__active_remote_file_names = []
+        # Remote roots that changed in the latest remote scan, which are
+        # likely still being populated on the remote server
+        self.__remote_file_sizes = None  # type: Optional[Dict[str, int]]
+        self.__growing_remote_file_names = set()  # type: Set[str]
+        self.__remote_active_scan_file_names = []  # type: List[str]
 
         # Keep track of active command processes
         self.__active_command_processes = []
@@ -184,6 +244,7 @@ class Controller:
         self.__active_scan_process.start()
         self.__local_scan_process.start()
         self.__remote_scan_process.start()
+        self.__remote_active_scan_process.start()
         self.__extract_process.start()
         self.__mp_logger.start()
         self.__started = True
@@ -208,26 +269,39 @@ class Controller:
             self.__active_scan_process.terminate()
             self.__local_scan_process.terminate()
             self.__remote_scan_process.terminate()
+            self.__remote_active_scan_process.terminate()
             self.__extract_process.terminate()
             self.__active_scan_process.join()
             self.__local_scan_process.join()
             self.__remote_scan_process.join()
+            self.__remote_active_scan_process.join()
             self.__extract_process.join()
             self.__mp_logger.stop()
             self.__started = False
             self.logger.info("Exited controller")
 
-    def get_model_files(self) -> List[ModelFile]:
+    def get_model_files(self) -> Sequence[ModelFile]:
         """
-        Returns a copy of all the model files
+        Returns a snapshot of all the model files
+        The files are frozen, and the snapshot does not change with the model.
         :return:
         """
-        # Lock the model
-        self.__model_lock.acquire()
-        model_files = self.__get_model_files()
-        # Release the model
-        self.__model_lock.release()
-        return model_files
+        return self.__model.get_snapshot().files
+
+    def get_model_snapshot(self) -> ModelSnapshot:
+        """
+        Returns the latest snapshot of the model, along with its sequence number
+        :return:
+        """
+        return self.__model.get_snapshot()
+
+    def get_model_journal(self) -> ModelJournal:
+        """
+        Returns the journal of the recent model events
+        The journal's entries continue from any snapshot of the model.
+        :return:
+        """
+        return self.__model_journal
 
     def add_model_listener(self, listener: IModelListener):
         """
@@ -235,11 +309,7 @@ class Controller:
         :param listener:
         :return:
         """
-        # Lock the model
-        self.__model_lock.acquire()
         self.__model.add_listener(listener)
-        # Release the model
-        self.__model_lock.release()
 
     def remove_model_listener(self, listener: IModelListener):
         """
@@ -247,13 +317,9 @@ class Controller:
         :param listener:
         :return:
         """
-        # Lock the model
-        self.__model_lock.acquire()
         self.__model.remove_listener(listener)
-        # Release the model
-        self.__model_lock.release()
 
-    def get_model_files_and_add_listener(self, listener: IModelListener):
+    def get_model_files_and_add_listener(self, listener: IModelListener) -> Sequence[ModelFile]:
         """
         Adds a listener and returns the current state of model files in one atomic operation
         This guarantees that model update events are not missed or duplicated for the clients
@@ -263,31 +329,21 @@ class Controller:
             2. add_listener() -> model updated -> get_model()
                The model update is duplicated on client side (once through listener, and once
                through the model).
+        Note: this does not wait for the controller thread, see Model.get_snapshot_and_add_listener
         :param listener:
         :return:
         """
-        # Lock the model
-        self.__model_lock.acquire()
-        self.__model.add_listener(listener)
-        model_files = self.__get_model_files()
-        # Release the model
-        self.__model_lock.release()
-        return model_files
+        return self.__model.get_snapshot_and_add_listener(listener).files
 
     def queue_command(self, command: Command):
         self.__command_queue.put(command)
 
-    def __get_model_files(self) -> List[ModelFile]:
-        model_files = []
-        for filename in self.__model.get_file_names():
-            model_files.append(copy.deepcopy(self.__model.get_file(filename)))
-        return model_files
-
     def __update_model(self):
         # Grab the latest scan results
         latest_remote_scan = self.__remote_scan_process.pop_latest_result()
         latest_local_scan = self.__local_scan_process.pop_latest_result()
         latest_active_scan = self.__active_scan_process.pop_latest_result()
+        latest_remote_active_scan = self.__remote_active_scan_process.pop_latest_result()
 
         # Grab the Lftp status
         lftp_statuses = None
@@ -312,17 +368,41 @@ class Controller:
                 s.name for s in latest_extract_statuses.statuses if s.state == ExtractStatus.State.EXTRACTING
             ]
 
-        # Update the active scanner's state
+        # Update list of active remote file names
+        # These are the queued and downloading files, and the files still being populated
+        if lftp_statuses is not None:
+            self.__active_remote_file_names = [s.name for s in lftp_statuses]
+        if latest_remote_scan is not None and latest_remote_scan.unchanged:
+            self.__growing_remote_file_names = set()
+        elif latest_remote_scan is not None and not latest_remote_scan.failed:
+            remote_file_sizes = {f.name: f.size for f in latest_remote_scan.files}
+            if self.__remote_file_sizes is not None:
+                self.__growing_remote_file_names = {
+                    name for name, size in remote_file_sizes.items()
+                    if self.__remote_file_sizes.get(name, None) != size
+                }
+            self.__remote_file_sizes = remote_file_sizes
+
+        # Update the active scanners' state
         self.__active_scanner.set_active_files(
             self.__active_downloading_file_names + self.__active_extracting_file_names
         )
+        remote_active_scan_file_names = sorted(self.__growing_remote_file_names.union(self.__active_remote_file_names))
+        if remote_active_scan_file_names != self.__remote_active_scan_file_names:
+            self.__remote_active_scan_file_names = remote_active_scan_file_names
+            self.__remote_active_scanner.set_active_files(remote_active_scan_file_names)
+            # New active roots are scanned right away, however far the schedule backed off
+            self.__remote_active_scan_process.force_scan()
 
         # Update model builder state
-        if latest_remote_scan is not None:
+        # Note: unchanged scan results carry no files, the builder already has them
+        if latest_remote_scan is not None and not latest_remote_scan.unchanged:
             self.__model_builder.set_remote_files(latest_remote_scan.files)
-        if latest_local_scan is not None:
+        if latest_remote_active_scan is not None and not latest_remote_active_scan.unchanged:
+            self.__model_builder.set_remote_active_files(latest_remote_active_scan.files)
+        if latest_local_scan is not None and not latest_local_scan.unchanged:
             self.__model_builder.set_local_files(latest_local_scan.files)
-        if latest_active_scan is not None:
+        if latest_active_scan is not None and not latest_active_scan.unchanged:
             self.__model_builder.set_active_files(latest_active_scan.files)
         if lftp_statuses is not None:
             self.__model_builder.set_lftp_statuses(lftp_statuses)
@@ -337,9 +417,6 @@ class Controller:
         if self.__model_builder.has_changes():
             new_model = self.__model_builder.build_model()
 
-            # Lock the model
-            self.__model_lock.acquire()
-
             # Diff the new model with old model
             model_diff = ModelDiffUtil.diff_models(self.__model, new_model)
 
@@ -370,6 +447,9 @@ class Controller:
                     self.__persist.downloaded_file_names.add(diff.new_file.name)
                     self.__model_builder.set_downloaded_files(self.__persist.downloaded_file_names)
 
+            # Publish the changes to the readers
+            self.__model.publish_snapshot()
+
             # Prune the extracted files list of any files that were deleted locally
             # This prevents these files from going to EXTRACTED state if they are re-downloaded
             remove_extracted_file_names = set()
@@ -389,9 +469,6 @@ class Controller:
                 self.__persist.extracted_file_names.difference_update(remove_extracted_file_names)
                 self.__model_builder.set_extracted_files(self.__persist.extracted_file_names)
 
-            # Release the model
-            self.__model_lock.release()
-
         # Update the controller status
         if latest_remote_scan is not None:
             self.__context.status.controller.latest_remote_scan_time = latest_remote_scan.timestamp
@@ -399,6 +476,16 @@ class Controller:
             self.__context.status.controller.latest_remote_scan_error = latest_remote_scan.error_message
         if latest_local_scan is not None:
             self.__context.status.controller.latest_local_scan_time = latest_local_scan.timestamp
+        for name, process in (
+            ("local_scan_interval_in_ms", self.__local_scan_process),
+            ("remote_scan_interval_in_ms", self.__remote_scan_process),
+            ("active_scan_interval_in_ms", self.__active_scan_process),
+            ("remote_active_scan_interval_in_ms", self.__remote_active_scan_process)
+        ):
+            # Only changes are set, so that listeners are not notified on every update
+            interval_in_ms = process.get_interval_in_ms()
+            if getattr(self.__context.status.controller, name) != interval_in_ms:
+                setattr(self.__context.status.controller, name, interval_in_ms)
 
     def __process_commands(self):
         def _notify_failure(_command: Controller.Command, _msg: str):
@@ -424,6 +511,8 @@ class Controller:
                 except LftpError as e:
                     _notify_failure(command, "Lftp error: ".format(str(e)))
                     continue
+                # Local files are about to change
+                self.__local_scan_process.force_scan()
 
             elif command.action == Controller.Command.Action.STOP:
                 if file.state not in (ModelFile.State.DOWNLOADING, ModelFile.State.QUEUED):
@@ -434,6 +523,7 @@ class Controller:
                 except LftpError as e:
                     _notify_failure(command, "Lftp error: ".format(str(e)))
                     continue
+                self.__local_scan_process.force_scan()
 
             elif command.action == Controller.Command.Action.EXTRACT:
                 # Note: We don't check the is_extractable flag because it's just a guess
@@ -524,6 +614,7 @@ class Controller:
         self.__active_scan_process.propagate_exception()
         self.__local_scan_process.propagate_exception()
         self.__remote_scan_process.propagate_exception()
+        self.__remote_active_scan_process.propagate_exception()
         self.__mp_logger.propagate_exception()
         self.__extract_process.propagate_exception()
 
@@ -1,6 +1,9 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
-from .scanner_process import IScanner, ScannerResult, ScannerProcess, ScannerError
+from .scanner_process import IScanner, IWatchingScanner, ScannerResult, ScannerProcess, ScannerError
+from .scan_schedule import IScanSchedule, FixedScanSchedule, AdaptiveScanSchedule
+from .shared_files import SharedScanFiles, SharedFilesError
 from .active_scanner import ActiveScanner
 from .local_scanner import LocalScanner
 from .remote_scanner import RemoteScanner
+from .remote_active_scanner import RemoteActiveScanner
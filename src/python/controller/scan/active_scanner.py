@@ -17,8 +17,13 @@ class ActiveScanner(IScanner):
     A multiprocessing.Queue is used to store the names because the set and scan
     methods are called by different processes.
     """
-    def __init__(self, local_path: str):
+    def __init__(self, local_path: str, num_workers: int = 1):
+        """
+        :param local_path: path of the local directory to scan
+        :param num_workers: number of threads used to scan directories in parallel
+        """
         self.__scanner = SystemScanner(local_path)
+        self.__scanner.set_num_workers(num_workers)
         self.__active_files_queue = multiprocessing.Queue()
         self.__active_files = []  # latest state
         self.logger = logging.getLogger(self.__class__.__name__)
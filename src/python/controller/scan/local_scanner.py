@@ -1,32 +1,183 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
+import errno
 import logging
-from typing import List
+import time
+from typing import List, Optional, Dict
 
-from .scanner_process import IScanner, ScannerError
+from .scanner_process import IWatchingScanner, ScannerError
 from common import overrides, Localization, Constants
-from system import SystemScanner, SystemFile, SystemScannerError
+from system import SystemScanner, SystemFile, SystemScannerError, Inotify, InotifyEvent, InotifyError
 
 
-class LocalScanner(IScanner):
+class LocalScanner(IWatchingScanner):
     """
     Scanner implementation to scan the local filesystem
+
+    In watch mode, inotify is used to track changes to the local directories.
+    A scan only re-lists the directories that reported changes (the incremental
+    mode of SystemScanner), and a result is only returned when the files
+    actually changed. A periodic scan remains as a safety net, and a full scan
+    is done whenever the kernel drops events.
+    If inotify is not available, the scanner falls back to periodic scans.
     """
-    def __init__(self, local_path: str, use_temp_file: bool):
+    # Interval of the safety-net scans done in watch mode
+    __WATCH_SAFETY_SCAN_INTERVAL_IN_SECS = 60
+    # After the first event, time to wait for more so that bursts are handled by one scan
+    __WATCH_COALESCE_TIME_IN_SECS = 0.05
+    # Growing files are not watched (IN_MODIFY), as they change on every write
+    # of a download; they are picked up on close, or by the active scanner
+    __WATCH_MASK = Inotify.IN_CREATE | \
+        Inotify.IN_DELETE | \
+        Inotify.IN_MOVED_FROM | \
+        Inotify.IN_MOVED_TO | \
+        Inotify.IN_CLOSE_WRITE | \
+        Inotify.IN_ATTRIB | \
+        Inotify.IN_DELETE_SELF | \
+        Inotify.IN_MOVE_SELF | \
+        Inotify.IN_ONLYDIR
+
+    def __init__(self, local_path: str, use_temp_file: bool, watch: bool = False, num_workers: int = 1):
+        """
+        :param local_path: path of the local directory to scan
+        :param use_temp_file: whether lftp downloads to temp files
+        :param watch: whether to watch for changes instead of scanning periodically
+        :param num_workers: number of threads used to scan directories in parallel
+        """
         self.__scanner = SystemScanner(local_path)
+        self.__scanner.set_num_workers(num_workers)
         if use_temp_file:
             self.__scanner.set_lftp_temp_suffix(Constants.LFTP_TEMP_FILE_SUFFIX)
         self.logger = logging.getLogger("LocalScanner")
 
-    @overrides(IScanner)
+        # Watch mode state
+        # Note: inotify is only set up on the first scan, so that it belongs
+        #       to the scanner process
+        self.__watch = watch
+        self.__inotify = None  # type: Optional[Inotify]
+        self.__watched_paths = dict()  # type: Dict[str, int]
+        self.__watch_descriptors = dict()  # type: Dict[int, str]
+        self.__changes_pending = False
+        self.__timestamp_last_scan = 0.0
+        self.__prev_result = None  # type: Optional[List[SystemFile]]
+
+    @overrides(IWatchingScanner)
     def set_base_logger(self, base_logger: logging.Logger):
         self.logger = base_logger.getChild("LocalScanner")
 
-    @overrides(IScanner)
-    def scan(self) -> List[SystemFile]:
+    @overrides(IWatchingScanner)
+    def scan(self) -> Optional[List[SystemFile]]:
+        if self.__watch and self.__inotify is None:
+            self.__start_watching()
+
+        if self.__inotify is not None:
+            self.__process_events(self.__inotify.read_events())
+            if not self.__changes_pending and \
+                    time.monotonic() - self.__timestamp_last_scan < LocalScanner.__WATCH_SAFETY_SCAN_INTERVAL_IN_SECS:
+                return None
+            self.__changes_pending = False
+            self.__timestamp_last_scan = time.monotonic()
+
         try:
             result = self.__scanner.scan()
         except SystemScannerError:
             self.logger.exception("Caught SystemScannerError")
             raise ScannerError(Localization.Error.LOCAL_SERVER_SCAN, recoverable=False)
+
+        if self.__inotify is not None:
+            self.__update_watches()
+            if result == self.__prev_result:
+                return None
+            self.__prev_result = result
         return result
+
+    @overrides(IWatchingScanner)
+    def is_watching(self) -> bool:
+        return self.__inotify is not None
+
+    @overrides(IWatchingScanner)
+    def wait_for_changes(self, timeout_in_s: float) -> bool:
+        if self.__changes_pending:
+            return True
+        events = self.__inotify.read_events(timeout_in_s)
+        if events:
+            # Gather the rest of the burst
+            time.sleep(LocalScanner.__WATCH_COALESCE_TIME_IN_SECS)
+            events += self.__inotify.read_events()
+            self.__process_events(events)
+        return self.__changes_pending
+
+    def __start_watching(self):
+        self.__watch = False
+        if not Inotify.is_supported():
+            self.logger.warning("Inotify is not supported, falling back to periodic scans")
+            return
+        inotify = Inotify()
+        try:
+            inotify.open()
+        except InotifyError as e:
+            self.logger.warning("Failed to start inotify, falling back to periodic scans: {}".format(str(e)))
+            return
+        self.__inotify = inotify
+        # Files appended to in place do not modify their directory, so the
+        # cached directories are only trusted while inotify reports the changes
+        self.__scanner.set_incremental(True)
+        self.logger.info("Watching local directories for changes")
+
+    def __stop_watching(self):
+        self.__inotify.close()
+        self.__inotify = None
+        self.__watched_paths.clear()
+        self.__watch_descriptors.clear()
+        self.__scanner.set_incremental(False)
+
+    def __process_events(self, events: List[InotifyEvent]):
+        for event in events:
+            if event.mask & Inotify.IN_Q_OVERFLOW:
+                self.logger.warning("Inotify event queue overflowed, doing a full scan")
+                self.__scanner.clear_cache()
+                self.__changes_pending = True
+                continue
+            path = self.__watch_descriptors.get(event.wd, None)
+            if path is None:
+                continue
+            if event.mask & Inotify.IN_IGNORED:
+                # Watch was removed because the directory is gone
+                del self.__watch_descriptors[event.wd]
+                if self.__watched_paths.get(path, None) == event.wd:
+                    del self.__watched_paths[path]
+            self.__scanner.invalidate_dir(path)
+            self.__changes_pending = True
+
+    def __update_watches(self):
+        """
+        Sync the watches with the set of directories found by the last scan
+        :return:
+        """
+        scanned_paths = set(self.__scanner.get_cached_dir_paths())
+        new_paths = scanned_paths.difference(self.__watched_paths.keys())
+        for path in new_paths:
+            try:
+                wd = self.__inotify.add_watch(path, LocalScanner.__WATCH_MASK)
+            except InotifyError as e:
+                if e.error_number == errno.ENOSPC:
+                    self.logger.warning("Reached the inotify watch limit, falling back to periodic scans")
+                    self.__stop_watching()
+                    return
+                # Directory may have been deleted since it was scanned
+                self.logger.debug(str(e))
+                continue
+            self.__watched_paths[path] = wd
+            self.__watch_descriptors[wd] = path
+
+        for path in set(self.__watched_paths.keys()).difference(scanned_paths):
+            wd = self.__watched_paths.pop(path)
+            # A moved directory keeps its watch descriptor, which is now mapped to the new path
+            if self.__watch_descriptors.get(wd, None) == path:
+                del self.__watch_descriptors[wd]
+                self.__inotify.rm_watch(wd)
+
+        if new_paths:
+            # Changes made in the new directories before they were watched are
+            # caught by scanning one more time
+            self.__changes_pending = True
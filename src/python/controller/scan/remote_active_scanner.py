@@ -0,0 +1,75 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import logging
+from typing import List, Optional
+import multiprocessing
+import queue
+
+from .scanner_process import IScanner
+from .remote_scanner import RemoteScanner
+from common import overrides
+from system import SystemFile
+
+
+class RemoteActiveScanner(IScanner):
+    """
+    Scanner implementation to scan the active remote files only
+    This is the remote counterpart of ActiveScanner. A caller sets the names
+    of the remote roots that need to be refreshed more often than the full
+    remote scan, e.g. queued roots and roots that are still being populated.
+    A multiprocessing.Queue is used to store the names because the set and
+    scan methods are called by different processes.
+    The remote scanfs is left for the full remote scanner to install, and
+    the active roots are only scanned once it is in place.
+    """
+    def __init__(self,
+                 remote_address: str,
+                 remote_username: str,
+                 remote_password: Optional[str],
+                 remote_port: int,
+                 remote_path_to_scan: str,
+                 local_path_to_scan_script: str,
+                 remote_path_to_scan_script: str):
+        # The roots scanned here have no use for the deltas or the directory
+        # cache of the full scans
+        self.__scanner = RemoteScanner(
+            remote_address=remote_address,
+            remote_username=remote_username,
+            remote_password=remote_password,
+            remote_port=remote_port,
+            remote_path_to_scan=remote_path_to_scan,
+            local_path_to_scan_script=local_path_to_scan_script,
+            remote_path_to_scan_script=remote_path_to_scan_script,
+            delta=False,
+            watch=False,
+            cache=False
+        )
+        self.__active_files_queue = multiprocessing.Queue()
+        self.__active_files = []  # latest state
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @overrides(IScanner)
+    def set_base_logger(self, base_logger: logging.Logger):
+        self.logger = base_logger.getChild(self.__class__.__name__)
+        self.__scanner.set_base_logger(self.logger)
+
+    def set_active_files(self, file_names: List[str]):
+        """
+        Set the list of active remote file names. Only these files will be scanned.
+        :param file_names:
+        :return:
+        """
+        self.__active_files_queue.put(file_names)
+
+    @overrides(IScanner)
+    def scan(self) -> Optional[List[SystemFile]]:
+        # Grab the latest list of active files, if any
+        try:
+            while True:
+                self.__active_files = self.__active_files_queue.get(block=False)
+        except queue.Empty:
+            pass
+
+        if not self.__active_files:
+            return []
+        return self.__scanner.scan_roots(self.__active_files)
@@ -1,22 +1,55 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
 import logging
-import pickle
-from typing import List
+from typing import List, Dict, Callable, Tuple
 import os
 from typing import Optional
 import hashlib
+import shlex
+import time
 
-from .scanner_process import IScanner, ScannerError
+from .scanner_process import IWatchingScanner, ScannerError
 from common import overrides, Localization
-from ssh import Sshcp, SshcpError
-from system import SystemFile
+from ssh import Sshcp, SshcpError, SshcpChannel
+from system import SystemFile, WireFormat, WireFormatDecoder, WireFormatError, \
+    ScanAgentError, ScanAgentResponseReader, ScanRequest, ScanWatcherError, ScanWatcherReader
 
 
-class RemoteScanner(IScanner):
+class RemoteScanner(IWatchingScanner):
     """
     Scanner implementation to scan the remote filesystem
+
+    The scan output is compressed by the remote scanfs. The compression is
+    negotiated on the first scan: if the remote side cannot provide the
+    requested compression it falls back to uncompressed output, and later
+    scans stop asking for it.
+
+    In delta mode, the remote scanfs keeps a snapshot of the previous scan
+    in a state file next to it, and only sends the roots that changed since
+    the generation held by this scanner. The delta is applied to the cached
+    roots, and the full list is returned. The remote side sends a full scan
+    whenever the generations do not match.
+
+    The remote scanfs also keeps its directory cache in a file next to it,
+    so that directories that did not change are not walked again.
+
+    In agent mode, scanfs is started once as a scan agent (see ScanAgent),
+    and each scan is a request to it. This saves the startup of scanfs on
+    every scan. The agent is restarted if its channel drops. If it cannot be
+    started, scans run scanfs on its own.
+
+    In watch mode, scanfs also runs as a watcher (see ScanWatcher) that
+    reports changes on the remote side as they happen, so that the scanner
+    process scans right away instead of at the next interval. The periodic
+    scans remain, and are all that is left if the watcher cannot run.
     """
+    # Amount of the scan output to log when it cannot be decoded
+    __ERROR_OUTPUT_SIZE = 1024
+    # Agent output is read in chunks of this size
+    __AGENT_READ_SIZE = 64 * 1024
+    # Time before restarting a watcher that failed or dropped
+    __WATCH_RETRY_INTERVAL_IN_SECS = 60
+
     def __init__(self,
                  remote_address: str,
                  remote_username: str,
@@ -24,7 +57,26 @@ class RemoteScanner(IScanner):
                  remote_port: int,
                  remote_path_to_scan: str,
                  local_path_to_scan_script: str,
-                 remote_path_to_scan_script: str):
+                 remote_path_to_scan_script: str,
+                 compression: str = WireFormat.COMPRESSION_ZLIB,
+                 compression_level: int = 6,
+                 delta: bool = True,
+                 agent: bool = True,
+                 watch: bool = False,
+                 watch_poll_interval_in_ms: Optional[int] = None,
+                 cache: bool = True):
+        """
+        :param compression: compression requested for the scan output, one of WireFormat.COMPRESSION_*
+        :param compression_level: compression level, 0-9
+        :param delta: whether to request delta scans
+        :param agent: whether to scan through a long-running scan agent
+        :param watch: whether to watch for remote changes between scans
+        :param watch_poll_interval_in_ms: interval of the watcher's own scans if the remote
+                                          side has no inotify, None for the scanfs default
+        :param cache: whether the remote scanfs keeps a directory cache between runs
+        """
+        if compression not in WireFormat.supported_compressions():
+            raise ValueError("Unsupported compression: {}".format(compression))
         self.logger = logging.getLogger("RemoteScanner")
         self.__remote_path_to_scan = remote_path_to_scan
         self.__local_path_to_scan_script = local_path_to_scan_script
@@ -34,27 +86,159 @@ class RemoteScanner(IScanner):
                            user=remote_username,
                            password=remote_password)
         self.__first_run = True
+        # Whether the remote scanfs is known to match the local one
+        self.__scanfs_verified = False
+        self.__compression = compression
+        self.__compression_negotiated = False
+        self.__compression_level = compression_level
+        self.__delta = delta
+        # Generation and roots of the last scan, used to apply deltas
+        self.__generation = None  # type: Optional[str]
+        self.__remote_files = dict()  # type: Dict[str, SystemFile]
+        self.__agent = agent
+        self.__agent_channel = None  # type: Optional[SshcpChannel]
+        self.__agent_reader = None  # type: Optional[ScanAgentResponseReader]
+        # Watch mode state
+        # Note: the watcher is only started on a scan, so that it belongs to
+        #       the scanner process
+        self.__watch = watch
+        self.__watch_poll_interval_in_ms = watch_poll_interval_in_ms
+        self.__watch_channel = None  # type: Optional[SshcpChannel]
+        self.__watch_reader = None  # type: Optional[ScanWatcherReader]
+        self.__watch_retry_time = 0.0
+        self.__changes_pending = False
 
         # Append scan script name to remote path if not there already
         script_name = os.path.basename(self.__local_path_to_scan_script)
         if os.path.basename(self.__remote_path_to_scan_script) != script_name:
             self.__remote_path_to_scan_script = os.path.join(self.__remote_path_to_scan_script, script_name)
+        self.__remote_path_to_delta_state = self.__remote_path_to_scan_script + ".state"
+        self.__remote_path_to_cache = self.__remote_path_to_scan_script + ".cache" if cache else None
 
-    @overrides(IScanner)
+    @overrides(IWatchingScanner)
     def set_base_logger(self, base_logger: logging.Logger):
         self.logger = base_logger.getChild("RemoteScanner")
         self.__ssh.set_base_logger(self.logger)
 
-    @overrides(IScanner)
+    @overrides(IWatchingScanner)
     def scan(self) -> List[SystemFile]:
         if self.__first_run:
             self._install_scanfs()
+            self.__scanfs_verified = True
+        if self.__watch and self.__watch_channel is None and time.monotonic() >= self.__watch_retry_time:
+            self.__start_watching()
+        # This scan covers any change reported so far
+        self.__changes_pending = False
 
-        try:
-            out = self.__ssh.shell("'{}' '{}'".format(
-                self.__remote_path_to_scan_script,
-                self.__remote_path_to_scan)
+        command = self.__scan_command()
+        if self.__remote_path_to_cache is not None:
+            command += " --cache '{}'".format(self.__remote_path_to_cache)
+        if self.__delta:
+            command += " --delta-state '{}'".format(self.__remote_path_to_delta_state)
+            if self.__generation is not None:
+                command += " --since {}".format(self.__generation)
+        request = ScanRequest(compression=self.__compression,
+                              compression_level=self.__compression_level,
+                              since=self.__generation if self.__delta else None)
+        decoder, remote_files = self.__run_scan(command, request, partial=False)
+
+        if decoder.base_generation is None:
+            self.__remote_files = {remote_file.name: remote_file for remote_file in remote_files}
+        elif decoder.base_generation == self.__generation:
+            for name in decoder.removed_names:
+                self.__remote_files.pop(name, None)
+            for remote_file in remote_files:
+                self.__remote_files[remote_file.name] = remote_file
+            self.logger.debug("Applied scan delta: {} changed, {} removed".format(
+                len(remote_files), len(decoder.removed_names)
+            ))
+        else:
+            # Should not happen, the remote only sends deltas against our generation
+            self.__generation = None
+            raise ScannerError(
+                Localization.Error.REMOTE_SERVER_SCAN.format("Scan delta does not match the previous scan"),
+                recoverable=True
+            )
+        self.__generation = decoder.generation
+
+        self.__first_run = False
+        return sorted(self.__remote_files.values(), key=lambda f: f.name)
+
+    def scan_roots(self, names: List[str]) -> Optional[List[SystemFile]]:
+        """
+        Scan only the named roots
+        Roots that no longer exist are left out, the next full scan reports
+        their removal. Errors are always recoverable, and the roots held for
+        delta scans are not affected.
+        Note: scanfs is installed by the full scans, so that two scanners do
+              not copy it to the same remote path at once. The roots are not
+              scanned until the remote scanfs matches the local one.
+        :param names:
+        :return: None if the remote scanfs is not installed yet
+        """
+        if not self.__scanfs_verified:
+            try:
+                installed = self.__is_scanfs_installed()
+            except SshcpError as e:
+                self.logger.warning("Skipping root scan, failed to check the remote scanfs: {}".format(str(e)))
+                return None
+            if not installed:
+                self.logger.info("Skipping root scan until the full scan installs the remote scanfs")
+                return None
+            self.__scanfs_verified = True
+
+        command = self.__scan_command() + "".join(" --root={}".format(shlex.quote(name)) for name in names)
+        request = ScanRequest(compression=self.__compression,
+                              compression_level=self.__compression_level,
+                              roots=names)
+        _, remote_files = self.__run_scan(command, request, partial=True)
+        return sorted(remote_files, key=lambda f: f.name)
+
+    def __scan_command(self) -> str:
+        command = "'{}' '{}'".format(
+            self.__remote_path_to_scan_script,
+            self.__remote_path_to_scan
+        )
+        if self.__compression != WireFormat.COMPRESSION_NONE:
+            command += " --compression {} --compression-level {}".format(
+                self.__compression,
+                self.__compression_level
             )
+        return command
+
+    def __run_scan(self,
+                   command: str,
+                   request: ScanRequest,
+                   partial: bool) -> Tuple[WireFormatDecoder, List[SystemFile]]:
+        """
+        Run a scan through the agent, or else scanfs on its own
+        :param command: scanfs command, used without the agent
+        :param request: scan request, used with the agent
+        :param partial: whether only some of the roots are scanned
+        :return: the decoder of the output, and the decoded roots
+        """
+        # The output is decoded while it arrives, so only the roots being
+        # received are held as raw bytes
+        decoder = WireFormatDecoder()
+        remote_files = []
+        out_head = bytearray()
+        decode_time_in_s = 0.0
+
+        def consume(data: bytes):
+            nonlocal decode_time_in_s
+            if len(out_head) < RemoteScanner.__ERROR_OUTPUT_SIZE:
+                out_head.extend(data[:RemoteScanner.__ERROR_OUTPUT_SIZE - len(out_head)])
+            timestamp_feed = time.time()
+            try:
+                remote_files.extend(decoder.feed(data))
+            finally:
+                decode_time_in_s += time.time() - timestamp_feed
+
+        timestamp_start = time.time()
+        try:
+            if not self.__scan_with_agent(request, consume):
+                self.__ssh.shell_stream(command, consume)
+            decoder.close()
         except SshcpError as e:
             self.logger.warning("Caught an SshcpError: {}".format(str(e)))
             recoverable = True
@@ -65,32 +249,200 @@ class RemoteScanner(IScanner):
             # User should be prompted to correct these
             if self.__first_run:
                 recoverable = False
+            # Persistent errors are left for the full scans to report
+            if partial:
+                recoverable = True
             raise ScannerError(
                 Localization.Error.REMOTE_SERVER_SCAN.format(str(e).strip()),
                 recoverable=recoverable
             )
-
-        try:
-            remote_files = pickle.loads(out)
-        except pickle.UnpicklingError as err:
-            self.logger.error("Unpickling error: {}\n{}".format(str(err), out))
+        except (WireFormatError, ScanAgentError) as err:
+            self.logger.error("Scan data decode error: {}\n{}".format(str(err), bytes(out_head)))
             raise ScannerError(
-                Localization.Error.REMOTE_SERVER_SCAN.format("Invalid pickled data"),
-                recoverable=False
+                Localization.Error.REMOTE_SERVER_SCAN.format("Invalid scan data"),
+                recoverable=partial
             )
+        total_time_in_s = time.time() - timestamp_start
+        self.__log_transfer_stats(decoder, total_time_in_s, decode_time_in_s)
 
-        self.__first_run = False
-        return remote_files
+        if not self.__compression_negotiated and decoder.compression != self.__compression:
+            self.logger.info("Remote scanfs does not support {} compression, using {}".format(
+                self.__compression, decoder.compression
+            ))
+            self.__compression = decoder.compression
+        self.__compression_negotiated = True
+        return decoder, remote_files
 
-    def _install_scanfs(self):
-        # Check md5sum on remote to see if we can skip installation
+    @overrides(IWatchingScanner)
+    def is_watching(self) -> bool:
+        return self.__watch_channel is not None
+
+    @overrides(IWatchingScanner)
+    def wait_for_changes(self, timeout_in_s: float) -> bool:
+        if self.__changes_pending:
+            return True
+        if self.__watch_channel is None:
+            time.sleep(timeout_in_s)
+            return False
+        try:
+            data = self.__watch_channel.read_available(RemoteScanner.__AGENT_READ_SIZE, timeout_in_s)
+            notifications = self.__watch_reader.feed(data)
+        except (SshcpError, ScanWatcherError) as e:
+            self.logger.warning("Lost the remote watcher, falling back to periodic scans: {}".format(str(e)))
+            self.__stop_watching()
+            return False
+        for changed in notifications:
+            self.logger.debug("Remote changes in: {}".format(", ".join(changed)))
+            self.__changes_pending = True
+        return self.__changes_pending
+
+    def __start_watching(self):
+        command = "'{}' '{}' --watch".format(
+            self.__remote_path_to_scan_script,
+            self.__remote_path_to_scan
+        )
+        if self.__watch_poll_interval_in_ms is not None:
+            command += " --poll-interval {}".format(self.__watch_poll_interval_in_ms / 1000)
+        try:
+            channel = self.__ssh.open_channel(command)
+        except SshcpError as e:
+            self.logger.warning("Failed to start the remote watcher: {}".format(str(e)))
+            self.__watch_retry_time = time.monotonic() + RemoteScanner.__WATCH_RETRY_INTERVAL_IN_SECS
+            return
+        reader = ScanWatcherReader()
+        try:
+            while not reader.has_hello:
+                reader.feed(channel.read(RemoteScanner.__AGENT_READ_SIZE))
+        except (SshcpError, ScanWatcherError) as e:
+            self.logger.warning("Failed to start the remote watcher: {}".format(str(e)))
+            channel.close()
+            self.__watch_retry_time = time.monotonic() + RemoteScanner.__WATCH_RETRY_INTERVAL_IN_SECS
+            return
+        self.logger.info("Watching the remote directory for changes")
+        self.__watch_channel = channel
+        self.__watch_reader = reader
+
+    def __stop_watching(self):
+        if self.__watch_channel is not None:
+            self.__watch_channel.close()
+        self.__watch_channel = None
+        self.__watch_reader = None
+        self.__watch_retry_time = time.monotonic() + RemoteScanner.__WATCH_RETRY_INTERVAL_IN_SECS
+
+    def __scan_with_agent(self, request: ScanRequest, consumer: Callable[[bytes], None]) -> bool:
+        """
+        Run a scan through the scan agent, starting it if needed
+        :param request:
+        :param consumer: called with each part of the scan output
+        :return: False if the agent is not available, and scanfs should run on its own
+        """
+        if not self.__agent:
+            return False
+
+        received = False
+
+        def consume(data: bytes):
+            nonlocal received
+            received = True
+            consumer(data)
+
+        while True:
+            if self.__agent_channel is None:
+                try:
+                    self.__start_agent()
+                except SshcpError as e:
+                    self.logger.warning("Failed to start the scan agent: {}".format(str(e)))
+                    return False
+                except ScanAgentError as e:
+                    # Not a transient error, the remote scanfs does not speak the same protocol
+                    self.logger.warning("Disabling the scan agent: {}".format(str(e)))
+                    self.__agent = False
+                    return False
+                restarted = True
+            else:
+                restarted = False
+            try:
+                self.__agent_reader.start_response(consume)
+                self.__agent_channel.send(request.to_line())
+                while not self.__agent_reader.done:
+                    self.__agent_reader.feed(self.__agent_channel.read(RemoteScanner.__AGENT_READ_SIZE))
+            except SshcpError as e:
+                self.__stop_agent()
+                # A dropped channel is retried with a new agent, unless part of
+                # the output was already consumed
+                if received or restarted:
+                    raise
+                self.logger.warning("Lost the scan agent, restarting it: {}".format(str(e)))
+                continue
+            except Exception:
+                # The agent's output can no longer be followed
+                self.__stop_agent()
+                raise
+            if self.__agent_reader.error is not None:
+                raise SshcpError(self.__agent_reader.error)
+            return True
+
+    def __start_agent(self):
+        command = "'{}' '{}' --agent".format(
+            self.__remote_path_to_scan_script,
+            self.__remote_path_to_scan
+        )
+        if self.__remote_path_to_cache is not None:
+            command += " --cache '{}'".format(self.__remote_path_to_cache)
+        if self.__delta:
+            command += " --delta-state '{}'".format(self.__remote_path_to_delta_state)
+        self.logger.info("Starting the scan agent")
+        channel = self.__ssh.open_channel(command)
+        reader = ScanAgentResponseReader()
+        try:
+            while not reader.has_hello:
+                reader.feed(channel.read(RemoteScanner.__AGENT_READ_SIZE))
+        except Exception:
+            channel.close()
+            raise
+        self.__agent_channel = channel
+        self.__agent_reader = reader
+
+    def __stop_agent(self):
+        if self.__agent_channel is not None:
+            self.__agent_channel.close()
+        self.__agent_channel = None
+        self.__agent_reader = None
+
+    def __log_transfer_stats(self, decoder: WireFormatDecoder, total_time_in_s: float, decode_time_in_s: float):
+        # Note: decoding overlaps with the transfer, so the total time is not the sum of the two
+        if decoder.compression == WireFormat.COMPRESSION_NONE:
+            self.logger.debug("Scan output of {} bytes took {:.3f}s, of which {:.3f}s decoding".format(
+                decoder.num_bytes_received, total_time_in_s, decode_time_in_s
+            ))
+            return
+        ratio = decoder.num_bytes_decoded / max(decoder.num_bytes_received, 1)
+        self.logger.debug("Scan output of {} bytes ({} uncompressed, {} ratio {:.2f}) took {:.3f}s, "
+                          "of which {:.3f}s decoding".format(
+                              decoder.num_bytes_received,
+                              decoder.num_bytes_decoded,
+                              decoder.compression,
+                              ratio,
+                              total_time_in_s,
+                              decode_time_in_s
+                          ))
+
+    def __is_scanfs_installed(self) -> bool:
+        """
+        Check whether the remote scanfs matches the local one, by md5sum
+        Raises SshcpError if the check fails
+        :return:
+        """
         with open(self.__local_path_to_scan_script, "rb") as f:
             local_md5sum = hashlib.md5(f.read()).hexdigest()
         self.logger.debug("Local scanfs md5sum = {}".format(local_md5sum))
+        out = self.__ssh.shell("md5sum {} | awk '{{print $1}}' || echo".format(self.__remote_path_to_scan_script))
+        return out.decode() == local_md5sum
+
+    def _install_scanfs(self):
+        # Check md5sum on remote to see if we can skip installation
         try:
-            out = self.__ssh.shell("md5sum {} | awk '{{print $1}}' || echo".format(self.__remote_path_to_scan_script))
-            out = out.decode()
-            if out == local_md5sum:
+            if self.__is_scanfs_installed():
                 self.logger.info("Skipping remote scanfs installation: already installed")
                 return
         except SshcpError as e:
@@ -0,0 +1,131 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+from abc import ABC, abstractmethod
+import random
+
+from common import overrides
+
+
+class IScanSchedule(ABC):
+    """
+    Policy for the interval between the scans of a scanner process
+    The schedule lives in the scanner process, and is told about the outcome
+    of every scan.
+    """
+    @abstractmethod
+    def on_scan(self, changed: bool):
+        """
+        Called after every scan
+        :param changed: whether the result differs from the previous one
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def reset(self):
+        """
+        Called when a scan is forced, e.g. after a command changed the files
+        :return:
+        """
+        pass
+
+    @abstractmethod
+    def get_interval_in_ms(self) -> int:
+        """Returns the current interval, without jitter"""
+        pass
+
+    @abstractmethod
+    def get_wait_time_in_ms(self) -> int:
+        """Returns the time to wait for the next scan, with jitter"""
+        pass
+
+
+class _JitteredScanSchedule(IScanSchedule, ABC):
+    """
+    Base for schedules that spread their wait times randomly around the
+    interval, so that the scanner processes do not all wake at once
+    """
+    def __init__(self, jitter: float):
+        """
+        :param jitter: fraction of the interval that the wait time randomly varies by, 0-1
+        """
+        if not 0.0 <= jitter <= 1.0:
+            raise ValueError("Jitter must be between 0 and 1")
+        self.__jitter = jitter
+        self.__random = random.Random()
+
+    @overrides(IScanSchedule)
+    def get_wait_time_in_ms(self) -> int:
+        interval_in_ms = self.get_interval_in_ms()
+        if self.__jitter == 0.0:
+            return interval_in_ms
+        return int(interval_in_ms * self.__random.uniform(1.0 - self.__jitter, 1.0 + self.__jitter))
+
+
+class FixedScanSchedule(_JitteredScanSchedule):
+    """
+    Schedule with a constant interval
+    """
+    def __init__(self, interval_in_ms: int, jitter: float = 0.0):
+        """
+        :param interval_in_ms: interval between scans
+        :param jitter: fraction of the interval that the wait time randomly varies by, 0-1
+        """
+        super().__init__(jitter)
+        self.__interval_in_ms = interval_in_ms
+
+    @overrides(IScanSchedule)
+    def on_scan(self, changed: bool):
+        pass
+
+    @overrides(IScanSchedule)
+    def reset(self):
+        pass
+
+    @overrides(IScanSchedule)
+    def get_interval_in_ms(self) -> int:
+        return self.__interval_in_ms
+
+
+class AdaptiveScanSchedule(_JitteredScanSchedule):
+    """
+    Schedule that backs off while nothing changes
+    The interval grows by a factor after every scan with an unchanged result,
+    up to a maximum. It snaps back to the minimum after a change or a reset.
+    """
+    def __init__(self,
+                 min_interval_in_ms: int,
+                 max_interval_in_ms: int,
+                 backoff_factor: float = 2.0,
+                 jitter: float = 0.1):
+        """
+        :param min_interval_in_ms: interval after a change
+        :param max_interval_in_ms: longest interval
+        :param backoff_factor: growth of the interval after each unchanged scan
+        :param jitter: fraction of the interval that the wait time randomly varies by, 0-1
+        """
+        super().__init__(jitter)
+        if min_interval_in_ms > max_interval_in_ms:
+            raise ValueError("Min interval cannot be greater than max interval")
+        if backoff_factor < 1.0:
+            raise ValueError("Backoff factor cannot be less than 1")
+        self.__min_interval_in_ms = min_interval_in_ms
+        self.__max_interval_in_ms = max_interval_in_ms
+        self.__backoff_factor = backoff_factor
+        self.__interval_in_ms = min_interval_in_ms
+
+    @overrides(IScanSchedule)
+    def on_scan(self, changed: bool):
+        if changed:
+            self.__interval_in_ms = self.__min_interval_in_ms
+        else:
+            self.__interval_in_ms = min(int(self.__interval_in_ms * self.__backoff_factor),
+                                        self.__max_interval_in_ms)
+
+    @overrides(IScanSchedule)
+    def reset(self):
+        self.__interval_in_ms = self.__min_interval_in_ms
+
+    @overrides(IScanSchedule)
+    def get_interval_in_ms(self) -> int:
+        return self.__interval_in_ms
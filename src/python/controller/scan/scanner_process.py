@@ -1,14 +1,20 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
+import copy
+import hashlib
 import logging
 from abc import ABC, abstractmethod
 import multiprocessing
 from datetime import datetime
 from typing import List, Optional
 import queue
+import struct
+import time
 
 from common import overrides, AppProcess, AppError
 from system import SystemFile
+from .scan_schedule import IScanSchedule, FixedScanSchedule
+from .shared_files import SharedScanFiles
 
 
 class ScannerError(AppError):
@@ -29,8 +35,11 @@ class IScanner(ABC):
     This hides the scanning implementation from the scanner process.
     """
     @abstractmethod
-    def scan(self) -> List[SystemFile]:
-        """Scan system"""
+    def scan(self) -> Optional[List[SystemFile]]:
+        """
+        Scan system
+        Returns None if the scanner knows that nothing changed since the previous scan
+        """
         pass
 
     @abstractmethod
@@ -38,38 +47,146 @@ class IScanner(ABC):
         pass
 
 
+class IWatchingScanner(IScanner):
+    """
+    Interface for a scanner that can detect changes on its own.
+    The scanner process waits on the scanner instead of sleeping through
+    the whole interval, so that changes are scanned as soon as they happen.
+    """
+    @abstractmethod
+    def is_watching(self) -> bool:
+        """Returns true if the scanner is currently able to detect changes"""
+        pass
+
+    @abstractmethod
+    def wait_for_changes(self, timeout_in_s: float) -> bool:
+        """
+        Block until a change is detected or the timeout expires
+        Returns true if a change was detected
+        """
+        pass
+
+
 class ScannerResult:
     """
     Results of a system scan
+    An unchanged result is a marker that carries no files. It means that the
+    files are the same as in the previous result, which was not a failure.
+    The files can also be held in shared memory, in which case they are
+    decoded on first access.
     """
     def __init__(self,
                  timestamp: datetime,
-                 files: List[SystemFile],
+                 files: Optional[List[SystemFile]],
                  failed: bool = False,
-                 error_message: str = None):
+                 error_message: str = None,
+                 unchanged: bool = False,
+                 shared_files: Optional[SharedScanFiles] = None):
         self.timestamp = timestamp
-        self.files = files
+        self.__files = files
+        self.__shared_files = shared_files
         self.failed = failed
         self.error_message = error_message
+        self.unchanged = unchanged
+
+    @property
+    def files(self) -> List[SystemFile]:
+        if self.__shared_files is not None:
+            self.__files = self.__shared_files.load()
+            self.__shared_files = None
+        return self.__files
+
+    def discard(self):
+        """
+        Free the shared memory of a result whose files are not going to be read
+        :return:
+        """
+        if self.__shared_files is not None:
+            self.__shared_files.discard()
+            self.__shared_files = None
+
+
+_FINGERPRINT_NODE = struct.Struct(">?qqqI")
+_FINGERPRINT_BUFFER_SIZE = 64 * 1024
+
+
+def _fingerprint(files: List[SystemFile]) -> bytes:
+    """
+    Streaming hash over a tree of files
+    :param files:
+    :return:
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = bytearray()
+    # Children are pushed in reverse so that the tree is hashed in order
+    stack = list(reversed(files))
+    digest.update(_FINGERPRINT_NODE.pack(False, 0, 0, 0, len(files)))
+    while stack:
+        file = stack.pop()
+        children = file.children
+        name = file.name.encode("utf-8", "surrogatepass")
+        buffer += _FINGERPRINT_NODE.pack(
+            file.is_dir,
+            file.size,
+            file.timestamp_created_ns if file.timestamp_created_ns is not None else -1,
+            file.timestamp_modified_ns if file.timestamp_modified_ns is not None else -1,
+            len(children)
+        )
+        buffer += struct.pack(">I", len(name))
+        buffer += name
+        if len(buffer) >= _FINGERPRINT_BUFFER_SIZE:
+            digest.update(buffer)
+            buffer.clear()
+        stack.extend(reversed(children))
+    digest.update(buffer)
+    return digest.digest()
 
 
 class ScannerProcess(AppProcess):
     """
     Process to scan a file system and publish the result
     """
+    # Max time to block on a watching scanner before checking for a wake event
+    __WATCH_POLL_INTERVAL_IN_S = 0.5
+    # Default time between a detected change and its scan
+    __DEFAULT_CHANGE_DELAY_IN_MS = 250
+
     def __init__(self,
-                 scanner: IScanner, interval_in_ms: int,
-                 verbose: bool = True):
+                 scanner: IScanner, interval_in_ms: Optional[int] = None,
+                 verbose: bool = True,
+                 schedule: Optional[IScanSchedule] = None,
+                 shared_memory: bool = False,
+                 change_delay_in_ms: int = __DEFAULT_CHANGE_DELAY_IN_MS):
         """
         Create a scanner process
         :param scanner: IScanner implementation
-        :param interval_in_ms: Minimum interval (in ms) between results
+        :param interval_in_ms: Minimum interval (in ms) between results, for a fixed schedule
+        :param schedule: Policy for the interval between results, instead of interval_in_ms
+        :param shared_memory: Whether to pass the files of results through shared memory,
+                              which saves copying large results through the queue
+        :param change_delay_in_ms: Time (in ms) between a change detected by a watching
+                                   scanner and its scan, so that a burst of changes is
+                                   scanned once
         """
         super().__init__(name=scanner.__class__.__name__)
+        if (interval_in_ms is None) == (schedule is None):
+            raise ValueError("Exactly one of interval_in_ms and schedule must be given")
         self.__queue = multiprocessing.Queue()
         self.__wake_event = multiprocessing.Event()
+        # Set along with the wake event when a scan is forced, and cleared by the process
+        self.__reset_event = multiprocessing.Event()
         self.__scanner = scanner
-        self.__interval_in_ms = interval_in_ms
+        self.__schedule = schedule if schedule is not None else FixedScanSchedule(interval_in_ms)
+        # Current interval of the schedule, shared so that other processes can observe it
+        self.__current_interval_in_ms = multiprocessing.Value('i', self.__schedule.get_interval_in_ms())
+        # Fingerprint of the files of the previous result, None if it failed
+        self.__prev_fingerprint = None  # type: Optional[bytes]
+        self.__prev_error_message = None  # type: Optional[str]
+        self.__shared_memory = shared_memory
+        self.__change_delay_in_s = change_delay_in_ms / 1000.0
+        self.__num_shared_results = 0
+        if shared_memory:
+            SharedScanFiles.prepare()
         self.verbose = verbose
 
     @overrides(AppProcess)
@@ -86,10 +203,30 @@ class ScannerProcess(AppProcess):
         timestamp_start = datetime.now()
         if self.verbose:
             self.logger.debug("Running a scan")
+        # Results that did not change are published as a marker, which saves
+        # pickling the files, and comparing them on the other side
         try:
             files = self.__scanner.scan()
-            result = ScannerResult(timestamp=timestamp_start,
-                                   files=files)
+            if files is None:
+                # Scanner knows that nothing changed
+                changed = False
+            else:
+                fingerprint = _fingerprint(files)
+                changed = fingerprint != self.__prev_fingerprint
+                self.__prev_fingerprint = fingerprint
+                self.__prev_error_message = None
+            if changed and self.__shared_memory:
+                self.__num_shared_results += 1
+                result = ScannerResult(timestamp=timestamp_start,
+                                       files=None,
+                                       shared_files=SharedScanFiles.create(files, self.__num_shared_results))
+            elif changed:
+                result = ScannerResult(timestamp=timestamp_start, files=files)
+            elif self.__prev_fingerprint is not None:
+                result = ScannerResult(timestamp=timestamp_start, files=[], unchanged=True)
+            else:
+                # Nothing was published yet that the marker could refer to
+                result = None
         except ScannerError as e:
             # Non-recoverable errors continue up as a fatal error
             if not e.recoverable:
@@ -98,33 +235,91 @@ class ScannerProcess(AppProcess):
                                    files=[],
                                    failed=True,
                                    error_message=str(e))
-        self.__queue.put(result)
+            changed = self.__prev_error_message != result.error_message
+            self.__prev_fingerprint = None
+            self.__prev_error_message = result.error_message
+        if result is not None:
+            self.__queue.put(result)
         delta_in_s = (datetime.now() - timestamp_start).total_seconds()
         delta_in_ms = int(delta_in_s * 1000)
         if self.verbose:
             self.logger.debug("Scan took {:.3f}s".format(delta_in_s))
 
+        if self.__reset_event.is_set():
+            self.__reset_event.clear()
+            self.__schedule.reset()
+        else:
+            self.__schedule.on_scan(changed=changed)
+        self.__current_interval_in_ms.value = self.__schedule.get_interval_in_ms()
+
         # Wait until the next interval, or until a wake event is fired
-        if delta_in_ms < self.__interval_in_ms:
-            wait_time_in_s = float(self.__interval_in_ms - delta_in_ms) / 1000.0
-            self.__wake_event.wait(timeout=wait_time_in_s)
+        # A watching scanner also ends the wait shortly after it detects a change
+        interval_in_ms = self.__schedule.get_wait_time_in_ms()
+        if delta_in_ms < interval_in_ms:
+            wait_time_in_s = float(interval_in_ms - delta_in_ms) / 1000.0
+            if isinstance(self.__scanner, IWatchingScanner) and self.__scanner.is_watching():
+                if self.__wait_for_changes(wait_time_in_s):
+                    # Let the rest of a burst of changes in, e.g. the files of an extraction
+                    self.__wake_event.wait(timeout=self.__change_delay_in_s)
+            else:
+                self.__wake_event.wait(timeout=wait_time_in_s)
             self.__wake_event.clear()
 
+    def __wait_for_changes(self, wait_time_in_s: float) -> bool:
+        """
+        Wait on the watching scanner
+        Returns true if it detected a change
+        """
+        timestamp_end = time.monotonic() + wait_time_in_s
+        while not self.__wake_event.is_set() and not self._terminate.is_set():
+            remaining_in_s = timestamp_end - time.monotonic()
+            if remaining_in_s <= 0:
+                break
+            if self.__scanner.wait_for_changes(min(remaining_in_s, ScannerProcess.__WATCH_POLL_INTERVAL_IN_S)):
+                return True
+        return False
+
     def pop_latest_result(self) -> Optional[ScannerResult]:
         """
         Process-safe method to retrieve latest scan result
         Returns None if no new scan result was generated since the last time
         this method was called
+        An unchanged result is only returned if the previous result was returned
+        by an earlier call.
         :return:
         """
         latest_scan = None
         try:
             while True:
-                latest_scan = self.__queue.get(block=False)
+                result = self.__queue.get(block=False)
+                if result.unchanged and latest_scan is not None:
+                    # Keep the files of the result that is not returned yet
+                    latest_scan = copy.copy(latest_scan)
+                    latest_scan.timestamp = result.timestamp
+                else:
+                    if latest_scan is not None:
+                        latest_scan.discard()
+                    latest_scan = result
         except queue.Empty:
             pass
         return latest_scan
 
+    @overrides(AppProcess)
+    def terminate(self):
+        super().terminate()
+        # Free the shared memory of the results that were never read
+        latest_scan = self.pop_latest_result()
+        if latest_scan is not None:
+            latest_scan.discard()
+
     def force_scan(self):
-        """Force process to wake and do an immediate scan"""
+        """Force process to wake and do an immediate scan, and reset its schedule"""
+        self.__reset_event.set()
         self.__wake_event.set()
+
+    def get_interval_in_ms(self) -> int:
+        """
+        Process-safe method to retrieve the current interval of the schedule
+        :return:
+        """
+        return self.__current_interval_in_ms.value
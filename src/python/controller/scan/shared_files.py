@@ -0,0 +1,136 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import gc
+import pickle
+import struct
+from multiprocessing import shared_memory, resource_tracker
+from typing import List
+
+from common import AppError
+from system import SystemFile, WireFormat, WireFormatError
+
+
+class SharedFilesError(AppError):
+    """
+    Indicates that shared scan files could not be read
+    """
+    pass
+
+
+class SharedScanFiles:
+    """
+    Files of a scan result, placed in a shared memory segment by the scanner
+    process so that only this small descriptor goes through the result queue
+
+    The segment belongs to whoever holds the descriptor. The reader must
+    either load() or discard() it, both of which free the segment.
+
+    Segment layout: header (generation, payload size), then the encoded files
+    The generation guards against reading a segment of another result.
+
+    The files are pickled by default. The wire format of the remote scans is
+    about a third of the size, but takes several times longer to decode in
+    the reader, whose time is what the segment is meant to save
+    (see benchmarks/scan_result_transport.py).
+    """
+    ENCODING_PICKLE = "pickle"
+    ENCODING_WIRE = "wire"
+
+    __HEADER = struct.Struct(">QQ")
+
+    def __init__(self, name: str, size: int, generation: int, encoding: str = ENCODING_PICKLE):
+        self.name = name
+        self.size = size
+        self.generation = generation
+        self.encoding = encoding
+
+    @staticmethod
+    def prepare():
+        """
+        Must be called in the reader process before the writer processes are
+        forked, so that they all share its resource tracker
+        Segments are then only tracked until the reader frees them, and the
+        ones that are never read are still freed on exit.
+        :return:
+        """
+        resource_tracker.ensure_running()
+
+    @staticmethod
+    def create(files: List[SystemFile], generation: int, encoding: str = ENCODING_PICKLE) -> "SharedScanFiles":
+        """
+        Place files in a new segment
+        :param files:
+        :param generation: number of the result, unique to the writer
+        :param encoding: one of ENCODING_*
+        :return:
+        """
+        if encoding == SharedScanFiles.ENCODING_PICKLE:
+            data = pickle.dumps(files, protocol=pickle.HIGHEST_PROTOCOL)
+        elif encoding == SharedScanFiles.ENCODING_WIRE:
+            data = WireFormat.encode(files)
+        else:
+            raise ValueError("Unsupported encoding: {}".format(encoding))
+        header_size = SharedScanFiles.__HEADER.size
+        shm = shared_memory.SharedMemory(create=True, size=header_size + len(data))
+        try:
+            SharedScanFiles.__HEADER.pack_into(shm.buf, 0, generation, len(data))
+            shm.buf[header_size:header_size + len(data)] = data
+            name = shm.name
+        finally:
+            shm.close()
+        return SharedScanFiles(name, len(data), generation, encoding)
+
+    def load(self) -> List[SystemFile]:
+        """
+        Decode the files straight from the segment, and free it
+        :return:
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except OSError as e:
+            raise SharedFilesError("Failed to open shared scan files {}: {}".format(self.name, str(e)))
+        try:
+            header_size = SharedScanFiles.__HEADER.size
+            generation, size = SharedScanFiles.__HEADER.unpack_from(shm.buf, 0)
+            if generation != self.generation or size != self.size:
+                raise SharedFilesError("Shared scan files {} do not match generation {}".format(
+                    self.name, self.generation
+                ))
+            # The tree has no reference cycles, so the collector would only slow
+            # down the creation of its objects
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                with shm.buf[header_size:header_size + size] as view:
+                    if self.encoding == SharedScanFiles.ENCODING_WIRE:
+                        return WireFormat.decode(view)
+                    return pickle.loads(view)
+            except WireFormatError as e:
+                raise SharedFilesError("Failed to decode shared scan files {}: {}".format(self.name, str(e)))
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        finally:
+            shm.close()
+            SharedScanFiles.__unlink(shm)
+
+    def discard(self):
+        """
+        Free the segment without reading it
+        :return:
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except OSError:
+            # Already gone
+            return
+        shm.close()
+        SharedScanFiles.__unlink(shm)
+
+    @staticmethod
+    def __unlink(shm: shared_memory.SharedMemory):
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            # Freed by someone else in the meantime
+            pass
@@ -1,5 +1,7 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
-from .model import Model, IModelListener, ModelError
+from .model import Model, IModelListener, ModelError, ModelSnapshot
 from .file import ModelFile
 from .diff import ModelDiff, ModelDiffUtil
+from .patch import ModelPatch, ModelPatchUtil
+from .journal import ModelJournal, ModelJournalEntry
@@ -78,11 +78,13 @@ class ModelDiffUtil:
             ]
 
         # 'before intersect after' gives potentially updated files
+        # Note: files that the model builder did not rebuild are the same
+        #       objects in both models, and are not compared
         file_names_updated = file_names_before.intersection(file_names_after)
         for name in file_names_updated:
             file_before = model_before.get_file(name)
             file_after = model_after.get_file(name)
-            if file_before != file_after:
+            if file_before is not file_after and file_before != file_after:
                 diffs.append(ModelDiff(ModelDiff.Change.UPDATED, file_before, file_after))
 
         return diffs
@@ -3,7 +3,7 @@
 from datetime import datetime
 from enum import Enum
 from typing import Optional, List
-import copy
+import hashlib
 import os
 
 
@@ -15,7 +15,18 @@ class ModelFile:
     updated only certain levels in the hierarchy. Specifically for this example,
     an Lftp status provides local sizes for a downloading directory but not its
     children.
+
+    Each file carries a hash of its content, which covers its own properties and
+    the hashes of its children. It is computed bottom-up on first use and
+    cleared up the parent chain by any change, so comparing two unchanged trees
+    costs a single integer comparison.
+
+    A tree can be frozen once built. Frozen files cannot be changed, so they are
+    safely shared between threads without copies.
     """
+    # Mask of the sum of the children's hashes
+    __HASH_MASK = (1 << 128) - 1
+
     class State(Enum):
         DEFAULT = 0
         DOWNLOADING = 1
@@ -42,42 +53,69 @@ class ModelFile:
         # timestamp of the latest update
         # Note: timestamp is not part of equality operator
         self.__update_timestamp = datetime.now()
-        self.__children = []  # children files
+        self.__children = {}  # children files, by name
         self.__parent = None  # direct predecessor
+        self.__content_hash = None  # None until computed
+        self.__frozen = False
 
     def __eq__(self, other):
-        # disregard in comparisons:
+        # compares the content hashes, which disregard:
         #   timestamp: we don't care about it
         #   parent: semantics are to check self and children only
-        #   children: check these manually for easier debugging
-        ka = set(self.__dict__).difference({
-            "_ModelFile__update_timestamp",
-            "_ModelFile__parent",
-            "_ModelFile__children"
-        })
-        kb = set(other.__dict__).difference({
-            "_ModelFile__update_timestamp",
-            "_ModelFile__parent",
-            "_ModelFile__children"
-        })
-        # Check self properties
-        if ka != kb:
-            return False
-        if not all(self.__dict__[k] == other.__dict__[k] for k in ka):
-            return False
-
-        # Check children's properties
-        if len(self.__children) != len(other.__children):
-            return False
-        my_children_dict = {f.name: f for f in self.__children}
-        other_children_dict = {f.name: f for f in other.__children}
-        if my_children_dict.keys() != other_children_dict.keys():
-            return False
-        for name in my_children_dict.keys():
-            if my_children_dict[name] != other_children_dict[name]:
-                return False
-
-        return True
+        if not isinstance(other, ModelFile):
+            return NotImplemented
+        return self.content_hash == other.content_hash
+
+    @property
+    def content_hash(self) -> int:
+        """Hash of the properties of this file and all its descendants"""
+        if self.__content_hash is None:
+            # Children whose hash is missing are computed before their parents,
+            # in reverse pre-order
+            files = []
+            stack = [self]
+            while stack:
+                file = stack.pop()
+                files.append(file)
+                stack.extend(child for child in file.__children.values() if child.__content_hash is None)
+            for file in reversed(files):
+                file.__compute_content_hash()
+        return self.__content_hash
+
+    def __compute_content_hash(self):
+        # Children are summed so that their order does not matter
+        children_hash = sum(child.__content_hash for child in self.__children.values()) & ModelFile.__HASH_MASK
+        content = repr((
+            self.__name,
+            self.__is_dir,
+            self.__state.value,
+            self.__remote_size,
+            self.__local_size,
+            self.__transferred_size,
+            self.__downloading_speed,
+            self.__eta,
+            self.__is_extractable,
+            self.__local_created_timestamp,
+            self.__local_modified_timestamp,
+            self.__remote_created_timestamp,
+            self.__remote_modified_timestamp,
+            children_hash
+        ))
+        self.__content_hash = int.from_bytes(hashlib.blake2b(content.encode(), digest_size=16).digest(), "big")
+
+    def __on_change(self):
+        """
+        Called before any change to the file
+        Clears the content hash of the file and its parents
+        """
+        if self.__frozen:
+            raise TypeError("Cannot modify a frozen file")
+        # A file with a hash implies that all its children have one, so the
+        # walk stops at the first file without
+        file = self
+        while file is not None and file.__content_hash is not None:
+            file.__content_hash = None
+            file = file.__parent
 
     def __repr__(self):
         return str(self.__dict__)
@@ -93,6 +131,7 @@ class ModelFile:
 
     @state.setter
     def state(self, state: State):
+        self.__on_change()
         if type(state) != ModelFile.State:
             raise TypeError
         self.__state = state
@@ -102,6 +141,7 @@ class ModelFile:
 
     @remote_size.setter
     def remote_size(self, remote_size: Optional[int]):
+        self.__on_change()
         if type(remote_size) == int:
             if remote_size < 0:
                 raise ValueError
@@ -116,6 +156,7 @@ class ModelFile:
 
     @local_size.setter
     def local_size(self, local_size: Optional[int]):
+        self.__on_change()
         if type(local_size) == int:
             if local_size < 0:
                 raise ValueError
@@ -130,6 +171,7 @@ class ModelFile:
 
     @transferred_size.setter
     def transferred_size(self, transferred_size: Optional[int]):
+        self.__on_change()
         if type(transferred_size) == int:
             if transferred_size < 0:
                 raise ValueError
@@ -144,6 +186,7 @@ class ModelFile:
 
     @downloading_speed.setter
     def downloading_speed(self, downloading_speed: Optional[int]):
+        self.__on_change()
         if type(downloading_speed) == int:
             if downloading_speed < 0:
                 raise ValueError
@@ -158,6 +201,8 @@ class ModelFile:
 
     @update_timestamp.setter
     def update_timestamp(self, update_timestamp: datetime):
+        if self.__frozen:
+            raise TypeError("Cannot modify a frozen file")
         if type(update_timestamp) != datetime:
             raise TypeError
         self.__update_timestamp = update_timestamp
@@ -167,6 +212,7 @@ class ModelFile:
 
     @eta.setter
     def eta(self, eta: Optional[int]):
+        self.__on_change()
         if type(eta) == int:
             if eta < 0:
                 raise ValueError
@@ -181,6 +227,7 @@ class ModelFile:
 
     @is_extractable.setter
     def is_extractable(self, is_extractable: bool):
+        self.__on_change()
         self.__is_extractable = is_extractable
 
     @property
@@ -188,6 +235,7 @@ class ModelFile:
 
     @local_created_timestamp.setter
     def local_created_timestamp(self, local_created_timestamp: datetime):
+        self.__on_change()
         if type(local_created_timestamp) != datetime:
             raise TypeError
         self.__local_created_timestamp = local_created_timestamp
@@ -197,6 +245,7 @@ class ModelFile:
 
     @local_modified_timestamp.setter
     def local_modified_timestamp(self, local_modified_timestamp: datetime):
+        self.__on_change()
         if type(local_modified_timestamp) != datetime:
             raise TypeError
         self.__local_modified_timestamp = local_modified_timestamp
@@ -206,6 +255,7 @@ class ModelFile:
 
     @remote_created_timestamp.setter
     def remote_created_timestamp(self, remote_created_timestamp: datetime):
+        self.__on_change()
         if type(remote_created_timestamp) != datetime:
             raise TypeError
         self.__remote_created_timestamp = remote_created_timestamp
@@ -215,6 +265,7 @@ class ModelFile:
 
     @remote_modified_timestamp.setter
     def remote_modified_timestamp(self, remote_modified_timestamp: datetime):
+        self.__on_change()
         if type(remote_modified_timestamp) != datetime:
             raise TypeError
         self.__remote_modified_timestamp = remote_modified_timestamp
@@ -231,14 +282,36 @@ class ModelFile:
             raise TypeError("Cannot add child to a non-directory")
         if child_file is self:
             raise ValueError("Cannot add parent as a child")
-        if child_file.name in (f.name for f in self.__children):
+        if child_file.name in self.__children:
             raise ValueError("Cannot add child more than once")
-        self.__children.append(child_file)
+        if child_file.__frozen:
+            raise TypeError("Cannot add a frozen file as a child")
+        self.__on_change()
+        self.__children[child_file.name] = child_file
         child_file.__parent = self
 
     def get_children(self) -> List["ModelFile"]:
-        return copy.copy(self.__children)
+        return list(self.__children.values())
 
     @property
     def parent(self) -> Optional["ModelFile"]:
         return self.__parent
+
+    @property
+    def is_frozen(self) -> bool:
+        return self.__frozen
+
+    def freeze(self):
+        """
+        Freeze this file and all its descendants
+        The content hash is computed first, so that reading a frozen tree
+        never changes it.
+        :return:
+        """
+        _ = self.content_hash
+        frontier = [self]
+        while frontier:
+            file = frontier.pop()
+            if not file.__frozen:
+                file.__frozen = True
+                frontier.extend(file.__children.values())
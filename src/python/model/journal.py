@@ -0,0 +1,140 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import uuid
+from collections import deque
+from enum import Enum
+from itertools import islice
+from threading import Lock
+from typing import List, Optional
+
+# my libs
+from common import overrides
+from .file import ModelFile
+from .model import Model, IModelListener
+
+
+class ModelJournalEntry:
+    """
+    A model event recorded by the journal
+      seq: sequence number of the model change
+    """
+    class Change(Enum):
+        ADDED = 0
+        REMOVED = 1
+        UPDATED = 2
+
+    def __init__(self,
+                 seq: int,
+                 change: Change,
+                 old_file: Optional[ModelFile],
+                 new_file: Optional[ModelFile]):
+        self.__seq = seq
+        self.__change = change
+        self.__old_file = old_file
+        self.__new_file = new_file
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+    @property
+    def seq(self) -> int:
+        return self.__seq
+
+    @property
+    def change(self) -> Change:
+        return self.__change
+
+    @property
+    def old_file(self) -> Optional[ModelFile]:
+        return self.__old_file
+
+    @property
+    def new_file(self) -> Optional[ModelFile]:
+        return self.__new_file
+
+
+class ModelJournal(IModelListener):
+    """
+    Bounded history of the latest model events
+    Readers catch up from any sequence number that is still in the journal,
+    and fall back to a snapshot of the model otherwise.
+
+    The journal must be added as a listener before the model changes, and is
+    written by the model's writer thread only. Any thread can read it.
+
+    Event ids identify a sequence number of this journal. They include a
+    random id so that the ids of a previous run, e.g. from a client that
+    reconnects after a restart, are never mistaken for ours.
+    """
+    DEFAULT_CAPACITY = 1000
+
+    def __init__(self, model: Model, capacity: int = DEFAULT_CAPACITY):
+        self.__model = model
+        self.__id = uuid.uuid4().hex[:8]
+        self.__entries = deque(maxlen=capacity)
+        self.__last_seq = model.seq
+        self.__lock = Lock()
+
+    @property
+    def capacity(self) -> int:
+        """Number of the latest events kept"""
+        return self.__entries.maxlen
+
+    def to_event_id(self, seq: int) -> str:
+        """
+        Returns the event id of the given sequence number
+        :param seq:
+        :return:
+        """
+        return "{}-{}".format(self.__id, seq)
+
+    def from_event_id(self, event_id: str) -> Optional[int]:
+        """
+        Returns the sequence number of the given event id, or None if the id
+        was not generated by this journal
+        :param event_id:
+        :return:
+        """
+        journal_id, _, seq = event_id.partition("-")
+        if journal_id != self.__id or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def get_entries(self, after_seq: int) -> Optional[List[ModelJournalEntry]]:
+        """
+        Returns all the entries after the given sequence number, in order
+        Returns None if some of them are no longer in the journal, or if the
+        sequence number is not one of the model's yet.
+        :param after_seq:
+        :return:
+        """
+        with self.__lock:
+            first_seq = self.__last_seq - len(self.__entries) + 1
+            if after_seq < first_seq - 1 or after_seq > self.__last_seq:
+                return None
+            return list(islice(self.__entries, after_seq - first_seq + 1, None))
+
+    def __append(self,
+                 change: ModelJournalEntry.Change,
+                 old_file: Optional[ModelFile],
+                 new_file: Optional[ModelFile]):
+        # The model notifies its listeners right after numbering the change
+        entry = ModelJournalEntry(self.__model.seq, change, old_file, new_file)
+        with self.__lock:
+            self.__entries.append(entry)
+            self.__last_seq = entry.seq
+
+    @overrides(IModelListener)
+    def file_added(self, file: ModelFile):
+        self.__append(ModelJournalEntry.Change.ADDED, None, file)
+
+    @overrides(IModelListener)
+    def file_removed(self, file: ModelFile):
+        self.__append(ModelJournalEntry.Change.REMOVED, file, None)
+
+    @overrides(IModelListener)
+    def file_updated(self, old_file: ModelFile, new_file: ModelFile):
+        self.__append(ModelJournalEntry.Change.UPDATED, old_file, new_file)
@@ -2,11 +2,13 @@
 
 import logging
 from abc import ABC, abstractmethod
-from typing import Set
+from threading import Condition, Lock
+from typing import Set, List, Tuple
 
 # my libs
-from common import AppError
+from common import AppError, overrides
 from .file import ModelFile
+from .patch import ModelPatch, ModelPatchUtil
 
 
 class ModelError(AppError):
@@ -48,15 +50,109 @@ class IModelListener(ABC):
         """
         pass
 
+    def file_patched(self, old_file: ModelFile, new_file: ModelFile, patches: List[ModelPatch]):
+        """
+        Event indicating that the given file was updated, along with the changes
+        within its tree
+        Listeners that only need the whole files can leave this to file_updated.
+        :param old_file:
+        :param new_file:
+        :param patches:
+        :return:
+        """
+        self.file_updated(old_file, new_file)
+
+
+class ModelSnapshot:
+    """
+    Immutable state of the model, shared between threads
+      seq: sequence number of the latest model event included in the snapshot
+      files: the model files
+    """
+    def __init__(self, seq: int, files: Tuple[ModelFile, ...]):
+        self.__seq = seq
+        self.__files = files
+
+    @property
+    def seq(self) -> int:
+        return self.__seq
+
+    @property
+    def files(self) -> Tuple[ModelFile, ...]:
+        return self.__files
+
+
+class _SnapshotModelListener(IModelListener):
+    """
+    Wraps a listener that starts from a snapshot
+    Events are held back until the snapshot is known. Then the ones already
+    included in the snapshot are dropped, and the rest are passed through.
+    """
+    def __init__(self, listener: IModelListener, model: "Model"):
+        self.listener = listener
+        self.__model = model
+        self.__lock = Lock()
+        self.__pending = []  # (seq, method name, args)
+        self.__started = False
+
+    def start(self, snapshot_seq: int):
+        """
+        Pass through the events that are newer than the snapshot
+        :param snapshot_seq:
+        :return:
+        """
+        with self.__lock:
+            for seq, name, args in self.__pending:
+                if seq > snapshot_seq:
+                    getattr(self.listener, name)(*args)
+            self.__pending = None
+            self.__started = True
+
+    def __on_event(self, name: str, *args):
+        if not self.__started:
+            with self.__lock:
+                if not self.__started:
+                    self.__pending.append((self.__model.seq, name, args))
+                    return
+        getattr(self.listener, name)(*args)
+
+    @overrides(IModelListener)
+    def file_added(self, file: ModelFile):
+        self.__on_event("file_added", file)
+
+    @overrides(IModelListener)
+    def file_removed(self, file: ModelFile):
+        self.__on_event("file_removed", file)
+
+    @overrides(IModelListener)
+    def file_updated(self, old_file: ModelFile, new_file: ModelFile):
+        self.__on_event("file_updated", old_file, new_file)
+
+    @overrides(IModelListener)
+    def file_patched(self, old_file: ModelFile, new_file: ModelFile, patches: List[ModelPatch]):
+        self.__on_event("file_patched", old_file, new_file, patches)
+
 
 class Model:
     """
     Represents the entire state of lftp
+
+    The model is changed by a single writer thread, while other threads read
+    its published snapshots and add or remove listeners. None of these wait
+    for the writer:
+      * Every change to the files gets a sequence number.
+      * The writer publishes a snapshot of the files after a batch of changes.
+      * The list of listeners is replaced, never modified, so the writer can
+        notify them while it is being changed.
     """
     def __init__(self):
         self.logger = logging.getLogger("Model")
         self.__files = {}  # name->LftpFile
-        self.__listeners = []
+        self.__listeners = []  # replaced on every change
+        self.__listeners_lock = Lock()  # serializes the changes to the listeners only
+        self.__seq = 0
+        self.__snapshot = ModelSnapshot(0, tuple())
+        self.__snapshot_published = Condition()  # notified on every new snapshot
 
     def set_base_logger(self, base_logger: logging.Logger):
         self.logger = base_logger.getChild("Model")
@@ -68,8 +164,9 @@ class Model:
         :return:
         """
         self.logger.debug("LftpModel: Adding a listener")
-        if listener not in self.__listeners:
-            self.__listeners.append(listener)
+        with self.__listeners_lock:
+            if listener not in self.__listeners:
+                self.__listeners = self.__listeners + [listener]
 
     def remove_listener(self, listener: IModelListener):
         """
@@ -78,10 +175,59 @@ class Model:
         :return:
         """
         self.logger.debug("LftpModel: Removing a listener")
-        if listener not in self.__listeners:
-            self.logger.error("LftpModel: listener does not exist!")
-        else:
-            self.__listeners.remove(listener)
+        with self.__listeners_lock:
+            listeners = [
+                l for l in self.__listeners
+                if l != listener and not (isinstance(l, _SnapshotModelListener) and l.listener == listener)
+            ]
+            if len(listeners) == len(self.__listeners):
+                self.logger.error("LftpModel: listener does not exist!")
+            else:
+                self.__listeners = listeners
+
+    @property
+    def seq(self) -> int:
+        """Sequence number of the latest change"""
+        return self.__seq
+
+    def publish_snapshot(self):
+        """
+        Publish the current state for the readers
+        Called by the writer after a batch of changes
+        :return:
+        """
+        if self.__snapshot.seq != self.__seq:
+            snapshot = ModelSnapshot(self.__seq, tuple(self.__files.values()))
+            with self.__snapshot_published:
+                self.__snapshot = snapshot
+                self.__snapshot_published.notify_all()
+
+    def get_snapshot(self) -> ModelSnapshot:
+        """
+        Returns the latest published snapshot
+        :return:
+        """
+        return self.__snapshot
+
+    def get_snapshot_and_add_listener(self, listener: IModelListener) -> ModelSnapshot:
+        """
+        Adds a listener and returns the snapshot that its events start from
+        The listener gets exactly the events that are newer than the snapshot.
+        If the writer is in the middle of a batch, this waits for the batch's
+        snapshot, but the writer never waits for this.
+        :param listener:
+        :return:
+        """
+        snapshot_listener = _SnapshotModelListener(listener, self)
+        self.add_listener(snapshot_listener)
+        # Changes up to here may have been missed by the listener, so the
+        # snapshot must include them
+        seq = self.__seq
+        with self.__snapshot_published:
+            self.__snapshot_published.wait_for(lambda: self.__snapshot.seq >= seq)
+            snapshot = self.__snapshot
+        snapshot_listener.start(snapshot.seq)
+        return snapshot
 
     def add_file(self, file: ModelFile):
         """
@@ -93,6 +239,7 @@ class Model:
         if file.name in self.__files:
             raise ModelError("File already exists in the model")
         self.__files[file.name] = file
+        self.__seq += 1
         for listener in self.__listeners:
             listener.file_added(self.__files[file.name])
 
@@ -107,6 +254,7 @@ class Model:
             raise ModelError("File does not exist in the model")
         file = self.__files[filename]
         del self.__files[filename]
+        self.__seq += 1
         for listener in self.__listeners:
             listener.file_removed(file)
 
@@ -122,8 +270,26 @@ class Model:
         old_file = self.__files[file.name]
         new_file = file
         self.__files[file.name] = new_file
+        self.__seq += 1
+        # Patches are only worked out for the listeners that use them
+        patches = None
         for listener in self.__listeners:
-            listener.file_updated(old_file, new_file)
+            if Model.__receives_patches(listener):
+                if patches is None:
+                    patches = ModelPatchUtil.diff_files(old_file, new_file)
+                listener.file_patched(old_file, new_file, patches)
+            else:
+                listener.file_updated(old_file, new_file)
+
+    @staticmethod
+    def __receives_patches(listener: IModelListener) -> bool:
+        """
+        Returns true if the listener overrides file_patched, instead of
+        leaving it to file_updated
+        """
+        if isinstance(listener, _SnapshotModelListener):
+            listener = listener.listener
+        return getattr(listener.file_patched, "__func__", None) is not IModelListener.file_patched
 
     def get_file(self, name: str) -> ModelFile:
         """
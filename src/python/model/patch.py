@@ -0,0 +1,115 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+from enum import Enum
+from typing import List, Optional, Dict, Any
+import os
+
+# my libs
+from .file import ModelFile
+
+
+class ModelPatch:
+    """
+    Represents a single change within the tree of a file
+    The changed file is addressed by its full path, i.e. including the root's name
+      ADDED: the file was added, new_file holds it with all its children
+      REMOVED: the file was removed with all its children
+      UPDATED: some properties of the file itself changed, fields maps their
+               names to the new values; its children are patched separately
+    """
+    class Change(Enum):
+        ADDED = 0
+        REMOVED = 1
+        UPDATED = 2
+
+    def __init__(self,
+                 change: Change,
+                 path: str,
+                 new_file: Optional[ModelFile] = None,
+                 fields: Optional[Dict[str, Any]] = None):
+        self.__change = change
+        self.__path = path
+        self.__new_file = new_file
+        self.__fields = fields
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+    @property
+    def change(self) -> Change:
+        return self.__change
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def new_file(self) -> Optional[ModelFile]:
+        return self.__new_file
+
+    @property
+    def fields(self) -> Optional[Dict[str, Any]]:
+        return self.__fields
+
+
+class ModelPatchUtil:
+    # Names of the ModelFile properties that are patched
+    FIELDS = (
+        "state",
+        "remote_size",
+        "local_size",
+        "transferred_size",
+        "downloading_speed",
+        "eta",
+        "is_extractable",
+        "local_created_timestamp",
+        "local_modified_timestamp",
+        "remote_created_timestamp",
+        "remote_modified_timestamp"
+    )
+
+    @staticmethod
+    def diff_files(old_file: ModelFile, new_file: ModelFile) -> List[ModelPatch]:
+        """
+        Compare two versions of a file and generate the patches that turn the
+        old tree into the new one
+        Subtrees with the same content hash are skipped, so the cost follows
+        the number of changed files rather than the size of the tree.
+        A file that turned from a directory into a file, or back, is replaced.
+        :param old_file:
+        :param new_file:
+        :return:
+        """
+        patches = []
+        frontier = [(old_file, new_file, old_file.name)]
+        while frontier:
+            _old_file, _new_file, _path = frontier.pop()
+            if _old_file.content_hash == _new_file.content_hash:
+                continue
+            if _old_file.is_dir != _new_file.is_dir:
+                patches.append(ModelPatch(ModelPatch.Change.REMOVED, _path))
+                patches.append(ModelPatch(ModelPatch.Change.ADDED, _path, new_file=_new_file))
+                continue
+
+            fields = {}
+            for field in ModelPatchUtil.FIELDS:
+                new_value = getattr(_new_file, field)
+                if getattr(_old_file, field) != new_value:
+                    fields[field] = new_value
+            if fields:
+                patches.append(ModelPatch(ModelPatch.Change.UPDATED, _path, fields=fields))
+
+            old_children = {f.name: f for f in _old_file.get_children()}
+            new_children = {f.name: f for f in _new_file.get_children()}
+            for name in sorted(old_children.keys() - new_children.keys()):
+                patches.append(ModelPatch(ModelPatch.Change.REMOVED, os.path.join(_path, name)))
+            for name, new_child in new_children.items():
+                old_child = old_children.get(name, None)
+                if old_child is None:
+                    patches.append(ModelPatch(ModelPatch.Change.ADDED, os.path.join(_path, name), new_file=new_child))
+                else:
+                    frontier.append((old_child, new_child, os.path.join(_path, name)))
+        return patches
@@ -1,11 +1,11 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
-import pickle
 import sys
 import argparse
 
 # my libs
-from system import SystemScanner, SystemFile, SystemScannerError
+from system import SystemScanner, SystemFile, SystemScannerError, WireFormat, \
+    ScanAgent, ScanAgentError, ScanRequest, ScanWatcher
 
 
 if __name__ == "__main__":
@@ -18,27 +18,95 @@ if __name__ == "__main__":
                         help="Exclude hidden files")
     parser.add_argument("-H", "--human-readable", action="store_true", default=False,
                         help="Human readable output")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of threads used to scan directories in parallel")
+    parser.add_argument("-c", "--compression", default=WireFormat.COMPRESSION_NONE,
+                        choices=[WireFormat.COMPRESSION_NONE, WireFormat.COMPRESSION_ZLIB, WireFormat.COMPRESSION_LZMA],
+                        help="Compression of the output")
+    parser.add_argument("-l", "--compression-level", type=int, default=6,
+                        help="Compression level, 0-9")
+    parser.add_argument("-d", "--delta-state",
+                        help="State file used to only output the roots that changed since the previous scan")
+    parser.add_argument("-s", "--since",
+                        help="Generation of the previous scan held by the reader (requires --delta-state)")
+    parser.add_argument("-C", "--cache",
+                        help="File that keeps the directory cache between runs, so that unchanged "
+                             "directories are not walked again")
+    parser.add_argument("-r", "--root", action="append", dest="roots",
+                        help="Name of a root to scan, can be repeated; all roots are scanned by default")
+    parser.add_argument("-a", "--agent", action="store_true", default=False,
+                        help="Serve scan requests from stdin until it is closed, see ScanAgent")
+    parser.add_argument("-W", "--watch", action="store_true", default=False,
+                        help="Report changed roots until stdin is closed, see ScanWatcher")
+    parser.add_argument("-p", "--poll-interval", type=float, default=5.0,
+                        help="Interval in seconds of the scans done by --watch when inotify is not available")
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("Number of workers must be positive")
+    if not 0 <= args.compression_level <= 9:
+        parser.error("Compression level must be between 0 and 9")
+    if args.since and not args.delta_state:
+        parser.error("--since requires --delta-state")
+    if args.agent and args.human_readable:
+        parser.error("--agent cannot be used with --human-readable")
+    if args.watch and (args.agent or args.human_readable):
+        parser.error("--watch cannot be used with --agent or --human-readable")
+    if args.roots and (args.agent or args.watch or args.human_readable or args.since):
+        parser.error("--root cannot be used with --agent, --watch, --human-readable or --since")
+    if args.poll_interval <= 0:
+        parser.error("Poll interval must be positive")
+
+    if args.watch:
+        watcher = ScanWatcher(args.path,
+                              exclude_hidden=args.exclude_hidden,
+                              poll_interval_in_s=args.poll_interval)
+        try:
+            watcher.run(sys.stdin.fileno(), sys.stdout.buffer)
+        except SystemScannerError as e:
+            sys.exit("SystemScannerError: {}".format(str(e)))
+        sys.exit(0)
+
+    agent = ScanAgent(args.path,
+                      exclude_hidden=args.exclude_hidden,
+                      num_workers=args.workers,
+                      delta_state_path=args.delta_state,
+                      cache_path=args.cache,
+                      incremental=args.agent)
+    if args.agent:
+        agent.run(sys.stdin.buffer, sys.stdout.buffer)
+        sys.exit(0)
+
+    if not args.human_readable:
+        request = ScanRequest(compression=args.compression,
+                              compression_level=args.compression_level,
+                              since=args.since,
+                              roots=args.roots)
+        try:
+            for chunk in agent.iter_scan(request):
+                sys.stdout.buffer.write(chunk)
+        except SystemScannerError as e:
+            sys.exit("SystemScannerError: {}".format(str(e)))
+        except ScanAgentError as e:
+            sys.exit("ScanAgentError: {}".format(str(e)))
+        sys.exit(0)
 
     scanner = SystemScanner(args.path)
+    scanner.set_num_workers(args.workers)
     if args.exclude_hidden:
         scanner.add_exclude_prefix(".")
     try:
         root_files = scanner.scan()
     except SystemScannerError as e:
         sys.exit("SystemScannerError: {}".format(str(e)))
-    if args.human_readable:
-        def print_file(file: SystemFile, level: int):
-            sys.stdout.write("  "*level)
-            sys.stdout.write("{} {} {}\n".format(
-                file.name,
-                "d" if file.is_dir else "f",
-                file.size
-            ))
-            for child in file.children:
-                print_file(child, level+1)
-        for root_file in root_files:
-            print_file(root_file, 0)
-    else:
-        bytes_out = pickle.dumps(root_files)
-        sys.stdout.buffer.write(bytes_out)
+
+    def print_file(file: SystemFile, level: int):
+        sys.stdout.write("  "*level)
+        sys.stdout.write("{} {} {}\n".format(
+            file.name,
+            "d" if file.is_dir else "f",
+            file.size
+        ))
+        for child in file.children:
+            print_file(child, level+1)
+    for root_file in root_files:
+        print_file(root_file, 0)
@@ -1,7 +1,12 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
+import hashlib
 import logging
+import os
+import tempfile
+import termios
 import time
+from typing import Callable, Optional, Dict
 
 import pexpect
 
@@ -16,38 +21,223 @@ class SshcpError(AppError):
     pass
 
 
+class SshcpLatency:
+    """
+    Latency statistics of one kind of command
+    """
+    def __init__(self):
+        self.count = 0
+        self.total_in_s = 0.0
+        self.max_in_s = 0.0
+        self.last_in_s = 0.0
+
+    @property
+    def mean_in_s(self) -> float:
+        return self.total_in_s / self.count if self.count else 0.0
+
+    def add(self, latency_in_s: float):
+        self.count += 1
+        self.total_in_s += latency_in_s
+        self.max_in_s = max(self.max_in_s, latency_in_s)
+        self.last_in_s = latency_in_s
+
+
+class _StrippedStream:
+    """
+    Passes a byte stream on to a consumer without its leading and trailing
+    whitespace, like bytes.strip() does for a whole buffer
+    Trailing whitespace of a chunk is held back until more data arrives.
+    """
+    __WHITESPACE = b" \t\n\r\x0b\x0c"
+
+    def __init__(self, consumer: Callable[[bytes], None]):
+        self.__consumer = consumer
+        self.__started = False
+        self.__pending = b""
+
+    def feed(self, data: bytes):
+        if not self.__started:
+            data = data.lstrip(_StrippedStream.__WHITESPACE)
+            if not data:
+                return
+            self.__started = True
+        stripped = data.rstrip(_StrippedStream.__WHITESPACE)
+        if not stripped:
+            self.__pending += data
+            return
+        self.__consumer(self.__pending + stripped)
+        self.__pending = data[len(stripped):]
+
+
+class SshcpChannel:
+    """
+    Long-running shell command on the remote server, that data is exchanged
+    with through its stdin and stdout
+    As with Sshcp.shell_stream(), the output is binary-safe. It is not
+    stripped. Input is line-buffered by the terminal, so it must be sent as
+    lines of printable text.
+    """
+    def __init__(self,
+                 sp: pexpect.spawn,
+                 timeout_secs: int,
+                 error_for_output: Callable[[str], SshcpError],
+                 tail_size: int):
+        self.__sp = sp
+        self.__timeout_secs = timeout_secs
+        self.__error_for_output = error_for_output
+        self.__tail_size = tail_size
+        self.__tail = bytearray()
+
+    def send(self, data: bytes):
+        """
+        Write data to the command's stdin
+        :param data:
+        :return:
+        """
+        try:
+            self.__sp.send(data)
+        except OSError as e:
+            self.close()
+            raise SshcpError("Channel closed: {}".format(str(e)))
+
+    def read(self, size: int) -> bytes:
+        """
+        Read at least one and up to size bytes of the command's output
+        Raises an SshcpError once the command has exited, or on timeout
+        :param size:
+        :return:
+        """
+        return self.__read(size, self.__timeout_secs, empty_on_timeout=False)
+
+    def read_available(self, size: int, timeout_in_s: float) -> bytes:
+        """
+        Read up to size bytes of the command's output, waiting up to the timeout
+        Returns no data on timeout, and raises an SshcpError once the command has exited
+        :param size:
+        :param timeout_in_s:
+        :return:
+        """
+        return self.__read(size, timeout_in_s, empty_on_timeout=True)
+
+    def __read(self, size: int, timeout_in_s: float, empty_on_timeout: bool) -> bytes:
+        try:
+            data = self.__sp.read_nonblocking(size, timeout=timeout_in_s)
+        except pexpect.EOF:
+            self.__sp.close()
+            output = self.__tail.decode(errors="replace").strip()
+            if self.__sp.exitstatus != 0:
+                raise self.__error_for_output(output)
+            raise SshcpError("Channel closed" + (" - " + output if output else ""))
+        except pexpect.exceptions.TIMEOUT:
+            if empty_on_timeout:
+                return b""
+            self.close()
+            raise SshcpError("Timed out")
+        self.__tail += data
+        del self.__tail[:-self.__tail_size]
+        return data
+
+    def is_alive(self) -> bool:
+        return self.__sp.isalive()
+
+    def close(self):
+        self.__sp.close(force=True)
+
+
 class Sshcp:
     """
     Scp command utility
+
+    Commands are multiplexed over a long-lived master connection (OpenSSH
+    ControlMaster), so that only the first command pays for the connection
+    handshake. The master is shared by every Sshcp with the same host, port,
+    user and password, across processes, and exits on its own after being
+    idle for a while. It is health-checked before each command and restarted
+    if it died. If it cannot be started, commands connect directly.
     """
     __TIMEOUT_SECS = 180
 
+    # Kinds of commands, for latency statistics
+    LATENCY_CONNECT = "connect"
+    LATENCY_CHECK = "check"
+    LATENCY_SHELL = "shell"
+    LATENCY_COPY = "copy"
+
+    # Idle time after which the master connection exits
+    __MASTER_PERSIST_SECS = 600
+    # Time before retrying a master connection that failed to start
+    __MASTER_RETRY_SECS = 60
+    __CHECK_TIMEOUT_SECS = 10
+
+    # Streamed output is read in chunks of this size
+    __STREAM_READ_SIZE = 64 * 1024
+    # Amount of streamed output kept for error messages
+    __STREAM_TAIL_SIZE = 8 * 1024
+
     def __init__(self,
                  host: str,
                  port: int,
                  user: str = None,
-                 password: str = None):
+                 password: str = None,
+                 multiplex: bool = True,
+                 control_dir: str = None):
+        """
+        :param multiplex: whether to run commands over a shared master connection
+        :param control_dir: directory of the master connection sockets, private to this user
+        """
         if host is None:
             raise ValueError("Hostname not specified.")
         self.__host = host
         self.__port = port
         self.__user = user
         self.__password = password
+        self.__multiplex = multiplex
+        if control_dir is None:
+            control_dir = os.path.join(tempfile.gettempdir(), "seedsync-ssh-{}".format(os.getuid()))
+        self.__control_dir = control_dir
+        # The password is part of the key, so that a master is never reused with
+        # credentials that it was not authenticated with
+        # Note: the socket path length is limited, so the key is hashed
+        key = "{}@{}:{}:{}".format(user, host, port, password)
+        self.__control_path = os.path.join(
+            control_dir, hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+        )
+        # Time until which starting a master is not retried
+        self.__master_retry_time = 0.0
+        self.__latency = dict()  # type: Dict[str, SshcpLatency]
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def set_base_logger(self, base_logger: logging.Logger):
         self.logger = base_logger.getChild(self.__class__.__name__)
 
-    def __run_command(self,
-                      command: str,
-                      flags: str,
-                      args: str) -> bytes:
+    def latency_stats(self) -> Dict[str, SshcpLatency]:
+        """
+        Latency statistics of the commands run so far, by kind (LATENCY_*)
+        :return:
+        """
+        return dict(self.__latency)
+
+    def __record_latency(self, kind: str, latency_in_s: float):
+        latency = self.__latency.setdefault(kind, SshcpLatency())
+        latency.add(latency_in_s)
+        self.logger.debug("Command took {:.3f}s ({} mean {:.3f}s, max {:.3f}s over {} commands)".format(
+            latency_in_s, kind, latency.mean_in_s, latency.max_in_s, latency.count
+        ))
 
+    def __build_command(self, command: str, flags: str, args: str, multiplexed: bool = False) -> str:
         command_args = [
             command,
             flags
         ]
 
+        if multiplexed:
+            command_args += [
+                "-o", "ControlMaster=no",  # never become a master
+                "-o", "ControlPath='{}'".format(self.__control_path),
+                # fail instead of prompting for a password if the master just died
+                "-o", "BatchMode=yes",
+            ]
+
         # Common flags
         command_args += [
             "-o", "StrictHostKeyChecking=no",  # ignore host key changes
@@ -66,37 +256,208 @@ class Sshcp:
 
         command_args.append(args)
 
-        command = " ".join(command_args)
+        return " ".join(command_args)
+
+    def __send_password(self, sp: pexpect.spawn):
+        """
+        Wait for the password prompt and answer it, if password authentication is used
+        :param sp:
+        :return:
+        """
+        if self.__password is not None:
+            i = sp.expect([
+                'password: ',  # i=0, all's good
+                pexpect.EOF,  # i=1, unknown error
+                'lost connection',  # i=2, connection refused
+                'Could not resolve hostname',  # i=3, bad hostname
+                'Connection refused',  # i=4, connection refused
+            ])
+            if i > 0:
+                before = sp.before.decode().strip() if sp.before != pexpect.EOF else ""
+                after = sp.after.decode().strip() if sp.after != pexpect.EOF else ""
+                self.logger.warning("Command failed: '{} - {}'".format(before, after))
+            if i == 1:
+                error_msg = "Unknown error"
+                if sp.before.decode().strip():
+                    error_msg += " - " + sp.before.decode().strip()
+                raise SshcpError(error_msg)
+            elif i == 3:
+                raise SshcpError("Bad hostname: {}".format(self.__host))
+            elif i in {2, 4}:
+                error_msg = "Connection refused by server"
+                if sp.before.decode().strip():
+                    error_msg += " - " + sp.before.decode().strip()
+                raise SshcpError(error_msg)
+            sp.sendline(self.__password)
+
+    def __use_master(self) -> bool:
+        """
+        Make sure that the master connection is up
+        :return: True if commands should run over the master connection
+        """
+        if not self.__multiplex:
+            return False
+        if self.__check_master():
+            return True
+        if time.time() < self.__master_retry_time:
+            return False
+        try:
+            self.__start_master()
+        except SshcpError as e:
+            self.logger.warning("Failed to start master connection, connecting directly: {}".format(str(e)))
+            self.__master_retry_time = time.time() + Sshcp.__MASTER_RETRY_SECS
+            return False
+        return True
+
+    def __check_master(self) -> bool:
+        if not os.path.exists(self.__control_path):
+            return False
+        command = "ssh -O check -o ControlPath='{}' -p {} {}@{}".format(
+            self.__control_path, self.__port, self.__user, self.__host
+        )
+        start_time = time.time()
+        out, exitstatus = pexpect.run(command, withexitstatus=True, timeout=Sshcp.__CHECK_TIMEOUT_SECS)
+        self.__record_latency(Sshcp.LATENCY_CHECK, time.time() - start_time)
+        if exitstatus == 0:
+            return True
+        self.logger.info("Master connection is down: {}".format(out.decode(errors="replace").strip()))
+        # A stale socket would prevent a new master from starting
+        try:
+            os.remove(self.__control_path)
+        except OSError:
+            pass
+        return False
+
+    def __start_master(self):
+        try:
+            os.makedirs(self.__control_dir, mode=0o700, exist_ok=True)
+            stat = os.stat(self.__control_dir)
+        except OSError as e:
+            raise SshcpError("Cannot create control directory: {}".format(str(e)))
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+            raise SshcpError("Control directory {} is not private".format(self.__control_dir))
+
+        self.logger.info("Starting master connection to {}@{}:{}".format(self.__user, self.__host, self.__port))
+        flags = [
+            "-p", str(self.__port),  # port
+            "-f", "-N",  # go to background after authentication, without a command
+            "-o", "ControlMaster=yes",
+            "-o", "ControlPath='{}'".format(self.__control_path),
+            "-o", "ControlPersist={}".format(Sshcp.__MASTER_PERSIST_SECS),
+        ]
+        self.__run_command(
+            command="ssh",
+            flags=" ".join(flags),
+            args="{}@{}".format(self.__user, self.__host),
+            kind=Sshcp.LATENCY_CONNECT
+        )
+
+    @staticmethod
+    def __disable_output_processing():
+        """
+        Runs in the spawned process, so that the terminal passes its output
+        through unmodified (e.g. without translating newlines)
+        :return:
+        """
+        attrs = termios.tcgetattr(1)
+        attrs[1] &= ~termios.OPOST
+        termios.tcsetattr(1, termios.TCSANOW, attrs)
+
+    @staticmethod
+    def __disable_echo_and_output_processing():
+        """
+        Runs in the spawned process, so that input written to the terminal is
+        not echoed into the output either
+        :return:
+        """
+        Sshcp.__disable_output_processing()
+        attrs = termios.tcgetattr(0)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(0, termios.TCSANOW, attrs)
+
+    def __error_for_output(self, output: str) -> SshcpError:
+        """
+        Error of a failed command, from its output
+        :param output:
+        :return:
+        """
+        self.logger.warning("Command failed: '{}'".format(output))
+        if "Could not resolve hostname" in output:
+            return SshcpError("Bad hostname: {}".format(self.__host))
+        elif "lost connection" in output or "Connection refused" in output:
+            return SshcpError("Connection refused by server - {}".format(output))
+        return SshcpError(output)
+
+    def __run_command_stream(self,
+                             command: str,
+                             flags: str,
+                             args: str,
+                             consumer: Callable[[bytes], None],
+                             kind: str,
+                             multiplexed: bool = False):
+        command = self.__build_command(command, flags, args, multiplexed)
+        self.logger.debug("Command: {}".format(command))
+
+        start_time = time.time()
+        sp = pexpect.spawn(command, preexec_fn=Sshcp.__disable_output_processing)
+        stream = _StrippedStream(consumer)
+        # An error in the consumer is only raised once the command has exited
+        # cleanly, since the output may just be an error message from ssh
+        consumer_error = None  # type: Optional[Exception]
+        tail = bytearray()
+        num_bytes = 0
+        try:
+            if not multiplexed:
+                self.__send_password(sp)
+
+            while True:
+                try:
+                    chunk = sp.read_nonblocking(Sshcp.__STREAM_READ_SIZE, timeout=self.__TIMEOUT_SECS)
+                except pexpect.EOF:
+                    break
+                num_bytes += len(chunk)
+                tail += chunk
+                del tail[:-Sshcp.__STREAM_TAIL_SIZE]
+                if consumer_error is None:
+                    try:
+                        stream.feed(chunk)
+                    except Exception as e:
+                        consumer_error = e
+                # A second prompt means the password was rejected
+                if not multiplexed and self.__password is not None and tail.endswith(b"password: "):
+                    sp.close(force=True)
+                    raise SshcpError("Incorrect password")
+
+        except pexpect.exceptions.TIMEOUT:
+            self.logger.exception("Timed out")
+            self.logger.error("Command output before:\n{}".format(bytes(tail)))
+            sp.close(force=True)
+            raise SshcpError("Timed out")
+        sp.close()
+        end_time = time.time()
+
+        self.logger.debug("Return code: {}".format(sp.exitstatus))
+        self.logger.debug("Streamed {} bytes".format(num_bytes))
+        self.__record_latency(kind, end_time-start_time)
+        if sp.exitstatus != 0:
+            raise self.__error_for_output(tail.decode(errors="replace").strip())
+        if consumer_error is not None:
+            raise consumer_error
+
+    def __run_command(self,
+                      command: str,
+                      flags: str,
+                      args: str,
+                      kind: str,
+                      multiplexed: bool = False) -> bytes:
+        command = self.__build_command(command, flags, args, multiplexed)
         self.logger.debug("Command: {}".format(command))
 
         start_time = time.time()
         sp = pexpect.spawn(command)
         try:
-            if self.__password is not None:
-                i = sp.expect([
-                    'password: ',  # i=0, all's good
-                    pexpect.EOF,  # i=1, unknown error
-                    'lost connection',  # i=2, connection refused
-                    'Could not resolve hostname',  # i=3, bad hostname
-                    'Connection refused',  # i=4, connection refused
-                ])
-                if i > 0:
-                    before = sp.before.decode().strip() if sp.before != pexpect.EOF else ""
-                    after = sp.after.decode().strip() if sp.after != pexpect.EOF else ""
-                    self.logger.warning("Command failed: '{} - {}'".format(before, after))
-                if i == 1:
-                    error_msg = "Unknown error"
-                    if sp.before.decode().strip():
-                        error_msg += " - " + sp.before.decode().strip()
-                    raise SshcpError(error_msg)
-                elif i == 3:
-                    raise SshcpError("Bad hostname: {}".format(self.__host))
-                elif i in {2, 4}:
-                    error_msg = "Connection refused by server"
-                    if sp.before.decode().strip():
-                        error_msg += " - " + sp.before.decode().strip()
-                    raise SshcpError(error_msg)
-                sp.sendline(self.__password)
+            if not multiplexed:
+                self.__send_password(sp)
 
             i = sp.expect(
                 [
@@ -130,7 +491,7 @@ class Sshcp:
         end_time = time.time()
 
         self.logger.debug("Return code: {}".format(sp.exitstatus))
-        self.logger.debug("Command took {:.3f}s".format(end_time-start_time))
+        self.__record_latency(kind, end_time-start_time)
         if sp.exitstatus != 0:
             before = sp.before.decode().strip() if sp.before != pexpect.EOF else ""
             after = sp.after.decode().strip() if sp.after != pexpect.EOF else ""
@@ -145,6 +506,68 @@ class Sshcp:
         :param command:
         :return:
         """
+        flags, args = self.__shell_args(command)
+        multiplexed = self.__use_master()
+        return self.__run_command(
+            command="ssh",
+            flags=flags,
+            args=args,
+            kind=Sshcp.LATENCY_SHELL,
+            multiplexed=multiplexed
+        )
+
+    def shell_stream(self, command: str, consumer: Callable[[bytes], None]):
+        """
+        Run a shell command on remote service, passing its output to the
+        consumer as it arrives
+        Unlike shell(), the output is binary-safe: the terminal does not
+        translate it. Leading and trailing whitespace is still removed.
+        If the consumer raises, the rest of the output is discarded, and the
+        exception is re-raised once the command exits successfully.
+        :param command:
+        :param consumer: called with each chunk of output
+        :return:
+        """
+        flags, args = self.__shell_args(command)
+        multiplexed = self.__use_master()
+        self.__run_command_stream(
+            command="ssh",
+            flags=flags,
+            args=args,
+            consumer=consumer,
+            kind=Sshcp.LATENCY_SHELL,
+            multiplexed=multiplexed
+        )
+
+    def open_channel(self, command: str) -> SshcpChannel:
+        """
+        Start a long-running shell command on remote service, to exchange
+        data with through its stdin and stdout
+        :param command:
+        :return:
+        """
+        flags, args = self.__shell_args(command)
+        multiplexed = self.__use_master()
+        command = self.__build_command("ssh", flags, args, multiplexed)
+        self.logger.debug("Channel command: {}".format(command))
+
+        sp = pexpect.spawn(command, preexec_fn=Sshcp.__disable_echo_and_output_processing)
+        try:
+            if not multiplexed:
+                self.__send_password(sp)
+        except pexpect.exceptions.TIMEOUT:
+            self.logger.exception("Timed out")
+            sp.close(force=True)
+            raise SshcpError("Timed out")
+        except SshcpError:
+            sp.close(force=True)
+            raise
+        return SshcpChannel(sp=sp,
+                            timeout_secs=self.__TIMEOUT_SECS,
+                            error_for_output=self.__error_for_output,
+                            tail_size=Sshcp.__STREAM_TAIL_SIZE)
+
+    def __shell_args(self, command: str) -> tuple:
         if not command:
             raise ValueError("Command cannot be empty")
 
@@ -166,11 +589,7 @@ class Sshcp:
             "{}@{}".format(self.__user, self.__host),
             command
         ]
-        return self.__run_command(
-            command="ssh",
-            flags=" ".join(flags),
-            args=" ".join(args)
-        )
+        return " ".join(flags), " ".join(args)
 
     def copy(self, local_path: str, remote_path: str):
         """
@@ -192,8 +611,11 @@ class Sshcp:
             local_path,
             "{}@{}:{}".format(self.__user, self.__host, remote_path)
         ]
+        multiplexed = self.__use_master()
         self.__run_command(
             command="scp",
             flags=" ".join(flags),
-            args=" ".join(args)
+            args=" ".join(args),
+            kind=Sshcp.LATENCY_COPY,
+            multiplexed=multiplexed
         )
@@ -2,3 +2,8 @@
 
 from .scanner import SystemScanner, SystemScannerError
 from .file import SystemFile
+from .inotify import Inotify, InotifyEvent, InotifyError
+from .wire import WireFormat, WireFormatDecoder, WireFormatError
+from .delta import ScanDelta, ScanDeltaState
+from .agent import ScanAgent, ScanAgentError, ScanAgentResponseReader, ScanRequest
+from .watcher import ScanWatcher, ScanWatcherError, ScanWatcherReader
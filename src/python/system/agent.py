@@ -0,0 +1,314 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import json
+import os
+import struct
+from typing import Optional, Iterator, Callable, BinaryIO, List
+
+# my libs
+from common import AppError
+from .scanner import SystemScanner, SystemScannerError
+from .file import SystemFile
+from .wire import WireFormat
+from .delta import ScanDeltaState
+
+
+class ScanAgentError(AppError):
+    """
+    Exception indicating a malformed scan agent request or response
+    """
+    pass
+
+
+class ScanRequest:
+    """
+    Request for a scan, sent to the scan agent as a single json line
+      path: sub-directory to scan, relative to the agent's root; None to scan the root
+      compression: compression of the output, one of WireFormat.COMPRESSION_*
+      compression_level: compression level, 0-9
+      since: generation of the previous scan held by the reader, for a delta scan
+      roots: names of the roots to scan; None to scan all of them
+    Note: sub-directory and root scans are always full scans
+    """
+    def __init__(self,
+                 path: Optional[str] = None,
+                 compression: str = WireFormat.COMPRESSION_NONE,
+                 compression_level: int = 6,
+                 since: Optional[str] = None,
+                 roots: Optional[List[str]] = None):
+        self.path = path
+        self.compression = compression
+        self.compression_level = compression_level
+        self.since = since
+        self.roots = roots
+
+    def to_line(self) -> bytes:
+        return json.dumps({
+            "path": self.path,
+            "compression": self.compression,
+            "compression_level": self.compression_level,
+            "since": self.since,
+            "roots": self.roots
+        }).encode() + b"\n"
+
+    @staticmethod
+    def from_line(line: bytes) -> "ScanRequest":
+        try:
+            content = json.loads(line.decode())
+            request = ScanRequest(
+                path=content.get("path", None),
+                compression=content.get("compression", WireFormat.COMPRESSION_NONE),
+                compression_level=content.get("compression_level", 6),
+                since=content.get("since", None),
+                roots=content.get("roots", None)
+            )
+        except (ValueError, AttributeError) as e:
+            raise ScanAgentError("Malformed request: {}".format(str(e)))
+        if request.path is not None and not isinstance(request.path, str):
+            raise ScanAgentError("Malformed request: bad path")
+        if not isinstance(request.compression_level, int) or not 0 <= request.compression_level <= 9:
+            raise ScanAgentError("Malformed request: bad compression level")
+        if request.since is not None and not isinstance(request.since, str):
+            raise ScanAgentError("Malformed request: bad generation")
+        if request.roots is not None:
+            if not isinstance(request.roots, list) or not all(isinstance(name, str) for name in request.roots):
+                raise ScanAgentError("Malformed request: bad roots")
+            if request.path is not None:
+                raise ScanAgentError("Malformed request: roots cannot be scanned in a sub-directory")
+        return request
+
+
+class ScanAgent:
+    """
+    Scans a root directory on request, so that repeated scans do not pay for
+    starting a new scan_fs process
+
+    The agent reads ScanRequests from its input, one per line, and answers
+    each with a response in its output. It exits when its input is closed.
+
+    Output:
+        HELLO on start, then for each request a response made of chunks
+        chunk:  type byte, 4-byte big-endian payload length, payload
+                CHUNK_DATA    a part of the scan output, see WireFormat
+                CHUNK_ERROR   an error message (utf-8), ends the response
+                CHUNK_END     empty, ends the response
+    """
+    HELLO = b"SSAG\x01"
+
+    CHUNK_DATA = b"D"
+    CHUNK_ERROR = b"X"
+    CHUNK_END = b"E"
+
+    __CHUNK_HEADER = struct.Struct(">cI")
+
+    def __init__(self,
+                 path: str,
+                 exclude_hidden: bool = False,
+                 num_workers: int = 1,
+                 delta_state_path: Optional[str] = None,
+                 cache_path: Optional[str] = None,
+                 incremental: bool = False):
+        """
+        :param path: root directory to scan
+        :param exclude_hidden: whether to exclude hidden files
+        :param num_workers: number of threads used to scan directories in parallel
+        :param delta_state_path: state file used for delta scans of the root, None to disable them
+        :param cache_path: file that persists the directory cache of the root between runs, None to disable it
+        :param incremental: whether scans of the root reuse the directories that did not change
+                            since the previous scan (implied by cache_path)
+        """
+        self.__path = path
+        self.__exclude_hidden = exclude_hidden
+        self.__num_workers = num_workers
+        self.__delta_state = ScanDeltaState(delta_state_path) if delta_state_path else None
+        self.__cache_path = cache_path
+        self.__root_scanner = None  # type: Optional[SystemScanner]
+        if incremental or cache_path:
+            self.__root_scanner = self.__create_scanner(path)
+            self.__root_scanner.set_incremental(True)
+            if cache_path:
+                self.__root_scanner.load_cache(cache_path)
+
+    def iter_scan(self, request: ScanRequest) -> Iterator[bytes]:
+        """
+        Scan and return the encoded output
+        The scan runs before the first chunk is returned, so scan errors are
+        raised before any output.
+        :param request:
+        :return:
+        """
+        path = self.__path
+        if request.path is not None:
+            path = os.path.normpath(os.path.join(self.__path, request.path))
+            relative_path = os.path.relpath(path, self.__path)
+            if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep):
+                raise ScanAgentError("Path is outside of the scan root: {}".format(request.path))
+
+        if request.roots is not None:
+            root_files = self.__scan_roots(request.roots)
+        elif request.path is None and self.__root_scanner is not None:
+            root_files = self.__root_scanner.scan()
+            if self.__cache_path:
+                try:
+                    self.__root_scanner.save_cache(self.__cache_path)
+                except OSError:
+                    # The next run will just walk the whole tree
+                    pass
+        else:
+            root_files = self.__create_scanner(path).scan()
+
+        compression = request.compression
+        if compression not in WireFormat.supported_compressions():
+            # The reader detects the compression of the output on its own
+            compression = WireFormat.COMPRESSION_NONE
+        if self.__delta_state is not None and request.path is None and request.roots is None:
+            delta = self.__delta_state.update(
+                [(root_file.name, WireFormat.encode_frame(root_file)) for root_file in root_files],
+                request.since
+            )
+            chunks = WireFormat.iter_stream(delta.frames,
+                                            generation=delta.generation,
+                                            base_generation=delta.base_generation,
+                                            removed_names=delta.removed_names)
+        else:
+            chunks = WireFormat.iter_encode(root_files)
+        return WireFormat.iter_compress(chunks, compression, request.compression_level)
+
+    def __scan_roots(self, names: List[str]) -> List[SystemFile]:
+        """
+        Scan the named roots, skipping the ones that do not exist or are excluded
+        :param names:
+        :return:
+        """
+        for name in names:
+            if not name or name in (os.curdir, os.pardir) or os.sep in name:
+                raise ScanAgentError("Bad root name: {}".format(name))
+        scanner = self.__create_scanner(self.__path)
+        root_files = []
+        for name in sorted(set(names)):
+            if self.__exclude_hidden and name.startswith("."):
+                continue
+            if not os.path.lexists(os.path.join(self.__path, name)):
+                # Root was removed, which the next full scan reports
+                continue
+            root_files.append(scanner.scan_single(name))
+        return root_files
+
+    def __create_scanner(self, path: str) -> SystemScanner:
+        scanner = SystemScanner(path)
+        scanner.set_num_workers(self.__num_workers)
+        if self.__exclude_hidden:
+            scanner.add_exclude_prefix(".")
+        return scanner
+
+    def run(self, input_stream: BinaryIO, output_stream: BinaryIO):
+        """
+        Serve requests until the input is closed
+        :param input_stream:
+        :param output_stream:
+        :return:
+        """
+        output_stream.write(ScanAgent.HELLO)
+        output_stream.flush()
+        for line in input_stream:
+            if not line.strip():
+                continue
+            try:
+                request = ScanRequest.from_line(line)
+                for chunk in self.iter_scan(request):
+                    ScanAgent.__write_chunk(output_stream, ScanAgent.CHUNK_DATA, chunk)
+            except SystemScannerError as e:
+                ScanAgent.__write_chunk(output_stream, ScanAgent.CHUNK_ERROR,
+                                        "SystemScannerError: {}".format(str(e)).encode())
+            except ScanAgentError as e:
+                ScanAgent.__write_chunk(output_stream, ScanAgent.CHUNK_ERROR,
+                                        "ScanAgentError: {}".format(str(e)).encode())
+            else:
+                ScanAgent.__write_chunk(output_stream, ScanAgent.CHUNK_END, b"")
+            output_stream.flush()
+
+    @staticmethod
+    def __write_chunk(output_stream: BinaryIO, chunk_type: bytes, payload: bytes):
+        output_stream.write(ScanAgent.__CHUNK_HEADER.pack(chunk_type, len(payload)))
+        output_stream.write(payload)
+
+
+class ScanAgentResponseReader:
+    """
+    Incremental parser of a scan agent's output, on the reader side
+    The scan output of each response is passed to the consumer as it arrives.
+    """
+    __CHUNK_HEADER = struct.Struct(">cI")
+
+    def __init__(self):
+        self.__buffer = bytearray()
+        self.__has_hello = False
+        self.__consumer = None  # type: Optional[Callable[[bytes], None]]
+        self.__error = None  # type: Optional[str]
+        self.__done = True
+
+    @property
+    def has_hello(self) -> bool:
+        return self.__has_hello
+
+    @property
+    def done(self) -> bool:
+        """True when the current response has been read"""
+        return self.__done
+
+    @property
+    def error(self) -> Optional[str]:
+        """Error message of the last response, if it failed"""
+        return self.__error
+
+    def start_response(self, consumer: Callable[[bytes], None]):
+        """
+        Expect the response to a new request
+        :param consumer: called with each part of the scan output
+        :return:
+        """
+        if not self.__done:
+            raise ScanAgentError("Previous response was not read")
+        self.__consumer = consumer
+        self.__error = None
+        self.__done = False
+
+    def feed(self, data: bytes):
+        """
+        Feed output of the agent
+        Output before the hello is skipped if it is whitespace, e.g. the
+        newline echoed after a password prompt.
+        :param data:
+        :return:
+        """
+        self.__buffer += data
+        if not self.__has_hello:
+            stripped = self.__buffer.lstrip()
+            if len(stripped) < len(ScanAgent.HELLO):
+                if not ScanAgent.HELLO.startswith(bytes(stripped)):
+                    raise ScanAgentError("Bad hello: {}".format(bytes(stripped)))
+                return
+            if not stripped.startswith(ScanAgent.HELLO):
+                raise ScanAgentError("Bad hello: {}".format(bytes(stripped)))
+            self.__buffer = stripped[len(ScanAgent.HELLO):]
+            self.__has_hello = True
+
+        header_size = ScanAgentResponseReader.__CHUNK_HEADER.size
+        pos = 0
+        # Output after the end of the response is kept for the next one
+        while not self.__done and len(self.__buffer) - pos >= header_size:
+            chunk_type, length = ScanAgentResponseReader.__CHUNK_HEADER.unpack_from(self.__buffer, pos)
+            if len(self.__buffer) - pos - header_size < length:
+                break
+            payload = bytes(self.__buffer[pos+header_size:pos+header_size+length])
+            pos += header_size + length
+            if chunk_type == ScanAgent.CHUNK_DATA:
+                self.__consumer(payload)
+            elif chunk_type == ScanAgent.CHUNK_ERROR:
+                self.__error = payload.decode(errors="replace")
+                self.__done = True
+            elif chunk_type == ScanAgent.CHUNK_END:
+                self.__done = True
+            else:
+                raise ScanAgentError("Unknown chunk type: {}".format(chunk_type))
+        del self.__buffer[:pos]
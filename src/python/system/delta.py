@@ -0,0 +1,96 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import hashlib
+import json
+import os
+import uuid
+from typing import List, Tuple, Optional, Dict
+
+
+class ScanDelta:
+    """
+    Difference of a scan against a previous generation
+      generation: generation of this scan, None if the snapshot could not be saved
+      base_generation: generation the delta applies to, None for a full scan
+      removed_names: names of the roots that no longer exist
+      frames: encoded frames of the added and changed roots (all roots for a full scan)
+    """
+    def __init__(self,
+                 generation: Optional[str],
+                 base_generation: Optional[str],
+                 removed_names: List[str],
+                 frames: List[bytes]):
+        self.generation = generation
+        self.base_generation = base_generation
+        self.removed_names = removed_names
+        self.frames = frames
+
+
+class ScanDeltaState:
+    """
+    Snapshot of the previous scan, persisted to a small state file so that
+    consecutive scan_fs runs only send the roots that changed
+
+    The state records a random generation token and a digest of every
+    root's encoded frame. A reader that holds the tree of the recorded
+    generation can apply a delta to it. Any other reader, or a missing or
+    corrupt state file, gets a full scan.
+    """
+    __DIGEST_SIZE = 16
+
+    def __init__(self, path: str):
+        """
+        :param path: path of the state file
+        """
+        self.__path = path
+
+    def update(self, root_frames: List[Tuple[str, bytes]], since_generation: Optional[str]) -> ScanDelta:
+        """
+        Compare a scan against the snapshot, and replace the snapshot with it
+        :param root_frames: (name, encoded frame) of every root
+        :param since_generation: generation held by the reader, if any
+        :return:
+        """
+        prev_generation, prev_digests = self.__load()
+        generation = uuid.uuid4().hex
+        digests = {
+            name: hashlib.blake2b(frame, digest_size=ScanDeltaState.__DIGEST_SIZE).hexdigest()
+            for name, frame in root_frames
+        }
+        try:
+            self.__save(generation, digests)
+        except OSError:
+            # Without a snapshot, the reader cannot be sent deltas
+            generation = None
+
+        if generation is None or since_generation is None or since_generation != prev_generation:
+            return ScanDelta(generation=generation,
+                             base_generation=None,
+                             removed_names=[],
+                             frames=[frame for _, frame in root_frames])
+        return ScanDelta(
+            generation=generation,
+            base_generation=prev_generation,
+            removed_names=sorted(set(prev_digests.keys()).difference(digests.keys())),
+            frames=[frame for name, frame in root_frames if prev_digests.get(name, None) != digests[name]]
+        )
+
+    def __load(self) -> Tuple[Optional[str], Dict[str, str]]:
+        try:
+            with open(self.__path, "r") as f:
+                content = json.load(f)
+            generation = content["generation"]
+            digests = content["roots"]
+            if not isinstance(generation, str) or not isinstance(digests, dict):
+                return None, {}
+            return generation, digests
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, {}
+
+    def __save(self, generation: str, digests: Dict[str, str]):
+        # Written to a temp file first, so that an interrupted run never leaves
+        # a partial state file behind
+        temp_path = "{}.{}.tmp".format(self.__path, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump({"generation": generation, "roots": digests}, f)
+        os.replace(temp_path, self.__path)
@@ -1,33 +1,94 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
-from typing import List
-from datetime import datetime
+from typing import List, Optional
+from datetime import datetime, timedelta
+
+
+def _datetime_to_ns(dt: Optional[datetime]) -> Optional[int]:
+    if dt is None:
+        return None
+    # Whole seconds and microseconds are converted separately so that
+    # the conversion is exact and round-trips
+    return int(dt.replace(microsecond=0).timestamp()) * 1000000000 + dt.microsecond * 1000
+
+
+def _ns_to_datetime(ns: Optional[int]) -> Optional[datetime]:
+    if ns is None:
+        return None
+    secs, rem_ns = divmod(ns, 1000000000)
+    return datetime.fromtimestamp(secs) + timedelta(microseconds=rem_ns // 1000)
 
 
 class SystemFile:
     """
     Represents a system file or directory
+    Timestamps are stored as raw epoch nanoseconds, as reported by stat, and
+    are only converted to datetime objects when requested.
+    Note: scans can produce millions of these, so the class uses __slots__
+          and files do not allocate a children list
     """
+    __slots__ = ("__name", "__size", "__is_dir", "__timestamp_created_ns", "__timestamp_modified_ns", "__children")
+
     def __init__(self,
                  name: str,
                  size: int,
                  is_dir: bool = False,
                  time_created: datetime = None,
-                 time_modified: datetime = None):
+                 time_modified: datetime = None,
+                 time_created_ns: int = None,
+                 time_modified_ns: int = None):
+        """
+        :param name:
+        :param size: in bytes
+        :param is_dir:
+        :param time_created: creation time, ignored if time_created_ns is given
+        :param time_modified: modification time, ignored if time_modified_ns is given
+        :param time_created_ns: creation time in nanoseconds since epoch
+        :param time_modified_ns: modification time in nanoseconds since epoch
+        """
         if size < 0:
             raise ValueError("File size must be greater than zero")
         self.__name = name
         self.__size = size  # in bytes
         self.__is_dir = is_dir
-        self.__timestamp_created = time_created
-        self.__timestamp_modified = time_modified
-        self.__children = []
+        self.__timestamp_created_ns = time_created_ns if time_created_ns is not None \
+            else _datetime_to_ns(time_created)
+        self.__timestamp_modified_ns = time_modified_ns if time_modified_ns is not None \
+            else _datetime_to_ns(time_modified)
+        self.__children = [] if is_dir else None
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, SystemFile):
+            return NotImplemented
+        return self.__name == other.__name and \
+            self.__size == other.__size and \
+            self.__is_dir == other.__is_dir and \
+            self.__timestamp_created_ns == other.__timestamp_created_ns and \
+            self.__timestamp_modified_ns == other.__timestamp_modified_ns and \
+            self.__children == other.__children
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str({
+            "name": self.__name,
+            "size": self.__size,
+            "is_dir": self.__is_dir,
+            "timestamp_created_ns": self.__timestamp_created_ns,
+            "timestamp_modified_ns": self.__timestamp_modified_ns,
+            "children": self.children
+        })
+
+    def __reduce__(self):
+        # Pickle as constructor arguments instead of the default slot dict,
+        # which repeats the mangled attribute names for every file
+        return (
+            SystemFile,
+            (self.__name, self.__size, self.__is_dir, None, None,
+             self.__timestamp_created_ns, self.__timestamp_modified_ns),
+            self.__children or None
+        )
+
+    def __setstate__(self, children: List["SystemFile"]):
+        self.__children = children
 
     @property
     def name(self) -> str: return self.__name
@@ -39,13 +100,20 @@ class SystemFile:
     def is_dir(self) -> bool: return self.__is_dir
 
     @property
-    def timestamp_created(self) -> datetime: return self.__timestamp_created
+    def timestamp_created(self) -> datetime: return _ns_to_datetime(self.__timestamp_created_ns)
+
+    @property
+    def timestamp_modified(self) -> datetime: return _ns_to_datetime(self.__timestamp_modified_ns)
+
+    @property
+    def timestamp_created_ns(self) -> Optional[int]: return self.__timestamp_created_ns
 
     @property
-    def timestamp_modified(self) -> datetime: return self.__timestamp_modified
+    def timestamp_modified_ns(self) -> Optional[int]: return self.__timestamp_modified_ns
 
     @property
-    def children(self) -> List["SystemFile"]: return self.__children
+    def children(self) -> List["SystemFile"]:
+        return self.__children if self.__children is not None else []
 
     def add_child(self, file: "SystemFile"):
         if not self.__is_dir:
@@ -0,0 +1,176 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+from typing import List, Optional
+
+# my libs
+from common import AppError
+
+
+class InotifyError(AppError):
+    """
+    Exception indicating an inotify failure
+
+    Args:
+        error_number: errno value reported by the system call
+    """
+    def __init__(self, message: str, error_number: int = 0):
+        super().__init__(message)
+        self.error_number = error_number
+
+
+class InotifyEvent:
+    """
+    A single inotify event
+      wd: watch descriptor of the watched directory
+      mask: event mask
+      cookie: links the two halves of a rename
+      name: name of the entry inside the watched directory, empty for the directory itself
+    """
+    def __init__(self, wd: int, mask: int, cookie: int, name: str):
+        self.wd = wd
+        self.mask = mask
+        self.cookie = cookie
+        self.name = name
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+class Inotify:
+    """
+    Minimal wrapper around the Linux inotify system calls
+    """
+    # Event masks, from <sys/inotify.h>
+    IN_ACCESS = 0x00000001
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_CLOSE_NOWRITE = 0x00000010
+    IN_OPEN = 0x00000020
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_UNMOUNT = 0x00002000
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_ISDIR = 0x40000000
+
+    # Flags for inotify_init1
+    __IN_CLOEXEC = 0o2000000
+    __IN_NONBLOCK = 0o4000
+
+    __EVENT_HEADER = struct.Struct("iIII")
+    __READ_BUFFER_SIZE = 64 * 1024
+
+    __libc = None
+
+    def __init__(self):
+        self.__fd = None  # type: Optional[int]
+
+    @staticmethod
+    def is_supported() -> bool:
+        """
+        Returns true if inotify is available on this system
+        :return:
+        """
+        return Inotify.__load_libc() is not None
+
+    @staticmethod
+    def __load_libc():
+        if Inotify.__libc is None and sys.platform.startswith("linux"):
+            libc_name = ctypes.util.find_library("c") or "libc.so.6"
+            try:
+                libc = ctypes.CDLL(libc_name, use_errno=True)
+            except OSError:
+                return None
+            if not all(hasattr(libc, f) for f in ("inotify_init1", "inotify_add_watch", "inotify_rm_watch")):
+                return None
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            Inotify.__libc = libc
+        return Inotify.__libc
+
+    def open(self):
+        """
+        Create the inotify instance
+        :return:
+        """
+        libc = Inotify.__load_libc()
+        if libc is None:
+            raise InotifyError("Inotify is not supported on this system")
+        fd = libc.inotify_init1(Inotify.__IN_CLOEXEC | Inotify.__IN_NONBLOCK)
+        if fd < 0:
+            error_number = ctypes.get_errno()
+            raise InotifyError("inotify_init1 failed: {}".format(os.strerror(error_number)), error_number)
+        self.__fd = fd
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def fileno(self) -> int:
+        return self.__fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """
+        Watch a path, or modify the mask of an existing watch
+        Note: a path that refers to an already watched inode returns the
+              existing watch descriptor
+        :param path:
+        :param mask:
+        :return: watch descriptor
+        """
+        wd = Inotify.__libc.inotify_add_watch(self.__fd, os.fsencode(path), mask)
+        if wd < 0:
+            error_number = ctypes.get_errno()
+            raise InotifyError("inotify_add_watch failed for {}: {}".format(path, os.strerror(error_number)),
+                               error_number)
+        return wd
+
+    def rm_watch(self, wd: int):
+        """
+        Remove a watch, ignoring watches that were already removed by the kernel
+        :param wd:
+        :return:
+        """
+        if Inotify.__libc.inotify_rm_watch(self.__fd, wd) < 0:
+            error_number = ctypes.get_errno()
+            if error_number != errno.EINVAL:
+                raise InotifyError("inotify_rm_watch failed: {}".format(os.strerror(error_number)), error_number)
+
+    def read_events(self, timeout_in_s: float = 0) -> List[InotifyEvent]:
+        """
+        Read all pending events, waiting up to the timeout for the first one
+        :param timeout_in_s:
+        :return:
+        """
+        ready, _, _ = select.select([self.__fd], [], [], timeout_in_s)
+        if not ready:
+            return []
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.__fd, Inotify.__READ_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = Inotify.__EVENT_HEADER.unpack_from(buffer, offset)
+                offset += Inotify.__EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b"\0")
+                offset += length
+                events.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+        return events
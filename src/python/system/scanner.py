@@ -1,9 +1,13 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
+import json
 import os
 import re
-from typing import List
-from datetime import datetime
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
 
 # my libs
 from common import AppError
@@ -18,6 +22,10 @@ class SystemScannerError(AppError):
 
 
 class PseudoDirEntry:
+    """
+    DirEntry-like object for paths that were not listed by scandir
+    If stat is None, the path is stat'ed when first needed
+    """
     def __init__(self, name: str, path: str, is_dir: bool, stat):
         self.name = name
         self.path = path
@@ -28,9 +36,30 @@ class PseudoDirEntry:
         return self._is_dir
 
     def stat(self):
+        if self._stat is None:
+            self._stat = os.stat(self.path)
         return self._stat
 
 
+class _DirCacheEntry:
+    """
+    Cached scan result of a single directory, used by incremental scans
+      key: (inode, mtime) of the directory when it was listed
+      time_listed: time when the directory was listed
+      sys_file: SystemFile built for the directory itself (None for the scan root)
+      children: children of the directory, in sorted order
+      paths: file system path of each child
+      pinned: whether each child must always be re-stat'ed, even if it is not recently modified
+    """
+    def __init__(self, key: tuple, time_listed: float, sys_file: Optional[SystemFile]):
+        self.key = key
+        self.time_listed = time_listed
+        self.sys_file = sys_file
+        self.children = []
+        self.paths = []
+        self.pinned = []
+
+
 class SystemScanner:
     """
     Scans system to generate list of files and sizes
@@ -38,6 +67,16 @@ class SystemScanner:
     """
     __LFTP_STATUS_FILE_SUFFIX = ".lftp-pget-status"
 
+    # Files modified within this window of the previous scan are assumed to
+    # still be written to, and are always re-stat'ed by incremental scans
+    __INCREMENTAL_SETTLE_TIME_IN_SECS = 60
+    # Directories are listed again after this time even if they look unchanged,
+    # which bounds how long an append to an idle file can go unnoticed
+    __INCREMENTAL_MAX_AGE_IN_SECS = 60 * 60
+    # Most files kept by a saved cache
+    __CACHE_MAX_ENTRIES = 2000000
+    __CACHE_VERSION = 1
+
     def __init__(self, path_to_scan: str):
         """
         :param path_to_scan: path to file or directory to scan
@@ -46,6 +85,17 @@ class SystemScanner:
         self.exclude_prefixes = []
         self.exclude_suffixes = [SystemScanner.__LFTP_STATUS_FILE_SUFFIX]
         self.__lftp_temp_file_suffix = None
+        self.__incremental = False
+        # Directory cache of the previous scan, and the one being built by the current scan
+        self.__dir_cache = dict()  # type: Dict[str, _DirCacheEntry]
+        self.__next_dir_cache = None  # type: Optional[Dict[str, _DirCacheEntry]]
+        self.__scan_start_time = 0.0
+        self.__prev_scan_start_time = None  # type: Optional[float]
+        self.__settle_time_ns = 0
+        # Worker pool for parallel scans, created on first use
+        self.__num_workers = 1
+        self.__executor = None  # type: Optional[ThreadPoolExecutor]
+        self.__free_workers = None  # type: Optional[threading.Semaphore]
 
     def add_exclude_prefix(self, prefix: str):
         """
@@ -54,6 +104,7 @@ class SystemScanner:
         :return:
         """
         self.exclude_prefixes.append(prefix)
+        self.__dir_cache.clear()
 
     def add_exclude_suffix(self, suffix: str):
         """
@@ -62,6 +113,7 @@ class SystemScanner:
         :return:
         """
         self.exclude_suffixes.append(suffix)
+        self.__dir_cache.clear()
 
     def set_lftp_temp_suffix(self, suffix: str):
         """
@@ -71,6 +123,60 @@ class SystemScanner:
         :return:
         """
         self.__lftp_temp_file_suffix = suffix
+        self.__dir_cache.clear()
+
+    def set_incremental(self, incremental: bool):
+        """
+        Enable or disable incremental scans
+        An incremental scan caches the subtree of every directory, keyed on the
+        directory's (inode, mtime). A directory whose key has not changed since
+        the previous scan is not listed again; its cached files are reused and
+        only its sub-directories are re-stat'ed. Files that may still be growing
+        without touching their directory (pending lftp status, lftp temp files
+        and recently modified files) are always re-stat'ed.
+        :param incremental:
+        :return:
+        """
+        self.__incremental = incremental
+        self.__dir_cache.clear()
+
+    def set_num_workers(self, num_workers: int):
+        """
+        Set the number of threads used to scan directories in parallel
+        Sibling directories are scanned concurrently when a worker is free,
+        which hides the stat latency of network or spinning storage.
+        A value of 1 scans on the calling thread only.
+        :param num_workers:
+        :return:
+        """
+        if num_workers < 1:
+            raise ValueError("Number of workers must be positive")
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+        self.__num_workers = num_workers
+
+    def invalidate_dir(self, path: str):
+        """
+        Force the next incremental scan to list the given directory again
+        :param path: path of the directory, as passed to or discovered by the scanner
+        :return:
+        """
+        self.__dir_cache.pop(path, None)
+
+    def clear_cache(self):
+        """
+        Force the next incremental scan to be a full scan
+        :return:
+        """
+        self.__dir_cache.clear()
+
+    def get_cached_dir_paths(self) -> List[str]:
+        """
+        Returns the paths of all the directories visited by the last incremental scan
+        :return:
+        """
+        return list(self.__dir_cache.keys())
 
     def scan(self) -> List[SystemFile]:
         """
@@ -81,7 +187,103 @@ class SystemScanner:
             raise SystemScannerError("Path does not exist: {}".format(self.path_to_scan))
         elif not os.path.isdir(self.path_to_scan):
             raise SystemScannerError("Path is not a directory: {}".format(self.path_to_scan))
-        return self.__create_children(self.path_to_scan)
+        self.__start_workers()
+        if not self.__incremental:
+            return self.__create_children(self.path_to_scan)
+
+        self.__scan_start_time = time.time()
+        # Files that were still active around the previous scan may have
+        # grown since, however long ago that scan was
+        settle_reference_time = self.__scan_start_time
+        if self.__prev_scan_start_time is not None:
+            settle_reference_time = min(settle_reference_time, self.__prev_scan_start_time)
+        self.__settle_time_ns = int(
+            (settle_reference_time - SystemScanner.__INCREMENTAL_SETTLE_TIME_IN_SECS) * 1000000000
+        )
+        self.__next_dir_cache = dict()
+        try:
+            children = self.__create_children(self.path_to_scan, os.stat(self.path_to_scan))
+            # Only the directories visited by this scan are kept, which also
+            # drops the entries of deleted directories
+            self.__dir_cache = self.__next_dir_cache
+            self.__prev_scan_start_time = self.__scan_start_time
+        finally:
+            self.__next_dir_cache = None
+        return children
+
+    def save_cache(self, path: str, max_entries: int = __CACHE_MAX_ENTRIES):
+        """
+        Save the cache of the last incremental scan to a file, so that a later
+        scanner can start from it
+        Directories beyond max_entries files are left out, and will be listed again.
+        :param path:
+        :param max_entries:
+        :return:
+        """
+        dirs = dict()
+        num_entries = 0
+        for dir_path, entry in self.__dir_cache.items():
+            num_entries += len(entry.children) + 1
+            if num_entries > max_entries:
+                break
+            # Sub-directories are saved without their children, which are in their own entries
+            dirs[dir_path] = [
+                entry.key[0], entry.key[1], entry.time_listed,
+                [
+                    [os.path.basename(child_path), child.name, child.is_dir, child.size,
+                     child.timestamp_created_ns, child.timestamp_modified_ns, pinned]
+                    for child, child_path, pinned in zip(entry.children, entry.paths, entry.pinned)
+                ]
+            ]
+        content = {
+            "version": SystemScanner.__CACHE_VERSION,
+            "config": self.__cache_config(),
+            "scan_time": self.__prev_scan_start_time,
+            "dirs": dirs
+        }
+        # Written to a temp file first, so that an interrupted save never
+        # leaves a partial cache behind
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "wb") as f:
+            f.write(zlib.compress(json.dumps(content).encode()))
+        os.replace(temp_path, path)
+
+    def load_cache(self, path: str) -> bool:
+        """
+        Load a cache saved by save_cache(), so that the next incremental scan
+        only lists the directories that changed
+        A missing or unusable cache file is ignored.
+        :param path:
+        :return: True if the cache was loaded
+        """
+        try:
+            with open(path, "rb") as f:
+                content = json.loads(zlib.decompress(f.read()).decode())
+            if content["version"] != SystemScanner.__CACHE_VERSION or content["config"] != self.__cache_config():
+                return False
+            dir_cache = dict()
+            for dir_path, (inode, mtime_ns, time_listed, children) in content["dirs"].items():
+                entry = _DirCacheEntry((inode, mtime_ns), time_listed, None)
+                for fs_name, name, is_dir, size, created_ns, modified_ns, pinned in children:
+                    entry.children.append(SystemFile(name, size, is_dir,
+                                                     time_created_ns=created_ns,
+                                                     time_modified_ns=modified_ns))
+                    entry.paths.append(os.path.join(dir_path, fs_name))
+                    entry.pinned.append(pinned)
+                dir_cache[dir_path] = entry
+            scan_time = content["scan_time"]
+        except (OSError, ValueError, zlib.error, KeyError, TypeError):
+            return False
+        self.__dir_cache = dir_cache
+        self.__prev_scan_start_time = scan_time
+        return True
+
+    def __cache_config(self) -> list:
+        """
+        Settings that a saved cache depends on
+        :return:
+        """
+        return [self.path_to_scan, self.exclude_prefixes, self.exclude_suffixes, self.__lftp_temp_file_suffix]
 
     def scan_single(self, name: str) -> SystemFile:
         """
@@ -101,6 +303,7 @@ class SystemScanner:
         else:
             raise SystemScannerError("Path does not exist: {}".format(path))
 
+        self.__start_workers()
         return self.__create_system_file(
             PseudoDirEntry(
                 name=name,
@@ -110,7 +313,48 @@ class SystemScanner:
             )
         )
 
-    def __create_system_file(self, entry) -> SystemFile:
+    def __start_workers(self):
+        # Note: the pool is created lazily so that it belongs to the process that scans
+        if self.__num_workers > 1 and self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__num_workers,
+                                                 thread_name_prefix="SystemScanner")
+            self.__free_workers = threading.Semaphore(self.__num_workers)
+
+    def __create_system_files(self, entries: list, has_status_files: list) -> List[Optional[SystemFile]]:
+        """
+        Creates the system files for a list of entries
+        Directories are handed to the worker pool while there are free workers,
+        everything else is scanned on the calling thread. A task is only ever
+        submitted to an idle worker, so workers never wait on queued tasks.
+        Entries that were deleted while scanning result in None.
+        :param entries:
+        :param has_status_files: for each entry, whether it has an lftp status file, or None if unknown
+        :return:
+        """
+        results = [None] * len(entries)
+        futures = []
+        for i, (entry, has_status_file) in enumerate(zip(entries, has_status_files)):
+            if self.__executor is not None and entry.is_dir() and self.__free_workers.acquire(blocking=False):
+                futures.append((i, self.__executor.submit(self.__create_system_file_task, entry)))
+            else:
+                try:
+                    results[i] = self.__create_system_file(entry, has_status_file)
+                except FileNotFoundError:
+                    pass
+        for i, future in futures:
+            try:
+                results[i] = future.result()
+            except FileNotFoundError:
+                pass
+        return results
+
+    def __create_system_file_task(self, entry) -> SystemFile:
+        try:
+            return self.__create_system_file(entry)
+        finally:
+            self.__free_workers.release()
+
+    def __create_system_file(self, entry, has_status_file: Optional[bool] = None) -> SystemFile:
         """
         Creates a system file from a DirEntry.
 
@@ -118,79 +362,181 @@ class SystemScanner:
              Strips out any characters not-supported in utf-8. This prevents problems
              in other systems.
 
+        Note:
+             Each entry is stat'ed at most once, and DirEntry objects from scandir
+             usually answer is_dir() without a system call. Timestamps are kept
+             as raw integers.
+
         Args:
             entry: DirEntry object
+            has_status_file: whether the entry has an lftp status file, as found
+                             by the directory listing. If None, the file system is checked.
 
         Returns:
             The SystemFile object
         """
+        entry_name = entry.name
+        if not entry_name.isascii():
+            entry_name = entry_name.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
         if entry.is_dir():
-            sub_children = self.__create_children(entry.path)
-            name = entry.name.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
-            size = sum(sub_child.size for sub_child in sub_children)
-            time_created = None
-            try:
-                time_created = datetime.fromtimestamp(entry.stat().st_birthtime)
-            except AttributeError:
-                pass
-            time_modified = datetime.fromtimestamp(entry.stat().st_mtime)
-            sys_file = SystemFile(name,
+            entry_stat = entry.stat()
+            sub_children = self.__create_children(entry.path, entry_stat)
+            if self.__next_dir_cache is not None:
+                # Reuse the previous directory object if none of its children changed
+                cache_entry = self.__next_dir_cache[entry.path]
+                if cache_entry.sys_file is not None:
+                    return cache_entry.sys_file
+            size = 0
+            for sub_child in sub_children:
+                size += sub_child.size
+            sys_file = SystemFile(entry_name,
                                   size,
                                   True,
-                                  time_created=time_created,
-                                  time_modified=time_modified)
+                                  time_created_ns=SystemScanner.__birthtime_ns(entry_stat),
+                                  time_modified_ns=entry_stat.st_mtime_ns)
             for sub_child in sub_children:
                 sys_file.add_child(sub_child)
+            if self.__next_dir_cache is not None:
+                self.__next_dir_cache[entry.path].sys_file = sys_file
         else:
-            file_size = entry.stat().st_size
+            entry_stat = entry.stat()
+            file_size = entry_stat.st_size
             # Check if it's a partial lftp file, and if so, use the lftp
             # status to get the real file size
             lftp_status_file_path = entry.path + SystemScanner.__LFTP_STATUS_FILE_SUFFIX
-            if os.path.isfile(lftp_status_file_path):
+            if has_status_file is None:
+                has_status_file = os.path.isfile(lftp_status_file_path)
+            if has_status_file:
                 with open(lftp_status_file_path, "r") as f:
                     file_size = SystemScanner._lftp_status_file_size(f.read())
             # Check to see if this is a lftp temp file, and if so, use the real name
-            file_name = entry.name.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
+            file_name = entry_name
             if self.__lftp_temp_file_suffix is not None and \
                     file_name != self.__lftp_temp_file_suffix and \
                     file_name.endswith(self.__lftp_temp_file_suffix):
                 file_name = file_name[:-len(self.__lftp_temp_file_suffix)]
-            time_created = None
-            try:
-                time_created = datetime.fromtimestamp(entry.stat().st_birthtime)
-            except AttributeError:
-                pass
-            time_modified = datetime.fromtimestamp(entry.stat().st_mtime)
             sys_file = SystemFile(file_name,
                                   file_size,
                                   False,
-                                  time_created=time_created,
-                                  time_modified=time_modified)
+                                  time_created_ns=SystemScanner.__birthtime_ns(entry_stat),
+                                  time_modified_ns=entry_stat.st_mtime_ns)
         return sys_file
 
-    def __create_children(self, path: str) -> List[SystemFile]:
-        children = []
-        # Files may get deleted while scanning, ignore the error
-        for entry in os.scandir(path):
-            # Skip excluded entries
-            skip = False
-            for prefix in self.exclude_prefixes:
-                if entry.name.startswith(prefix):
-                    skip = True
-            for suffix in self.exclude_suffixes:
-                if entry.name.endswith(suffix):
-                    skip = True
-            if skip:
-                continue
+    @staticmethod
+    def __birthtime_ns(entry_stat: os.stat_result) -> Optional[int]:
+        # Creation time is only reported on some platforms
+        birthtime = getattr(entry_stat, "st_birthtime", None)
+        if birthtime is None:
+            return None
+        return int(birthtime * 1000000000)
 
-            try:
-                sys_file = self.__create_system_file(entry)
-            except FileNotFoundError:
-                continue
-            children.append(sys_file)
+    def __create_children(self, path: str, dir_stat: os.stat_result = None) -> List[SystemFile]:
+        if self.__next_dir_cache is not None:
+            return self.__create_children_incremental(path, dir_stat)
+
+        status_file_names = set()
+        entries = self.__list_dir(path, status_file_names)
+        has_status_files = [entry.name + SystemScanner.__LFTP_STATUS_FILE_SUFFIX in status_file_names
+                            for entry in entries]
+        # Files may get deleted while scanning, ignore them
+        children = [f for f in self.__create_system_files(entries, has_status_files) if f is not None]
         children.sort(key=lambda fl: fl.name)
         return children
 
+    def __list_dir(self, path: str, status_file_names: set = None) -> List[os.DirEntry]:
+        """
+        Returns the non-excluded entries of a directory
+        :param path:
+        :param status_file_names: if given, the names of any lftp status files are added to it
+        :return:
+        """
+        entries = []
+        exclude_prefixes = tuple(self.exclude_prefixes)
+        exclude_suffixes = tuple(self.exclude_suffixes)
+        with os.scandir(path) as it:
+            for entry in it:
+                name = entry.name
+                if status_file_names is not None and name.endswith(SystemScanner.__LFTP_STATUS_FILE_SUFFIX):
+                    status_file_names.add(name)
+                # Skip excluded entries
+                if name.startswith(exclude_prefixes) or name.endswith(exclude_suffixes):
+                    continue
+                entries.append(entry)
+        return entries
+
+    def __create_children_incremental(self, path: str, dir_stat: os.stat_result) -> List[SystemFile]:
+        key = (dir_stat.st_ino, dir_stat.st_mtime_ns)
+        prev_cache_entry = self.__dir_cache.get(path, None)
+        cache_entry = _DirCacheEntry(key, self.__scan_start_time, None)
+        self.__next_dir_cache[path] = cache_entry
+
+        settle_time_ns = self.__settle_time_ns
+
+        if prev_cache_entry is not None and prev_cache_entry.key == key and \
+                self.__scan_start_time - prev_cache_entry.time_listed < SystemScanner.__INCREMENTAL_MAX_AGE_IN_SECS:
+            cache_entry.time_listed = prev_cache_entry.time_listed
+            # Directory listing is unchanged, re-stat only the children that need it
+            restat_indices = [
+                i for i, (child, pinned) in enumerate(zip(prev_cache_entry.children, prev_cache_entry.pinned))
+                if child.is_dir or pinned or
+                child.timestamp_modified_ns is None or
+                child.timestamp_modified_ns > settle_time_ns
+            ]
+            restat_files = self.__create_system_files([
+                PseudoDirEntry(
+                    name=os.path.basename(prev_cache_entry.paths[i]),
+                    path=prev_cache_entry.paths[i],
+                    is_dir=prev_cache_entry.children[i].is_dir,
+                    stat=None
+                ) for i in restat_indices
+            ], [
+                # A child without a status file at the last listing still does not
+                # have one, since adding it would have modified the directory
+                None if prev_cache_entry.pinned[i] else False for i in restat_indices
+            ])
+            restat = dict(zip(restat_indices, restat_files))
+
+            unchanged = True
+            for i, (child, child_path, pinned) in enumerate(zip(prev_cache_entry.children,
+                                                                prev_cache_entry.paths,
+                                                                prev_cache_entry.pinned)):
+                sys_file = restat.get(i, child)
+                if sys_file is None:
+                    # Deleted while scanning
+                    unchanged = False
+                    continue
+                if sys_file is not child and sys_file == child:
+                    sys_file = child
+                unchanged = unchanged and sys_file is child
+                cache_entry.children.append(sys_file)
+                cache_entry.paths.append(child_path)
+                cache_entry.pinned.append(pinned)
+            if unchanged:
+                cache_entry.sys_file = prev_cache_entry.sys_file
+            return list(cache_entry.children)
+
+        # Directory is dirty, list it again
+        # Partial lftp files and lftp temp files are pinned because they grow
+        # without modifying their directory
+        status_file_names = set()
+        entries = self.__list_dir(path, status_file_names)
+        has_status_files = [entry.name + SystemScanner.__LFTP_STATUS_FILE_SUFFIX in status_file_names
+                            for entry in entries]
+        created = []
+        for entry, has_status_file, sys_file in zip(entries,
+                                                    has_status_files,
+                                                    self.__create_system_files(entries, has_status_files)):
+            if sys_file is None:
+                continue
+            pinned = not sys_file.is_dir and (has_status_file or entry.name != sys_file.name)
+            created.append((sys_file, entry.path, pinned))
+        created.sort(key=lambda c: c[0].name)
+        for sys_file, child_path, pinned in created:
+            cache_entry.children.append(sys_file)
+            cache_entry.paths.append(child_path)
+            cache_entry.pinned.append(pinned)
+        return list(cache_entry.children)
+
     @staticmethod
     def _lftp_status_file_size(status: str) -> int:
         """
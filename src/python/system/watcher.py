@@ -0,0 +1,243 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import errno
+import json
+import os
+import select
+import time
+from typing import List, Optional, Dict, BinaryIO
+
+# my libs
+from common import AppError
+from .scanner import SystemScanner
+from .file import SystemFile
+from .inotify import Inotify, InotifyEvent, InotifyError
+
+
+class ScanWatcherError(AppError):
+    """
+    Exception indicating malformed scan watcher output
+    """
+    pass
+
+
+class ScanWatcher:
+    """
+    Watches a directory tree, and reports the roots that changed
+
+    Inotify wakes the watcher up as soon as something changes, and an
+    incremental scan then finds which roots actually changed. Only if inotify
+    is not available or runs out of watches, the tree is polled at an
+    interval instead.
+
+    Output:
+        HELLO on start, then a json line for each change: {"changed": [root names]}
+        Roots that were added, changed or removed are all reported the same way.
+    The watcher exits when its input is closed.
+    """
+    HELLO = b"SSWA\x01"
+
+    # Growing files are not watched (IN_MODIFY); they are picked up on
+    # close, or by the next poll
+    __WATCH_MASK = Inotify.IN_CREATE | \
+        Inotify.IN_DELETE | \
+        Inotify.IN_MOVED_FROM | \
+        Inotify.IN_MOVED_TO | \
+        Inotify.IN_CLOSE_WRITE | \
+        Inotify.IN_ATTRIB | \
+        Inotify.IN_DELETE_SELF | \
+        Inotify.IN_MOVE_SELF | \
+        Inotify.IN_ONLYDIR
+    # After the first event, time to wait for more so that bursts are handled by one scan
+    __COALESCE_TIME_IN_S = 0.05
+    # Minimum time between two scans, so that a stream of events does not keep the disk busy
+    __MIN_SCAN_INTERVAL_IN_S = 1.0
+
+    def __init__(self, path: str, exclude_hidden: bool = False, poll_interval_in_s: float = 5.0):
+        """
+        :param path: root directory to watch
+        :param exclude_hidden: whether to exclude hidden files
+        :param poll_interval_in_s: interval of the scans done without inotify
+        """
+        self.__scanner = SystemScanner(path)
+        self.__scanner.set_incremental(True)
+        if exclude_hidden:
+            self.__scanner.add_exclude_prefix(".")
+        self.__poll_interval_in_s = poll_interval_in_s
+        self.__inotify = None  # type: Optional[Inotify]
+        self.__watched_paths = dict()  # type: Dict[str, int]
+        self.__watch_descriptors = dict()  # type: Dict[int, str]
+        self.__roots = None  # type: Optional[Dict[str, SystemFile]]
+
+    def start(self):
+        """
+        Start watching, and take the baseline scan
+        :return:
+        """
+        if Inotify.is_supported():
+            inotify = Inotify()
+            try:
+                inotify.open()
+                self.__inotify = inotify
+            except InotifyError:
+                pass
+        self.check()
+
+    def stop(self):
+        if self.__inotify is not None:
+            self.__inotify.close()
+            self.__inotify = None
+        self.__watched_paths.clear()
+        self.__watch_descriptors.clear()
+
+    def is_using_inotify(self) -> bool:
+        return self.__inotify is not None
+
+    def check(self) -> List[str]:
+        """
+        Scan the tree
+        :return: names of the roots that changed since the previous check
+        """
+        if self.__inotify is not None:
+            self.__process_events(self.__inotify.read_events())
+        roots = {root.name: root for root in self.__scanner.scan()}
+        if self.__inotify is not None:
+            self.__update_watches()
+        prev_roots = self.__roots
+        self.__roots = roots
+        if prev_roots is None:
+            return []
+        return sorted(
+            name for name in set(roots.keys()).union(prev_roots.keys())
+            if roots.get(name, None) != prev_roots.get(name, None)
+        )
+
+    def run(self, input_fd: int, output_stream: BinaryIO):
+        """
+        Report changes until the input is closed
+        :param input_fd: file descriptor of the input
+        :param output_stream:
+        :return:
+        """
+        self.start()
+        try:
+            output_stream.write(ScanWatcher.HELLO)
+            output_stream.flush()
+            timestamp_last_check = time.monotonic()
+            while True:
+                fds = [input_fd]
+                if self.__inotify is not None:
+                    # Files that are still growing are left to the scans of the reader
+                    fds.append(self.__inotify.fileno())
+                    timeout_in_s = None
+                else:
+                    timeout_in_s = max(0.0, timestamp_last_check + self.__poll_interval_in_s - time.monotonic())
+                readable, _, _ = select.select(fds, [], [], timeout_in_s)
+                if input_fd in readable:
+                    if not os.read(input_fd, 4096):
+                        return
+                    # Any other input is ignored
+                    readable.remove(input_fd)
+                    if not readable:
+                        continue
+                if readable:
+                    # An inotify event, gather the rest of the burst and limit the rate of scans
+                    time.sleep(max(ScanWatcher.__COALESCE_TIME_IN_S,
+                                   timestamp_last_check + ScanWatcher.__MIN_SCAN_INTERVAL_IN_S - time.monotonic()))
+                timestamp_last_check = time.monotonic()
+                changed = self.check()
+                if changed:
+                    output_stream.write(json.dumps({"changed": changed}).encode() + b"\n")
+                    output_stream.flush()
+        except BrokenPipeError:
+            # Reader is gone
+            return
+        finally:
+            self.stop()
+
+    def __process_events(self, events: List[InotifyEvent]):
+        for event in events:
+            if event.mask & Inotify.IN_Q_OVERFLOW:
+                self.__scanner.clear_cache()
+                continue
+            path = self.__watch_descriptors.get(event.wd, None)
+            if path is None:
+                continue
+            if event.mask & Inotify.IN_IGNORED:
+                # Watch was removed because the directory is gone
+                del self.__watch_descriptors[event.wd]
+                if self.__watched_paths.get(path, None) == event.wd:
+                    del self.__watched_paths[path]
+            self.__scanner.invalidate_dir(path)
+
+    def __update_watches(self):
+        scanned_paths = set(self.__scanner.get_cached_dir_paths())
+        for path in scanned_paths.difference(self.__watched_paths.keys()):
+            try:
+                wd = self.__inotify.add_watch(path, ScanWatcher.__WATCH_MASK)
+            except InotifyError as e:
+                if e.error_number == errno.ENOSPC:
+                    # Out of watches, fall back to polling
+                    self.stop()
+                    return
+                # Directory may have been deleted since it was scanned
+                continue
+            self.__watched_paths[path] = wd
+            self.__watch_descriptors[wd] = path
+
+        for path in set(self.__watched_paths.keys()).difference(scanned_paths):
+            wd = self.__watched_paths.pop(path)
+            # A moved directory keeps its watch descriptor, which is now mapped to the new path
+            if self.__watch_descriptors.get(wd, None) == path:
+                del self.__watch_descriptors[wd]
+                self.__inotify.rm_watch(wd)
+
+
+class ScanWatcherReader:
+    """
+    Incremental parser of a scan watcher's output, on the reader side
+    """
+    # Longest accepted notification line
+    __MAX_LINE_SIZE = 16 * 1024 * 1024
+
+    def __init__(self):
+        self.__buffer = bytearray()
+        self.__has_hello = False
+
+    @property
+    def has_hello(self) -> bool:
+        return self.__has_hello
+
+    def feed(self, data: bytes) -> List[List[str]]:
+        """
+        Feed output of the watcher
+        Output before the hello is skipped if it is whitespace.
+        :param data:
+        :return: changed root names of each completed notification
+        """
+        self.__buffer += data
+        if not self.__has_hello:
+            stripped = self.__buffer.lstrip()
+            if len(stripped) < len(ScanWatcher.HELLO):
+                if not ScanWatcher.HELLO.startswith(bytes(stripped)):
+                    raise ScanWatcherError("Bad hello: {}".format(bytes(stripped)))
+                return []
+            if not stripped.startswith(ScanWatcher.HELLO):
+                raise ScanWatcherError("Bad hello: {}".format(bytes(stripped)))
+            self.__buffer = stripped[len(ScanWatcher.HELLO):]
+            self.__has_hello = True
+
+        notifications = []
+        lines = self.__buffer.split(b"\n")
+        self.__buffer = lines.pop()
+        if len(self.__buffer) > ScanWatcherReader.__MAX_LINE_SIZE:
+            raise ScanWatcherError("Notification is too long")
+        for line in lines:
+            try:
+                changed = json.loads(line.decode())["changed"]
+            except (ValueError, KeyError, TypeError) as e:
+                raise ScanWatcherError("Malformed notification: {}".format(str(e)))
+            if not isinstance(changed, list):
+                raise ScanWatcherError("Malformed notification: {}".format(bytes(line)))
+            notifications.append(changed)
+        return notifications
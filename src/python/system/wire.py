@@ -0,0 +1,562 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import zlib
+from typing import List, Union, Iterable, Iterator, Optional
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# my libs
+from common import AppError
+from .file import SystemFile
+
+
+class WireFormatError(AppError):
+    """
+    Exception indicating malformed or unsupported wire data
+    """
+    pass
+
+
+class WireFormat:
+    """
+    Compact binary encoding of a scanned file tree, shared by scan_fs and
+    the remote scanner
+
+    Layout:
+        header:  MAGIC, VERSION byte
+        meta:    varint byte-length followed by the delta fields, empty for a plain scan
+        frames:  one per root file, varint byte-length followed by the root's
+                 node, so that each root can be decoded (or skipped) on its own
+        trailer: a zero-length frame, then the TRAILER bytes
+
+    Delta fields, see ScanDeltaState:
+        string    generation of this scan
+        string    generation the delta applies to, empty for a full scan
+        varint    number of removed roots, followed by their names
+        The frames of a delta hold only the added and changed roots.
+        Strings are a varint byte-length followed by utf-8 bytes.
+
+    Node, depth-first:
+        varint    flags (is_dir, has created time, has modified time)
+        varint    number of leading name bytes shared with the previous sibling
+        varint    length of the remaining name bytes, followed by the bytes (utf-8)
+        varint    size, files only (a directory's size is the sum of its children)
+        zigzag    created time in ns, delta from the previous created time in the frame
+        zigzag    modified time in ns, delta from the previous modified time in the frame
+        varint    number of children, directories only, followed by the children
+
+    A compressed stream is COMPRESSED_MAGIC, a compression method byte, the
+    compressed plain stream, and the TRAILER bytes.
+
+    Note: the output never begins or ends with whitespace, so it survives
+          the output stripping done by ssh shell commands
+    """
+    MAGIC = b"SSFW"
+    COMPRESSED_MAGIC = b"SSFZ"
+    VERSION = 2
+    TRAILER = b"END"
+
+    COMPRESSION_NONE = "none"
+    COMPRESSION_ZLIB = "zlib"
+    COMPRESSION_LZMA = "lzma"
+
+    # Method byte of each compression in a compressed stream
+    _COMPRESSION_IDS = {
+        COMPRESSION_ZLIB: 1,
+        COMPRESSION_LZMA: 2,
+    }
+
+    @staticmethod
+    def supported_compressions() -> List[str]:
+        """
+        Returns the compressions available on this system
+        :return:
+        """
+        compressions = [WireFormat.COMPRESSION_NONE, WireFormat.COMPRESSION_ZLIB]
+        if lzma is not None:
+            compressions.append(WireFormat.COMPRESSION_LZMA)
+        return compressions
+
+    @staticmethod
+    def encode(files: List[SystemFile], share_prefixes: bool = True) -> bytes:
+        """
+        Encode a list of root files
+        :param files:
+        :param share_prefixes: whether names share leading bytes with their previous sibling
+        :return:
+        """
+        return b"".join(WireFormat.iter_encode(files, share_prefixes))
+
+    @staticmethod
+    def iter_encode(files: List[SystemFile], share_prefixes: bool = True) -> Iterator[bytes]:
+        """
+        Encode a list of root files, one frame at a time
+        :param files:
+        :param share_prefixes: whether names share leading bytes with their previous sibling
+        :return: header, frame and trailer chunks
+        """
+        return WireFormat.iter_stream(WireFormat.encode_frame(file, share_prefixes) for file in files)
+
+    @staticmethod
+    def encode_frame(file: SystemFile, share_prefixes: bool = True) -> bytes:
+        """
+        Encode the frame of a single root file
+        :param file:
+        :param share_prefixes: whether names share leading bytes with their previous sibling
+        :return:
+        """
+        # Frames are self-contained, so roots share no state
+        node = bytearray()
+        _encode_node(node, file, b"", share_prefixes, [0, 0])
+        frame = bytearray()
+        _write_varint(frame, len(node))
+        frame += node
+        return bytes(frame)
+
+    @staticmethod
+    def iter_stream(frames: Iterable[bytes],
+                    generation: Optional[str] = None,
+                    base_generation: Optional[str] = None,
+                    removed_names: Iterable[str] = ()) -> Iterator[bytes]:
+        """
+        Wrap encoded frames into a stream
+        :param frames: output of encode_frame()
+        :param generation: generation of the scan, if it is part of a delta sequence
+        :param base_generation: generation the frames are a delta against, None for a full scan
+        :param removed_names: names of the roots removed since the base generation
+        :return: header, frame and trailer chunks
+        """
+        meta = bytearray()
+        if generation is not None:
+            _write_string(meta, generation)
+            _write_string(meta, base_generation or "")
+            removed_names = list(removed_names)
+            _write_varint(meta, len(removed_names))
+            for name in removed_names:
+                _write_string(meta, name)
+        header = bytearray(WireFormat.MAGIC)
+        header.append(WireFormat.VERSION)
+        _write_varint(header, len(meta))
+        header += meta
+        yield bytes(header)
+        yield from frames
+        yield b"\x00" + WireFormat.TRAILER
+
+    @staticmethod
+    def iter_compress(chunks: Iterable[bytes], compression: str, level: int = 6) -> Iterator[bytes]:
+        """
+        Compress an encoded stream
+        :param chunks: output of iter_encode()
+        :param compression: one of the COMPRESSION_* values
+        :param level: compression level, 0-9
+        :return: compressed stream chunks
+        """
+        if compression == WireFormat.COMPRESSION_NONE:
+            yield from chunks
+            return
+        if compression not in WireFormat.supported_compressions():
+            raise ValueError("Unsupported compression: {}".format(compression))
+        if not 0 <= level <= 9:
+            raise ValueError("Compression level must be between 0 and 9")
+        if compression == WireFormat.COMPRESSION_ZLIB:
+            compressor = zlib.compressobj(level)
+        else:
+            compressor = lzma.LZMACompressor(preset=level)
+        yield WireFormat.COMPRESSED_MAGIC + bytes([WireFormat._COMPRESSION_IDS[compression]])
+        for chunk in chunks:
+            out = compressor.compress(chunk)
+            if out:
+                yield out
+        yield compressor.flush()
+        yield WireFormat.TRAILER
+
+    @staticmethod
+    def decode(data: Union[bytes, bytearray, memoryview]) -> List[SystemFile]:
+        """
+        Decode the output of encode() or iter_compress()
+        :param data:
+        :return:
+        """
+        decoder = WireFormatDecoder()
+        files = decoder.feed(data)
+        decoder.close()
+        return files
+
+
+class WireFormatDecoder:
+    """
+    Incremental decoder of a plain or compressed wire stream
+    Each root file is returned as soon as its frame is complete, and
+    compressed input is inflated in bounded chunks, so neither the whole
+    compressed nor the whole decompressed stream has to be held in memory
+    """
+    # Size of the compressed chunks handed to the decompressor
+    __DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+    __HEADER_SIZE = len(WireFormat.MAGIC) + 1
+
+    __DECOMPRESS_ERRORS = (zlib.error, EOFError) + ((lzma.LZMAError,) if lzma is not None else ())
+
+    def __init__(self):
+        self.__header = bytearray()
+        self.__header_parsed = False
+        self.__buffer = bytearray()
+        self.__meta_parsed = False
+        self.__generation = None  # type: Optional[str]
+        self.__base_generation = None  # type: Optional[str]
+        self.__removed_names = []  # type: List[str]
+        self.__finished = False
+        self.__tail = bytearray()
+        self.__num_bytes_received = 0
+        # Compressed streams only
+        self.__compression = WireFormat.COMPRESSION_NONE
+        self.__decompressor = None
+        self.__inner = None  # type: Optional[WireFormatDecoder]
+
+    @property
+    def compression(self) -> str:
+        """
+        Compression of the stream, known once its header is received
+        :return:
+        """
+        return self.__compression
+
+    @property
+    def generation(self) -> Optional[str]:
+        """
+        Generation of the scan, None if the stream is not part of a delta sequence
+        :return:
+        """
+        return self.__inner.generation if self.__inner is not None else self.__generation
+
+    @property
+    def base_generation(self) -> Optional[str]:
+        """
+        Generation that the stream is a delta against, None for a full scan
+        :return:
+        """
+        return self.__inner.base_generation if self.__inner is not None else self.__base_generation
+
+    @property
+    def removed_names(self) -> List[str]:
+        """
+        Names of the roots removed since the base generation
+        :return:
+        """
+        return self.__inner.removed_names if self.__inner is not None else self.__removed_names
+
+    @property
+    def num_bytes_received(self) -> int:
+        return self.__num_bytes_received
+
+    @property
+    def num_bytes_decoded(self) -> int:
+        """
+        Size of the uncompressed stream received so far
+        :return:
+        """
+        return self.__inner.num_bytes_received if self.__inner is not None else self.__num_bytes_received
+
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> List[SystemFile]:
+        """
+        Decode the next piece of the stream
+        :param data:
+        :return: the root files completed by this piece, in order
+        """
+        self.__num_bytes_received += len(data)
+        if not self.__header_parsed:
+            needed = WireFormatDecoder.__HEADER_SIZE - len(self.__header)
+            self.__header += data[:needed]
+            data = data[needed:]
+            if len(self.__header) < WireFormatDecoder.__HEADER_SIZE:
+                return []
+            self.__parse_header()
+
+        if self.__inner is not None:
+            return self.__feed_compressed(data)
+        if self.__finished:
+            self.__tail += data
+            return []
+        self.__buffer += data
+        return self.__decode_frames()
+
+    def close(self):
+        """
+        Check that the stream was complete
+        :return:
+        """
+        if not self.__header_parsed:
+            raise WireFormatError("Missing wire format header")
+        if self.__inner is not None:
+            if not self.__decompressor.eof:
+                raise WireFormatError("Truncated compressed wire data")
+            self.__inner.close()
+        elif not self.__finished:
+            raise WireFormatError("Truncated wire data")
+        if self.__tail != WireFormat.TRAILER:
+            raise WireFormatError("Missing wire format trailer")
+
+    def __parse_header(self):
+        self.__header_parsed = True
+        magic = bytes(self.__header[:len(WireFormat.MAGIC)])
+        code = self.__header[len(WireFormat.MAGIC)]
+        if magic == WireFormat.MAGIC:
+            if code != WireFormat.VERSION:
+                raise WireFormatError("Unsupported wire format version {}".format(code))
+        elif magic == WireFormat.COMPRESSED_MAGIC:
+            if code == WireFormat._COMPRESSION_IDS[WireFormat.COMPRESSION_ZLIB]:
+                self.__compression = WireFormat.COMPRESSION_ZLIB
+                self.__decompressor = zlib.decompressobj()
+            elif code == WireFormat._COMPRESSION_IDS[WireFormat.COMPRESSION_LZMA] and lzma is not None:
+                self.__compression = WireFormat.COMPRESSION_LZMA
+                self.__decompressor = lzma.LZMADecompressor()
+            else:
+                raise WireFormatError("Unsupported wire format compression {}".format(code))
+            self.__inner = WireFormatDecoder()
+        else:
+            raise WireFormatError("Missing wire format header")
+
+    def __feed_compressed(self, data) -> List[SystemFile]:
+        files = []
+        view = memoryview(data)
+        for start in range(0, len(view), WireFormatDecoder.__DECOMPRESS_CHUNK_SIZE):
+            chunk = view[start:start + WireFormatDecoder.__DECOMPRESS_CHUNK_SIZE]
+            if self.__decompressor.eof:
+                self.__tail += chunk
+                continue
+            try:
+                out = self.__decompressor.decompress(chunk)
+            except WireFormatDecoder.__DECOMPRESS_ERRORS as e:
+                raise WireFormatError("Malformed compressed wire data: {}".format(str(e)))
+            files += self.__inner.feed(out)
+            if self.__decompressor.eof:
+                self.__tail += self.__decompressor.unused_data
+        return files
+
+    def __decode_frames(self) -> List[SystemFile]:
+        files = []
+        pos = 0
+        with memoryview(self.__buffer) as view:
+            if not self.__meta_parsed:
+                try:
+                    meta_size, start = _read_varint(view, pos)
+                except IndexError:
+                    return files
+                if start + meta_size > len(view):
+                    return files
+                try:
+                    self.__parse_meta(view[start:start + meta_size])
+                except IndexError:
+                    raise WireFormatError("Malformed wire format meta data")
+                self.__meta_parsed = True
+                pos = start + meta_size
+            while True:
+                try:
+                    frame_size, start = _read_varint(view, pos)
+                except IndexError:
+                    # Frame size is incomplete
+                    break
+                if frame_size == 0:
+                    self.__finished = True
+                    self.__tail += view[start:]
+                    pos = len(view)
+                    break
+                end = start + frame_size
+                if end > len(view):
+                    break
+                try:
+                    file, _, node_end = _decode_node(view[:end], start, b"", [0, 0])
+                except IndexError:
+                    raise WireFormatError("Truncated wire data")
+                if node_end != end:
+                    raise WireFormatError("Frame size mismatch")
+                files.append(file)
+                pos = end
+        del self.__buffer[:pos]
+        return files
+
+    def __parse_meta(self, view: memoryview):
+        if not view:
+            return
+        self.__generation, pos = _read_string(view, 0)
+        self.__base_generation, pos = _read_string(view, pos)
+        self.__base_generation = self.__base_generation or None
+        num_removed, pos = _read_varint(view, pos)
+        for _ in range(num_removed):
+            name, pos = _read_string(view, pos)
+            self.__removed_names.append(name)
+        if pos != len(view):
+            raise WireFormatError("Malformed wire format meta data")
+
+
+_FLAG_IS_DIR = 0x01
+_FLAG_HAS_CREATED = 0x02
+_FLAG_HAS_MODIFIED = 0x04
+
+
+def _encode_node(out: bytearray,
+                 file: SystemFile,
+                 prev_name: bytes,
+                 share_prefixes: bool,
+                 prev_times: list) -> bytes:
+    """
+    Encode a file and its children
+    :param out:
+    :param file:
+    :param prev_name: encoded name of the previous sibling
+    :param share_prefixes:
+    :param prev_times: previous [created, modified] times in the frame, updated in place
+    :return: encoded name of the file
+    """
+    name = file.name.encode("utf-8")
+    created = file.timestamp_created_ns
+    modified = file.timestamp_modified_ns
+    flags = 0
+    if file.is_dir:
+        flags |= _FLAG_IS_DIR
+    if created is not None:
+        flags |= _FLAG_HAS_CREATED
+    if modified is not None:
+        flags |= _FLAG_HAS_MODIFIED
+    _write_varint(out, flags)
+
+    shared = 0
+    if share_prefixes:
+        max_shared = min(len(name), len(prev_name))
+        while shared < max_shared and name[shared] == prev_name[shared]:
+            shared += 1
+    _write_varint(out, shared)
+    _write_varint(out, len(name) - shared)
+    out += name[shared:]
+
+    if not file.is_dir:
+        _write_varint(out, file.size)
+    if created is not None:
+        _write_zigzag(out, created - prev_times[0])
+        prev_times[0] = created
+    if modified is not None:
+        _write_zigzag(out, modified - prev_times[1])
+        prev_times[1] = modified
+
+    if file.is_dir:
+        children = file.children
+        _write_varint(out, len(children))
+        prev_child_name = b""
+        for child in children:
+            prev_child_name = _encode_node(out, child, prev_child_name, share_prefixes, prev_times)
+    return name
+
+
+def _decode_node(view: memoryview, pos: int, prev_name: bytes, prev_times: list) -> tuple:
+    """
+    Decode a file and its children
+    :param view:
+    :param pos:
+    :param prev_name: encoded name of the previous sibling
+    :param prev_times: previous [created, modified] times in the frame, updated in place
+    :return: (file, encoded name of the file, position after the file)
+    """
+    # Flags and name lengths nearly always fit in a single byte
+    flags = view[pos]
+    if flags < 0x80:
+        pos += 1
+    else:
+        flags, pos = _read_varint(view, pos)
+    shared = view[pos]
+    if shared < 0x80:
+        pos += 1
+    else:
+        shared, pos = _read_varint(view, pos)
+    length = view[pos]
+    if length < 0x80:
+        pos += 1
+    else:
+        length, pos = _read_varint(view, pos)
+    end = pos + length
+    if shared > len(prev_name) or end > len(view):
+        raise WireFormatError("Malformed file name")
+    if shared:
+        name = prev_name[:shared] + view[pos:end]
+    else:
+        name = view[pos:end].tobytes()
+    pos = end
+    is_dir = bool(flags & _FLAG_IS_DIR)
+
+    size = 0
+    if not is_dir:
+        size, pos = _read_varint(view, pos)
+    created = None
+    if flags & _FLAG_HAS_CREATED:
+        delta, pos = _read_varint(view, pos)
+        created = prev_times[0] + ((delta >> 1) ^ -(delta & 1))
+        prev_times[0] = created
+    modified = None
+    if flags & _FLAG_HAS_MODIFIED:
+        delta, pos = _read_varint(view, pos)
+        modified = prev_times[1] + ((delta >> 1) ^ -(delta & 1))
+        prev_times[1] = modified
+
+    children = None
+    if is_dir:
+        num_children, pos = _read_varint(view, pos)
+        children = []
+        prev_child_name = b""
+        for _ in range(num_children):
+            child, prev_child_name, pos = _decode_node(view, pos, prev_child_name, prev_times)
+            children.append(child)
+            size += child.size
+
+    try:
+        decoded_name = name.decode("utf-8")
+    except UnicodeDecodeError:
+        raise WireFormatError("Malformed file name")
+    file = SystemFile(decoded_name, size, is_dir, time_created_ns=created, time_modified_ns=modified)
+    if children:
+        for child in children:
+            file.add_child(child)
+    return file, name, pos
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_zigzag(out: bytearray, value: int):
+    _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+
+def _write_string(out: bytearray, value: str):
+    data = value.encode("utf-8")
+    _write_varint(out, len(data))
+    out += data
+
+
+def _read_string(view: memoryview, pos: int) -> tuple:
+    length, pos = _read_varint(view, pos)
+    if pos + length > len(view):
+        raise WireFormatError("Malformed string")
+    try:
+        return str(view[pos:pos + length], "utf-8"), pos + length
+    except UnicodeDecodeError:
+        raise WireFormatError("Malformed string")
+
+
+def _read_varint(view: memoryview, pos: int) -> tuple:
+    byte = view[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        byte = view[pos]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
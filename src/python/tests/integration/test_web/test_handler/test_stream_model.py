@@ -1,80 +1,143 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
-import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 from threading import Timer
 
 from tests.integration.test_web.test_web_app import BaseTestWebApp
 from web.serialize import SerializeModel
-from model import ModelFile
+from model import ModelFile, ModelJournal
 
 
 class TestModelStreamHandler(BaseTestWebApp):
-    def test_stream_model_fetches_model_and_adds_listener(self):
+    @patch("web.serialize.SerializeModel.model")
+    def test_stream_model_serializes_initial_model(self, mock_model):
         # Schedule server stop
         Timer(0.5, self.web_app.stop).start()
 
-        self.test_app.get("/server/stream")
-        self.controller.get_model_files_and_add_listener.assert_called_once_with(unittest.mock.ANY)
-
-    def test_stream_model_removes_listener(self):
-        # Schedule server stop
-        Timer(0.5, self.web_app.stop).start()
-
-        self.test_app.get("/server/stream")
-        self.controller.remove_model_listener.assert_called_once_with(self.model_listener)
-
-    @patch("web.handler.stream_model.SerializeModel")
-    def test_stream_model_serializes_initial_model(self, mock_serialize_model_cls):
-        # Schedule server stop
-        Timer(0.5, self.web_app.stop).start()
-
-        # Setup mock serialize instance
-        mock_serialize = mock_serialize_model_cls.return_value
-        mock_serialize.model.return_value = "\n"
+        # Setup mock serialize methods
+        mock_model.return_value = "\n"
 
         # Initial model
-        self.model_files = [ModelFile("a", True), ModelFile("b", False)]
+        self.model.add_file(ModelFile("a", True))
+        self.model.add_file(ModelFile("b", False))
+        self.model.publish_snapshot()
 
         self.test_app.get("/server/stream")
-        mock_serialize.model.assert_called_once_with([ModelFile("a", True), ModelFile("b", False)])
+        mock_model.assert_called_once_with((ModelFile("a", True), ModelFile("b", False)),
+                                           event_id=self.model_journal.to_event_id(2))
 
-    @patch("web.handler.stream_model.SerializeModel")
-    def test_stream_model_serializes_updates(self, mock_serialize_model_cls):
+    @patch("web.serialize.SerializeModel.update_event")
+    @patch("web.serialize.SerializeModel.model")
+    def test_stream_model_serializes_updates(self, mock_model, mock_update_event):
         # Schedule server stop
         Timer(2.0, self.web_app.stop).start()
 
-        # Setup mock serialize instance
-        mock_serialize = mock_serialize_model_cls.return_value
-        mock_serialize.model.return_value = "\n"
-        mock_serialize.update_event.return_value = "\n"
-        # Use the real UpdateEvent class
-        mock_serialize_model_cls.UpdateEvent = SerializeModel.UpdateEvent
+        # Setup mock serialize methods
+        mock_model.return_value = "\n"
+        mock_update_event.return_value = "\n"
 
-        # Queue updates
-        added_file = ModelFile("a", True)
+        # Initial model
         removed_file = ModelFile("b", False)
         old_file = ModelFile("c", False)
         old_file.local_size = 100
+        self.model.add_file(removed_file)
+        self.model.add_file(old_file)
+        self.model.publish_snapshot()
+
+        # Queue updates
+        added_file = ModelFile("a", True)
         new_file = ModelFile("c", False)
         new_file.local_size = 200
 
         def send_updates():
-            self.assertIsNotNone(self.model_listener)
-            self.model_listener.file_added(added_file)
-            self.model_listener.file_removed(removed_file)
-            self.model_listener.file_updated(old_file, new_file)
+            self.model.add_file(added_file)
+            self.model.remove_file("b")
+            self.model.update_file(new_file)
+            self.model.publish_snapshot()
         Timer(0.5, send_updates).start()
 
         self.test_app.get("/server/stream")
-        self.assertEqual(3, len(mock_serialize.update_event.call_args_list))
-        call1, call2, call3 = mock_serialize.update_event.call_args_list
+        mock_model.assert_called_once_with((removed_file, old_file),
+                                           event_id=self.model_journal.to_event_id(2))
+        self.assertEqual(3, len(mock_update_event.call_args_list))
+        call1, call2, call3 = mock_update_event.call_args_list
         self.assertEqual(SerializeModel.UpdateEvent.Change.ADDED, call1[0][0].change)
         self.assertEqual(None, call1[0][0].old_file)
         self.assertEqual(added_file, call1[0][0].new_file)
+        self.assertEqual(self.model_journal.to_event_id(3), call1[1]["event_id"])
         self.assertEqual(SerializeModel.UpdateEvent.Change.REMOVED, call2[0][0].change)
         self.assertEqual(removed_file, call2[0][0].old_file)
         self.assertEqual(None, call2[0][0].new_file)
+        self.assertEqual(self.model_journal.to_event_id(4), call2[1]["event_id"])
         self.assertEqual(SerializeModel.UpdateEvent.Change.UPDATED, call3[0][0].change)
         self.assertEqual(old_file, call3[0][0].old_file)
         self.assertEqual(new_file, call3[0][0].new_file)
+        self.assertEqual(self.model_journal.to_event_id(5), call3[1]["event_id"])
+
+    @patch("web.serialize.SerializeModel.update_event")
+    @patch("web.serialize.SerializeModel.model")
+    def test_stream_model_resumes_from_last_event_id(self, mock_model, mock_update_event):
+        # Schedule server stop
+        Timer(0.5, self.web_app.stop).start()
+
+        # Setup mock serialize methods
+        mock_model.return_value = "\n"
+        mock_update_event.return_value = "\n"
+
+        self.model.add_file(ModelFile("a", True))
+        self.model.add_file(ModelFile("b", True))
+        self.model.add_file(ModelFile("c", True))
+        self.model.publish_snapshot()
+
+        self.test_app.get("/server/stream", headers={"Last-Event-ID": self.model_journal.to_event_id(1)})
+        mock_model.assert_not_called()
+        self.assertEqual(2, len(mock_update_event.call_args_list))
+        call1, call2 = mock_update_event.call_args_list
+        self.assertEqual(ModelFile("b", True), call1[0][0].new_file)
+        self.assertEqual(self.model_journal.to_event_id(2), call1[1]["event_id"])
+        self.assertEqual(ModelFile("c", True), call2[0][0].new_file)
+        self.assertEqual(self.model_journal.to_event_id(3), call2[1]["event_id"])
+
+    @patch("web.serialize.SerializeModel.update_event")
+    @patch("web.serialize.SerializeModel.model")
+    def test_stream_model_sends_model_for_unknown_last_event_id(self, mock_model, mock_update_event):
+        # Schedule server stop
+        Timer(0.5, self.web_app.stop).start()
+
+        # Setup mock serialize methods
+        mock_model.return_value = "\n"
+        mock_update_event.return_value = "\n"
+
+        self.model.add_file(ModelFile("a", True))
+        self.model.publish_snapshot()
+
+        # An id from before a restart
+        self.test_app.get("/server/stream", headers={"Last-Event-ID": "0badc0de-1"})
+        mock_model.assert_called_once_with((ModelFile("a", True),),
+                                           event_id=self.model_journal.to_event_id(1))
+        mock_update_event.assert_not_called()
+
+    @patch("web.serialize.SerializeModel.update_event")
+    @patch("web.serialize.SerializeModel.model")
+    def test_stream_model_sends_model_for_evicted_last_event_id(self, mock_model, mock_update_event):
+        # Schedule server stop
+        Timer(0.5, self.web_app.stop).start()
+
+        # Setup mock serialize methods
+        mock_model.return_value = "\n"
+        mock_update_event.return_value = "\n"
+
+        # A smaller journal
+        self.model.remove_listener(self.model_journal)
+        self.model_journal = ModelJournal(self.model, capacity=2)
+        self.model.add_listener(self.model_journal)
+        self.controller.get_model_journal.return_value = self.model_journal
+
+        for name in ["a", "b", "c", "d"]:
+            self.model.add_file(ModelFile(name, True))
+        self.model.publish_snapshot()
+
+        self.test_app.get("/server/stream", headers={"Last-Event-ID": self.model_journal.to_event_id(1)})
+        self.assertEqual(1, len(mock_model.call_args_list))
+        self.assertEqual(self.model_journal.to_event_id(4), mock_model.call_args[1]["event_id"])
+        mock_update_event.assert_not_called()
@@ -9,6 +9,7 @@ from webtest import TestApp
 
 from common import overrides, Status, Config
 from controller import AutoQueuePersist
+from model import Model, ModelJournal
 from web import WebAppBuilder
 
 
@@ -31,9 +32,6 @@ class BaseTestWebApp(unittest.TestCase):
         handler.setFormatter(formatter)
         self.context.logger = logger
 
-        # Model files
-        self.model_files = []
-
         # Real status
         self.context.status = Status()
 
@@ -43,14 +41,12 @@ class BaseTestWebApp(unittest.TestCase):
         # Real auto-queue persist
         self.auto_queue_persist = AutoQueuePersist()
 
-        # Capture the model listener
-        def capture_listener(listener):
-            self.model_listener = listener
-            return self.model_files
-        self.model_listener = None
-        self.controller.get_model_files_and_add_listener = MagicMock()
-        self.controller.get_model_files_and_add_listener.side_effect = capture_listener
-        self.controller.remove_model_listener = MagicMock()
+        # Real model and journal
+        self.model = Model()
+        self.model_journal = ModelJournal(self.model)
+        self.model.add_listener(self.model_journal)
+        self.controller.get_model_snapshot.side_effect = self.model.get_snapshot
+        self.controller.get_model_journal.return_value = self.model_journal
 
         # noinspection PyTypeChecker
         self.web_app_builder = WebAppBuilder(self.context,
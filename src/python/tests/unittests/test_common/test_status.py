@@ -133,6 +133,8 @@ class TestStatus(unittest.TestCase):
         self.assertEqual(None, status.server.error_msg)
         self.assertEqual(None, status.controller.latest_local_scan_time)
         self.assertEqual(None, status.controller.latest_remote_scan_time)
+        self.assertEqual(None, status.controller.local_scan_interval_in_ms)
+        self.assertEqual(None, status.controller.remote_scan_interval_in_ms)
 
     def test_components_registered(self):
         # Test that all components were registered
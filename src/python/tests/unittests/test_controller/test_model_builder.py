@@ -1322,6 +1322,31 @@ class TestModelBuilder(unittest.TestCase):
         self.model_builder.set_active_files([])
         self.assertFalse(self.model_builder.has_changes())
 
+    def test_rebuild_on_remote_active_files(self):
+        self.model_builder.set_remote_files([
+            SystemFile("a", 10),
+            SystemFile("b", 20)
+        ])
+        self.model_builder.build_model()
+        self.assertFalse(self.model_builder.has_changes())
+
+        # Does not invalidate on same files
+        self.model_builder.set_remote_active_files([SystemFile("a", 10)])
+        self.assertFalse(self.model_builder.has_changes())
+
+        # Partial scan is merged over the full scan
+        self.model_builder.set_remote_active_files([SystemFile("b", 30), SystemFile("c", 5)])
+        self.assertTrue(self.model_builder.has_changes())
+        model = self.model_builder.build_model()
+        self.assertEqual({"a", "b", "c"}, model.get_file_names())
+        self.assertEqual(10, model.get_file("a").remote_size)
+        self.assertEqual(30, model.get_file("b").remote_size)
+
+        # Next full scan replaces it
+        self.model_builder.set_remote_files([SystemFile("a", 10)])
+        model = self.model_builder.build_model()
+        self.assertEqual({"a"}, model.get_file_names())
+
     def test_rebuild_on_local_files(self):
         self.assertTrue(self.model_builder.has_changes())
 
@@ -1453,3 +1478,59 @@ class TestModelBuilder(unittest.TestCase):
         # Invalidate on different
         self.model_builder.set_extracted_files({"a", "c"})
         self.assertTrue(self.model_builder.has_changes())
+
+    def test_rebuild_reuses_unchanged_roots(self):
+        self.model_builder.set_remote_files([SystemFile("a", 10), SystemFile("b", 20)])
+        self.model_builder.set_local_files([SystemFile("a", 5)])
+        s1 = LftpJobStatus(1, LftpJobStatus.Type.PGET, LftpJobStatus.State.RUNNING, "a", "")
+        s1.total_transfer_state = LftpJobStatus.TransferState(5, 10, 50, 100, 1)
+        self.model_builder.set_lftp_statuses([s1])
+        model_1 = self.model_builder.build_model()
+
+        # Only the downloading root changes
+        s2 = LftpJobStatus(1, LftpJobStatus.Type.PGET, LftpJobStatus.State.RUNNING, "a", "")
+        s2.total_transfer_state = LftpJobStatus.TransferState(5, 10, 50, 200, 1)
+        self.model_builder.set_lftp_statuses([s2])
+        model_2 = self.model_builder.build_model()
+        self.assertIs(model_1.get_file("b"), model_2.get_file("b"))
+        self.assertIsNot(model_1.get_file("a"), model_2.get_file("a"))
+        self.assertEqual(100, model_1.get_file("a").downloading_speed)
+        self.assertEqual(200, model_2.get_file("a").downloading_speed)
+
+        # Removed root is dropped, the others are still reused
+        self.model_builder.set_remote_files([SystemFile("a", 10)])
+        self.model_builder.set_lftp_statuses([])
+        model_3 = self.model_builder.build_model()
+        self.assertEqual({"a"}, model_3.get_file_names())
+
+        # Clear drops all of them
+        self.model_builder.clear()
+        self.model_builder.set_remote_files([SystemFile("b", 20)])
+        model_4 = self.model_builder.build_model()
+        self.assertIsNot(model_2.get_file("b"), model_4.get_file("b"))
+        self.assertEqual(model_2.get_file("b"), model_4.get_file("b"))
+
+    def test_rebuild_on_downloaded_files_updated_in_place(self):
+        self.model_builder.set_remote_files([SystemFile("a", 10)])
+        downloaded_files = set()
+        self.model_builder.set_downloaded_files(downloaded_files)
+        model = self.model_builder.build_model()
+        self.assertEqual(ModelFile.State.DEFAULT, model.get_file("a").state)
+
+        # The caller's set is updated in place, as the controller does
+        downloaded_files.add("a")
+        self.model_builder.set_downloaded_files(downloaded_files)
+        self.assertTrue(self.model_builder.has_changes())
+        model = self.model_builder.build_model()
+        self.assertEqual(ModelFile.State.DELETED, model.get_file("a").state)
+
+    def test_build_freezes_files(self):
+        remote_a = SystemFile("a", 10, True)
+        remote_a.add_child(SystemFile("aa", 10, False))
+        self.model_builder.set_remote_files([remote_a, SystemFile("b", 10, False)])
+        model = self.model_builder.build_model()
+        self.assertTrue(model.get_file("a").is_frozen)
+        self.assertTrue(model.get_file("a").get_children()[0].is_frozen)
+        self.assertTrue(model.get_file("b").is_frozen)
+        with self.assertRaises(TypeError):
+            model.get_file("b").local_size = 10
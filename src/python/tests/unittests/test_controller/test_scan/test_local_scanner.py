@@ -0,0 +1,95 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from controller.scan import LocalScanner
+from system import Inotify
+
+
+class TestLocalScanner(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_local_scanner")
+        os.mkdir(os.path.join(self.temp_dir, "a"))
+        os.mkdir(os.path.join(self.temp_dir, "a", "aa"))
+        with open(os.path.join(self.temp_dir, "b"), "wb") as f:
+            f.write(bytearray(10))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_scan_without_watch_always_returns_result(self):
+        scanner = LocalScanner(self.temp_dir, use_temp_file=False)
+        self.assertFalse(scanner.is_watching())
+        self.assertEqual(["a", "b"], [f.name for f in scanner.scan()])
+        self.assertEqual(["a", "b"], [f.name for f in scanner.scan()])
+
+    def test_scan_without_watch_finds_append_to_idle_file(self):
+        scanner = LocalScanner(self.temp_dir, use_temp_file=False)
+        # File was last written long before the scan
+        old_time = time.time() - 2 * 60 * 60
+        os.utime(os.path.join(self.temp_dir, "b"), (old_time, old_time))
+        os.utime(self.temp_dir, (old_time, old_time))
+        self.assertEqual(10, scanner.scan()[1].size)
+
+        # Append in place, e.g. a resumed download, which does not modify the directory
+        with open(os.path.join(self.temp_dir, "b"), "ab") as f:
+            f.write(bytearray(30))
+        os.utime(self.temp_dir, (old_time, old_time))
+        self.assertEqual(40, scanner.scan()[1].size)
+
+    @unittest.skipIf(not Inotify.is_supported(), "Inotify is not supported")
+    def test_watch_returns_result_only_on_change(self):
+        scanner = LocalScanner(self.temp_dir, use_temp_file=False, watch=True)
+        self.assertEqual(["a", "b"], [f.name for f in scanner.scan()])
+        self.assertTrue(scanner.is_watching())
+        # Follow-up scan of the newly watched directories
+        self.assertTrue(scanner.wait_for_changes(0))
+        self.assertIsNone(scanner.scan())
+        # Nothing changed
+        self.assertFalse(scanner.wait_for_changes(0.1))
+        self.assertIsNone(scanner.scan())
+
+        # Add a file in a nested directory
+        with open(os.path.join(self.temp_dir, "a", "aa", "aaa"), "wb") as f:
+            f.write(bytearray(20))
+        self.assertTrue(scanner.wait_for_changes(1))
+        files = scanner.scan()
+        self.assertEqual(["a", "b"], [f.name for f in files])
+        self.assertEqual(20, files[0].size)
+        self.assertEqual(["aaa"], [f.name for f in files[0].children[0].children])
+
+        # Grow the file without modifying its directory
+        with open(os.path.join(self.temp_dir, "a", "aa", "aaa"), "ab") as f:
+            f.write(bytearray(30))
+        self.assertTrue(scanner.wait_for_changes(1))
+        files = scanner.scan()
+        self.assertEqual(50, files[0].size)
+
+        # Delete a root
+        os.remove(os.path.join(self.temp_dir, "b"))
+        self.assertTrue(scanner.wait_for_changes(1))
+        files = scanner.scan()
+        self.assertEqual(["a"], [f.name for f in files])
+
+    @unittest.skipIf(not Inotify.is_supported(), "Inotify is not supported")
+    def test_watch_tracks_new_directories(self):
+        scanner = LocalScanner(self.temp_dir, use_temp_file=False, watch=True)
+        scanner.scan()
+        os.mkdir(os.path.join(self.temp_dir, "c"))
+        self.assertTrue(scanner.wait_for_changes(1))
+        files = scanner.scan()
+        self.assertEqual(["a", "b", "c"], [f.name for f in files])
+        # Drain the follow-up scan of the new directory
+        while scanner.wait_for_changes(0):
+            scanner.scan()
+
+        # Changes inside the new directory are detected
+        with open(os.path.join(self.temp_dir, "c", "ca"), "wb") as f:
+            f.write(bytearray(5))
+        self.assertTrue(scanner.wait_for_changes(1))
+        files = scanner.scan()
+        self.assertEqual(5, files[2].size)
@@ -1,17 +1,74 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
 import unittest
+import hashlib
 import logging
 import sys
 from unittest.mock import patch, call, ANY
 import tempfile
 import os
-import pickle
 import shutil
+import io
 
 from controller.scan import RemoteScanner, ScannerError
 from ssh import SshcpError
 from common import Localization
+from system import SystemFile, WireFormat, ScanAgent, ScanWatcher
+
+
+class FakeAgentChannel:
+    """
+    Channel to a scan agent that runs in-process
+    """
+    def __init__(self, agent: ScanAgent, hello: bytes = ScanAgent.HELLO):
+        self.agent = agent
+        self.output = bytearray(hello)
+        self.requests = []
+        self.closed = False
+        self.drop_on_send = False
+
+    def send(self, data: bytes):
+        if self.drop_on_send:
+            raise SshcpError("Channel closed")
+        self.requests.append(data)
+        out = io.BytesIO()
+        self.agent.run(io.BytesIO(data), out)
+        self.output += out.getvalue()[len(ScanAgent.HELLO):]
+
+    def read(self, size: int) -> bytes:
+        if not self.output:
+            raise SshcpError("Channel closed")
+        # Return the output in small pieces to exercise the incremental reads
+        size = min(size, 7)
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWatchChannel:
+    """
+    Channel to a scan watcher, whose output is written by the test
+    """
+    def __init__(self):
+        self.output = bytearray(ScanWatcher.HELLO)
+        self.closed = False
+        self.dropped = False
+
+    def read(self, size: int) -> bytes:
+        return self.read_available(size, 0)
+
+    def read_available(self, size: int, timeout_in_s: float) -> bytes:
+        if self.dropped:
+            raise SshcpError("Channel closed")
+        data = bytes(self.output[:size])
+        del self.output[:size]
+        return data
+
+    def close(self):
+        self.closed = True
 
 
 class TestRemoteScanner(unittest.TestCase):
@@ -33,6 +90,10 @@ class TestRemoteScanner(unittest.TestCase):
 
         # Ssh to return mangled binary by default
         self.mock_ssh.shell.return_value = b'error'
+        # Scan agent is unavailable by default
+        self.mock_ssh.open_channel.side_effect = SshcpError("Agent unavailable")
+        # Streamed commands deliver the whole shell output in one chunk
+        self.mock_ssh.shell_stream.side_effect = lambda command, consumer: consumer(self.mock_ssh.shell(command))
 
     @classmethod
     def setUpClass(cls):
@@ -82,7 +143,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns error for md5sum check, empty pickle dump for later commands
+        # Ssh returns error for md5sum check, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -90,7 +151,7 @@ class TestRemoteScanner(unittest.TestCase):
                 return "".encode()
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()
@@ -117,7 +178,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns error for md5sum check, empty pickle dump for later commands
+        # Ssh returns error for md5sum check, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -125,7 +186,7 @@ class TestRemoteScanner(unittest.TestCase):
                 return "".encode()
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()
@@ -148,7 +209,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns error for md5sum check, empty pickle dump for later commands
+        # Ssh returns error for md5sum check, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -156,7 +217,7 @@ class TestRemoteScanner(unittest.TestCase):
                 return "".encode()
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()
@@ -179,7 +240,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns empty on md5sum, empty pickle dump for later commands
+        # Ssh returns empty on md5sum, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -187,7 +248,7 @@ class TestRemoteScanner(unittest.TestCase):
                 return "d41d8cd98f00b204e9800998ecf8427e".encode()
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()
@@ -211,7 +272,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns error for md5sum check, empty pickle dump for later commands
+        # Ssh returns error for md5sum check, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -219,7 +280,7 @@ class TestRemoteScanner(unittest.TestCase):
                 return "some output from md5sum".encode()
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()
@@ -242,7 +303,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns error for md5sum check, empty pickle dump for later commands
+        # Ssh returns error for md5sum check, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -250,7 +311,7 @@ class TestRemoteScanner(unittest.TestCase):
                 raise SshcpError("an ssh error")
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         with self.assertRaises(ScannerError) as ctx:
@@ -271,7 +332,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         self.ssh_run_command_count = 0
 
-        # Ssh returns error for md5sum check, empty pickle dump for later commands
+        # Ssh returns error for md5sum check, empty scan output for later commands
         def ssh_shell(*args):
             self.ssh_run_command_count += 1
             if self.ssh_run_command_count == 1:
@@ -279,15 +340,154 @@ class TestRemoteScanner(unittest.TestCase):
                 return b''
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()
         self.assertEqual(2, self.mock_ssh.shell.call_count)
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --compression zlib --compression-level 6 "
+            "--cache '/remote/path/to/scan/script.cache' "
+            "--delta-state '/remote/path/to/scan/script.state'"
+        )
+
+    def test_calls_correct_ssh_scan_command_without_compression(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_NONE,
+            delta=False
+        )
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([])]
+
+        scanner.scan()
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --cache '/remote/path/to/scan/script.cache'"
+        )
+
+    def test_calls_correct_ssh_scan_command_without_cache(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_NONE,
+            delta=False,
+            cache=False
+        )
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([])]
+
+        scanner.scan()
         self.mock_ssh.shell.assert_called_with(
             "'/remote/path/to/scan/script' '/remote/path/to/scan'"
         )
 
+    def test_decodes_compressed_output(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_ZLIB,
+            compression_level=9,
+            delta=False
+        )
+        a = SystemFile("a", 100, True)
+        a.add_child(SystemFile("aa", 100, False))
+        files = [a, SystemFile("b", 200, False)]
+        compressed = b"".join(WireFormat.iter_compress(WireFormat.iter_encode(files),
+                                                       WireFormat.COMPRESSION_ZLIB, 9))
+        self.mock_ssh.shell.side_effect = [b'', compressed, compressed]
+
+        self.assertEqual(files, scanner.scan())
+        self.assertEqual(files, scanner.scan())
+        # compression is kept after the first scan
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --compression zlib --compression-level 9 "
+            "--cache '/remote/path/to/scan/script.cache'"
+        )
+
+    def test_decodes_streamed_output(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_ZLIB,
+            delta=False
+        )
+        a = SystemFile("a", 100, True)
+        a.add_child(SystemFile("aa", 100, False))
+        files = [a, SystemFile("b", 200, False)]
+        compressed = b"".join(WireFormat.iter_compress(WireFormat.iter_encode(files),
+                                                       WireFormat.COMPRESSION_ZLIB))
+
+        def shell_stream(command, consumer):
+            for i in range(len(compressed)):
+                consumer(compressed[i:i+1])
+        self.mock_ssh.shell.return_value = b''
+        self.mock_ssh.shell_stream.side_effect = shell_stream
+
+        self.assertEqual(files, scanner.scan())
+        self.mock_ssh.shell_stream.assert_called_once()
+
+    def test_raises_nonrecoverable_error_on_truncated_streamed_output(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            delta=False
+        )
+        data = WireFormat.encode([SystemFile("a", 100, False)])
+        self.mock_ssh.shell.side_effect = [b'', data[:-2]]
+
+        with self.assertRaises(ScannerError) as ctx:
+            scanner.scan()
+        self.assertEqual(Localization.Error.REMOTE_SERVER_SCAN.format("Invalid scan data"), str(ctx.exception))
+        self.assertFalse(ctx.exception.recoverable)
+
+    def test_stops_requesting_compression_if_unsupported_by_remote(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            delta=False
+        )
+        # remote replies with uncompressed output
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([]), WireFormat.encode([])]
+
+        scanner.scan()
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --compression zlib --compression-level 6 "
+            "--cache '/remote/path/to/scan/script.cache'"
+        )
+        scanner.scan()
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --cache '/remote/path/to/scan/script.cache'"
+        )
+
     def test_raises_nonrecoverable_error_on_first_failed_ssh(self):
         scanner = RemoteScanner(
             remote_address="my remote address",
@@ -313,7 +513,7 @@ class TestRemoteScanner(unittest.TestCase):
                 raise SshcpError("an ssh error")
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         with self.assertRaises(ScannerError) as ctx:
@@ -343,13 +543,13 @@ class TestRemoteScanner(unittest.TestCase):
                 return b''
             elif self.ssh_run_command_count == 2:
                 # first try
-                return pickle.dumps([])
+                return WireFormat.encode([])
             elif self.ssh_run_command_count == 3:
                 # second try
                 raise SshcpError("an ssh error")
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()  # no error first time
@@ -380,13 +580,13 @@ class TestRemoteScanner(unittest.TestCase):
                 return b''
             elif self.ssh_run_command_count == 2:
                 # first try
-                return pickle.dumps([])
+                return WireFormat.encode([])
             elif self.ssh_run_command_count == 3:
                 # second try
                 raise SshcpError("an ssh error")
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         scanner.scan()  # no error first time
@@ -433,7 +633,7 @@ class TestRemoteScanner(unittest.TestCase):
 
         with self.assertRaises(ScannerError) as ctx:
             scanner.scan()
-        self.assertEqual(Localization.Error.REMOTE_SERVER_SCAN.format("Invalid pickled data"), str(ctx.exception))
+        self.assertEqual(Localization.Error.REMOTE_SERVER_SCAN.format("Invalid scan data"), str(ctx.exception))
         self.assertFalse(ctx.exception.recoverable)
 
     def test_raises_nonrecoverable_error_on_failed_scan(self):
@@ -461,7 +661,7 @@ class TestRemoteScanner(unittest.TestCase):
                 raise SshcpError("SystemScannerError: something failed")
             else:
                 # later tries
-                return pickle.dumps([])
+                return WireFormat.encode([])
         self.mock_ssh.shell.side_effect = ssh_shell
 
         with self.assertRaises(ScannerError) as ctx:
@@ -471,3 +671,367 @@ class TestRemoteScanner(unittest.TestCase):
             str(ctx.exception)
         )
         self.assertFalse(ctx.exception.recoverable)
+
+    def test_applies_scan_deltas(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_NONE
+        )
+        a = SystemFile("a", 100, False)
+        b = SystemFile("b", 200, False)
+        b2 = SystemFile("b", 300, False)
+        c = SystemFile("c", 400, False)
+        full = b"".join(WireFormat.iter_stream([WireFormat.encode_frame(a), WireFormat.encode_frame(b)],
+                                               generation="gen1"))
+        delta = b"".join(WireFormat.iter_stream([WireFormat.encode_frame(b2), WireFormat.encode_frame(c)],
+                                                generation="gen2",
+                                                base_generation="gen1",
+                                                removed_names=["a"]))
+        empty_delta = b"".join(WireFormat.iter_stream([], generation="gen3", base_generation="gen2"))
+        self.mock_ssh.shell.side_effect = [b'', full, delta, empty_delta]
+
+        self.assertEqual([a, b], scanner.scan())
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --cache '/remote/path/to/scan/script.cache' "
+            "--delta-state '/remote/path/to/scan/script.state'"
+        )
+        self.assertEqual([b2, c], scanner.scan())
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --cache '/remote/path/to/scan/script.cache' "
+            "--delta-state '/remote/path/to/scan/script.state' --since gen1"
+        )
+        files = scanner.scan()
+        self.assertEqual([b2, c], files)
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --cache '/remote/path/to/scan/script.cache' "
+            "--delta-state '/remote/path/to/scan/script.state' --since gen2"
+        )
+
+    def test_full_scan_replaces_cached_files(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_NONE
+        )
+        a = SystemFile("a", 100, False)
+        b = SystemFile("b", 200, False)
+        full1 = b"".join(WireFormat.iter_stream([WireFormat.encode_frame(a)], generation="gen1"))
+        full2 = b"".join(WireFormat.iter_stream([WireFormat.encode_frame(b)], generation="gen2"))
+        self.mock_ssh.shell.side_effect = [b'', full1, full2]
+
+        self.assertEqual([a], scanner.scan())
+        self.assertEqual([b], scanner.scan())
+
+    def test_raises_recoverable_error_on_mismatched_delta(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_NONE
+        )
+        full = b"".join(WireFormat.iter_stream([], generation="gen1"))
+        delta = b"".join(WireFormat.iter_stream([], generation="gen3", base_generation="gen2"))
+        self.mock_ssh.shell.side_effect = [b'', full, delta, full]
+
+        scanner.scan()
+        with self.assertRaises(ScannerError) as ctx:
+            scanner.scan()
+        self.assertTrue(ctx.exception.recoverable)
+        # next scan asks for a full scan
+        scanner.scan()
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --cache '/remote/path/to/scan/script.cache' "
+            "--delta-state '/remote/path/to/scan/script.state'"
+        )
+
+    def create_agent_scanner(self):
+        return RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            compression=WireFormat.COMPRESSION_ZLIB,
+            delta=False
+        )
+
+    @staticmethod
+    def scan_script_md5sum() -> bytes:
+        with open(TestRemoteScanner.temp_scan_script, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest().encode()
+
+    def create_agent_tree(self):
+        scan_dir = os.path.join(TestRemoteScanner.temp_dir, "agent_scan")
+        os.makedirs(os.path.join(scan_dir, "a"), exist_ok=True)
+        with open(os.path.join(scan_dir, "a", "aa"), "w") as f:
+            f.write("x" * 10)
+        with open(os.path.join(scan_dir, "b"), "w") as f:
+            f.write("x" * 20)
+        return scan_dir
+
+    def test_scans_with_agent(self):
+        scanner = self.create_agent_scanner()
+        channel = FakeAgentChannel(ScanAgent(self.create_agent_tree()))
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.return_value = b''
+
+        for _ in range(2):
+            files = scanner.scan()
+            self.assertEqual(["a", "b"], [f.name for f in files])
+            self.assertEqual(10, files[0].size)
+            self.assertEqual(["aa"], [f.name for f in files[0].children])
+        self.mock_ssh.open_channel.assert_called_once_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --agent "
+            "--cache '/remote/path/to/scan/script.cache'"
+        )
+        self.mock_ssh.shell_stream.assert_not_called()
+        self.assertEqual(2, len(channel.requests))
+
+    def test_agent_is_started_with_delta_state(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script"
+        )
+        state_path = os.path.join(TestRemoteScanner.temp_dir, "agent.state")
+        self.addCleanup(lambda: os.path.exists(state_path) and os.remove(state_path))
+        channel = FakeAgentChannel(ScanAgent(self.create_agent_tree(), delta_state_path=state_path))
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.return_value = b''
+
+        files = scanner.scan()
+        self.assertEqual(files, scanner.scan())
+        self.mock_ssh.open_channel.assert_called_once_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --agent --cache '/remote/path/to/scan/script.cache' "
+            "--delta-state '/remote/path/to/scan/script.state'"
+        )
+        # Second request asks for a delta
+        self.assertIn(b'"since": "', channel.requests[1])
+
+    def test_restarts_agent_if_channel_drops(self):
+        scanner = self.create_agent_scanner()
+        scan_dir = self.create_agent_tree()
+        channels = [FakeAgentChannel(ScanAgent(scan_dir)), FakeAgentChannel(ScanAgent(scan_dir))]
+        self.mock_ssh.open_channel.side_effect = channels
+        self.mock_ssh.shell.return_value = b''
+
+        scanner.scan()
+        channels[0].drop_on_send = True
+        self.assertEqual(["a", "b"], [f.name for f in scanner.scan()])
+        self.assertTrue(channels[0].closed)
+        self.assertEqual(2, self.mock_ssh.open_channel.call_count)
+        self.mock_ssh.shell_stream.assert_not_called()
+
+    def test_scans_without_agent_if_unavailable(self):
+        scanner = self.create_agent_scanner()
+        files = [SystemFile("a", 100, False)]
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode(files)]
+
+        self.assertEqual(files, scanner.scan())
+        self.mock_ssh.open_channel.assert_called_once_with(ANY)
+        self.mock_ssh.shell_stream.assert_called_once_with(ANY, ANY)
+
+    def test_disables_agent_on_bad_hello(self):
+        scanner = self.create_agent_scanner()
+        files = [SystemFile("a", 100, False)]
+        channel = FakeAgentChannel(ScanAgent(self.create_agent_tree()), hello=b"usage: scanfs")
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode(files), WireFormat.encode(files)]
+
+        self.assertEqual(files, scanner.scan())
+        self.assertEqual(files, scanner.scan())
+        self.assertTrue(channel.closed)
+        self.mock_ssh.open_channel.assert_called_once_with(ANY)
+        self.assertEqual(2, self.mock_ssh.shell_stream.call_count)
+
+    def test_raises_nonrecoverable_error_on_agent_scan_error(self):
+        scanner = self.create_agent_scanner()
+        channel = FakeAgentChannel(ScanAgent(os.path.join(TestRemoteScanner.temp_dir, "missing")))
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.return_value = b''
+
+        with self.assertRaises(ScannerError) as ctx:
+            scanner.scan()
+        self.assertIn("SystemScannerError", str(ctx.exception))
+        self.assertFalse(ctx.exception.recoverable)
+
+    def test_scans_roots_with_agent(self):
+        scanner = self.create_agent_scanner()
+        channel = FakeAgentChannel(ScanAgent(self.create_agent_tree()))
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.return_value = b''
+
+        files = scanner.scan()
+        # Missing roots are left out
+        self.assertEqual(["b"], [f.name for f in scanner.scan_roots(["b", "missing"])])
+        self.assertIn(b'"roots": ["b", "missing"]', channel.requests[1])
+        # Full scans are not affected
+        self.assertEqual(files, scanner.scan())
+
+    def test_scans_roots_without_agent(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            agent=False
+        )
+        files = [SystemFile("a", 100, False)]
+        self.mock_ssh.shell.side_effect = [self.scan_script_md5sum(), WireFormat.encode(files)]
+
+        self.assertEqual(files, scanner.scan_roots(["a", "it's -b"]))
+        self.mock_ssh.shell.assert_called_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --compression zlib --compression-level 6 "
+            "--root=a --root=\'it\'\"\'\"\'s -b\'"
+        )
+
+    def test_root_scan_waits_for_scanfs_install(self):
+        scanner = self.create_agent_scanner()
+        files = [SystemFile("a", 100, False)]
+        # Not installed, failed check, then installed
+        self.mock_ssh.shell.side_effect = [
+            b'',
+            SshcpError("Connection refused"),
+            self.scan_script_md5sum(),
+            WireFormat.encode(files),
+            WireFormat.encode(files)
+        ]
+
+        self.assertIsNone(scanner.scan_roots(["a"]))
+        self.assertIsNone(scanner.scan_roots(["a"]))
+        self.mock_ssh.shell_stream.assert_not_called()
+        self.assertEqual(files, scanner.scan_roots(["a"]))
+        # Checked only until it matches
+        self.assertEqual(files, scanner.scan_roots(["a"]))
+        self.assertEqual(5, self.mock_ssh.shell.call_count)
+        self.mock_ssh.copy.assert_not_called()
+
+    def test_root_scan_errors_are_recoverable(self):
+        scanner = self.create_agent_scanner()
+        self.mock_ssh.shell.side_effect = [self.scan_script_md5sum(),
+                                           SshcpError("SystemScannerError: Permission denied")]
+
+        with self.assertRaises(ScannerError) as ctx:
+            scanner.scan_roots(["a"])
+        self.assertTrue(ctx.exception.recoverable)
+
+    def create_watch_scanner(self):
+        return RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            delta=False,
+            agent=False,
+            watch=True
+        )
+
+    def test_watches_remote_changes(self):
+        scanner = self.create_watch_scanner()
+        channel = FakeWatchChannel()
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([]), WireFormat.encode([])]
+
+        self.assertFalse(scanner.is_watching())
+        scanner.scan()
+        self.assertTrue(scanner.is_watching())
+        self.mock_ssh.open_channel.assert_called_once_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --watch"
+        )
+        self.assertFalse(scanner.wait_for_changes(0))
+
+        channel.output += b'{"changed": ["a", "b"]}\n'
+        self.assertTrue(scanner.wait_for_changes(0))
+        # Change stays pending until the next scan
+        self.assertTrue(scanner.wait_for_changes(0))
+        scanner.scan()
+        self.assertFalse(scanner.wait_for_changes(0))
+        self.mock_ssh.open_channel.assert_called_once_with(ANY)
+
+    def test_passes_watch_poll_interval(self):
+        scanner = RemoteScanner(
+            remote_address="my remote address",
+            remote_username="my remote user",
+            remote_password="my password",
+            remote_port=1234,
+            remote_path_to_scan="/remote/path/to/scan",
+            local_path_to_scan_script=TestRemoteScanner.temp_scan_script,
+            remote_path_to_scan_script="/remote/path/to/scan/script",
+            delta=False,
+            agent=False,
+            watch=True,
+            watch_poll_interval_in_ms=30000
+        )
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = FakeWatchChannel()
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([])]
+        scanner.scan()
+        self.mock_ssh.open_channel.assert_called_once_with(
+            "'/remote/path/to/scan/script' '/remote/path/to/scan' --watch --poll-interval 30.0"
+        )
+
+    def test_stops_watching_if_watcher_drops(self):
+        scanner = self.create_watch_scanner()
+        channel = FakeWatchChannel()
+        self.mock_ssh.open_channel.side_effect = None
+        self.mock_ssh.open_channel.return_value = channel
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([]), WireFormat.encode([])]
+
+        scanner.scan()
+        channel.dropped = True
+        self.assertFalse(scanner.wait_for_changes(0))
+        self.assertFalse(scanner.is_watching())
+        self.assertTrue(channel.closed)
+        # Not restarted right away
+        scanner.scan()
+        self.assertFalse(scanner.is_watching())
+        self.mock_ssh.open_channel.assert_called_once_with(ANY)
+
+    def test_scans_periodically_if_watcher_fails(self):
+        scanner = self.create_watch_scanner()
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([])]
+
+        self.assertEqual([], scanner.scan())
+        self.assertFalse(scanner.is_watching())
+        self.assertFalse(scanner.wait_for_changes(0))
+
+    def test_does_not_watch_by_default(self):
+        scanner = self.create_agent_scanner()
+        self.mock_ssh.shell.side_effect = [b'', WireFormat.encode([])]
+        scanner.scan()
+        self.assertFalse(scanner.is_watching())
+        for c in self.mock_ssh.open_channel.call_args_list:
+            self.assertNotIn("--watch", c[0][0])
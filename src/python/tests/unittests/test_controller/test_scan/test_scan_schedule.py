@@ -0,0 +1,61 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import unittest
+
+from controller import FixedScanSchedule, AdaptiveScanSchedule
+
+
+class TestFixedScanSchedule(unittest.TestCase):
+    def test_interval_is_constant(self):
+        schedule = FixedScanSchedule(interval_in_ms=100)
+        for changed in (False, True, False):
+            schedule.on_scan(changed)
+            self.assertEqual(100, schedule.get_interval_in_ms())
+            self.assertEqual(100, schedule.get_wait_time_in_ms())
+        schedule.reset()
+        self.assertEqual(100, schedule.get_interval_in_ms())
+
+    def test_jitter(self):
+        schedule = FixedScanSchedule(interval_in_ms=1000, jitter=0.1)
+        wait_times = {schedule.get_wait_time_in_ms() for _ in range(100)}
+        self.assertTrue(all(900 <= t <= 1100 for t in wait_times))
+        self.assertGreater(len(wait_times), 1)
+        self.assertEqual(1000, schedule.get_interval_in_ms())
+
+    def test_fails_on_bad_jitter(self):
+        with self.assertRaises(ValueError):
+            FixedScanSchedule(interval_in_ms=100, jitter=1.5)
+        with self.assertRaises(ValueError):
+            FixedScanSchedule(interval_in_ms=100, jitter=-0.1)
+
+
+class TestAdaptiveScanSchedule(unittest.TestCase):
+    def test_backs_off_while_unchanged(self):
+        schedule = AdaptiveScanSchedule(min_interval_in_ms=100, max_interval_in_ms=700, jitter=0.0)
+        self.assertEqual(100, schedule.get_interval_in_ms())
+        intervals = []
+        for _ in range(5):
+            schedule.on_scan(changed=False)
+            intervals.append(schedule.get_interval_in_ms())
+        self.assertEqual([200, 400, 700, 700, 700], intervals)
+        self.assertEqual(700, schedule.get_wait_time_in_ms())
+
+    def test_snaps_back_on_change(self):
+        schedule = AdaptiveScanSchedule(min_interval_in_ms=100, max_interval_in_ms=1000, backoff_factor=3.0)
+        schedule.on_scan(changed=False)
+        self.assertEqual(300, schedule.get_interval_in_ms())
+        schedule.on_scan(changed=True)
+        self.assertEqual(100, schedule.get_interval_in_ms())
+
+    def test_snaps_back_on_reset(self):
+        schedule = AdaptiveScanSchedule(min_interval_in_ms=100, max_interval_in_ms=1000)
+        schedule.on_scan(changed=False)
+        schedule.on_scan(changed=False)
+        schedule.reset()
+        self.assertEqual(100, schedule.get_interval_in_ms())
+
+    def test_fails_on_bad_args(self):
+        with self.assertRaises(ValueError):
+            AdaptiveScanSchedule(min_interval_in_ms=1000, max_interval_in_ms=100)
+        with self.assertRaises(ValueError):
+            AdaptiveScanSchedule(min_interval_in_ms=100, max_interval_in_ms=1000, backoff_factor=0.5)
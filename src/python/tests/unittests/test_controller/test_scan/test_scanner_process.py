@@ -4,11 +4,12 @@ import unittest
 import multiprocessing
 import logging
 import sys
+import time
 from unittest.mock import MagicMock
 
 import timeout_decorator
 
-from controller import IScanner, ScannerProcess, ScannerError
+from controller import IScanner, IWatchingScanner, ScannerProcess, ScannerError, FixedScanSchedule, AdaptiveScanSchedule
 from system import SystemFile
 
 
@@ -174,3 +175,259 @@ class TestScannerProcess(unittest.TestCase):
                 self.process.propagate_exception()
         # noinspection PyUnreachableCode
         self.assertEqual("non-recoverable error", str(ctx.exception))
+
+    @timeout_decorator.timeout(10)
+    def test_does_not_publish_unchanged_scans(self):
+        self.scan_counter = multiprocessing.Value('i', 0)
+
+        mock_scanner = DummyScanner()
+        mock_scanner.scan = MagicMock()
+
+        def _scan():
+            self.scan_counter.value += 1
+            return [SystemFile("a", 100, False)] if self.scan_counter.value == 1 else None
+        mock_scanner.scan.side_effect = _scan
+
+        self.process = ScannerProcess(scanner=mock_scanner,
+                                      interval_in_ms=100)
+        self.process.start()
+        while self.scan_counter.value < 3:
+            pass
+        result = self.process.pop_latest_result()
+        self.assertEqual(1, len(result.files))
+        self.assertEqual("a", result.files[0].name)
+        while self.scan_counter.value < 5:
+            pass
+        # Only a marker with the time of the scan is published
+        result = self.process.pop_latest_result()
+        self.assertTrue(result.unchanged)
+        self.assertEqual([], result.files)
+
+    @timeout_decorator.timeout(10)
+    def test_publishes_marker_for_identical_results(self):
+        self.scan_signal = multiprocessing.Value('i', 0)
+        self.scan_counter = multiprocessing.Value('i', 0)
+
+        mock_scanner = DummyScanner()
+        mock_scanner.scan = MagicMock()
+
+        def _scan():
+            self.scan_counter.value += 1
+            # A new but identical tree on every scan
+            a = SystemFile("a", 100, True)
+            a.add_child(SystemFile("aa", 100 if self.scan_signal.value == 0 else 99, False))
+            return [a]
+        mock_scanner.scan.side_effect = _scan
+
+        self.process = ScannerProcess(scanner=mock_scanner,
+                                      interval_in_ms=10)
+        self.process.start()
+        while self.scan_counter.value < 3:
+            pass
+        # Markers that follow an unread result do not hide it
+        result = self.process.pop_latest_result()
+        self.assertFalse(result.unchanged)
+        self.assertEqual("aa", result.files[0].children[0].name)
+        orig_counter = self.scan_counter.value
+        while self.scan_counter.value < orig_counter + 2:
+            pass
+        result = self.process.pop_latest_result()
+        self.assertTrue(result.unchanged)
+        self.assertEqual([], result.files)
+
+        # A change in a nested file is published in full
+        self.scan_signal.value = 1
+        orig_counter = self.scan_counter.value
+        while self.scan_counter.value < orig_counter + 2:
+            pass
+        result = self.process.pop_latest_result()
+        self.assertFalse(result.unchanged)
+        self.assertEqual(99, result.files[0].children[0].size)
+
+    @timeout_decorator.timeout(10)
+    def test_watching_scanner_ends_wait_on_change(self):
+        self.scan_counter = multiprocessing.Value('i', 0)
+        self.change_signal = multiprocessing.Event()
+
+        class DummyWatchingScanner(IWatchingScanner):
+            def __init__(self, scan_counter, change_signal):
+                self.scan_counter = scan_counter
+                self.change_signal = change_signal
+
+            def scan(self):
+                self.change_signal.clear()
+                self.scan_counter.value += 1
+                return []
+
+            def set_base_logger(self, base_logger: logging.Logger):
+                pass
+
+            def is_watching(self) -> bool:
+                return True
+
+            def wait_for_changes(self, timeout_in_s: float) -> bool:
+                return self.change_signal.wait(timeout_in_s)
+
+        # Interval backs off far enough that the test times out without the change
+        self.process = ScannerProcess(scanner=DummyWatchingScanner(self.scan_counter, self.change_signal),
+                                      schedule=AdaptiveScanSchedule(min_interval_in_ms=10,
+                                                                    max_interval_in_ms=60000,
+                                                                    backoff_factor=10000.0,
+                                                                    jitter=0.0))
+        self.process.start()
+        while self.scan_counter.value < 1:
+            pass
+        self.change_signal.set()
+        while self.scan_counter.value < 2:
+            pass
+        self.change_signal.set()
+        while self.scan_counter.value < 3:
+            pass
+
+    @timeout_decorator.timeout(10)
+    def test_watching_scanner_scans_change_after_delay(self):
+        self.scan_times = multiprocessing.Array('d', 2)
+        self.scan_counter = multiprocessing.Value('i', 0)
+
+        class DummyWatchingScanner(IWatchingScanner):
+            def __init__(self, scan_times, scan_counter):
+                self.scan_times = scan_times
+                self.scan_counter = scan_counter
+
+            def scan(self):
+                if self.scan_counter.value < 2:
+                    self.scan_times[self.scan_counter.value] = time.monotonic()
+                self.scan_counter.value += 1
+                return []
+
+            def set_base_logger(self, base_logger: logging.Logger):
+                pass
+
+            def is_watching(self) -> bool:
+                return True
+
+            def wait_for_changes(self, timeout_in_s: float) -> bool:
+                # Always changing, like a file being written
+                return True
+
+        # The change is scanned after the delay, long before the schedule's interval
+        self.process = ScannerProcess(scanner=DummyWatchingScanner(self.scan_times, self.scan_counter),
+                                      schedule=AdaptiveScanSchedule(min_interval_in_ms=30000,
+                                                                    max_interval_in_ms=60000,
+                                                                    jitter=0.0),
+                                      change_delay_in_ms=300)
+        self.process.start()
+        while self.scan_counter.value < 2:
+            pass
+        # Some leeway for the time between the process starting a scan and the scanner recording it
+        self.assertGreaterEqual(self.scan_times[1] - self.scan_times[0], 0.25)
+        self.assertLess(self.scan_times[1] - self.scan_times[0], 2.0)
+
+    @timeout_decorator.timeout(10)
+    def test_pushed_change_is_scanned_within_a_second(self):
+        self.change_signal = multiprocessing.Event()
+        self.scan_counter = multiprocessing.Value('i', 0)
+
+        class DummyWatchingScanner(IWatchingScanner):
+            """Like the remote scanner, with its watcher pushing a change"""
+            def __init__(self, scan_counter, change_signal):
+                self.scan_counter = scan_counter
+                self.change_signal = change_signal
+
+            def scan(self):
+                self.change_signal.clear()
+                self.scan_counter.value += 1
+                return [SystemFile("a", self.scan_counter.value, False)]
+
+            def set_base_logger(self, base_logger: logging.Logger):
+                pass
+
+            def is_watching(self) -> bool:
+                return True
+
+            def wait_for_changes(self, timeout_in_s: float) -> bool:
+                return self.change_signal.wait(timeout_in_s)
+
+        # Schedule of the remote scans, with the default interval
+        self.process = ScannerProcess(scanner=DummyWatchingScanner(self.scan_counter, self.change_signal),
+                                      schedule=AdaptiveScanSchedule(min_interval_in_ms=30000,
+                                                                    max_interval_in_ms=30000 * 8,
+                                                                    jitter=0.0))
+        self.process.start()
+        while self.process.pop_latest_result() is None:
+            pass
+        self.change_signal.set()
+        timestamp_change = time.monotonic()
+        result = None
+        while result is None:
+            result = self.process.pop_latest_result()
+        self.assertLess(time.monotonic() - timestamp_change, 1.0)
+        self.assertEqual(2, result.files[0].size)
+
+    @timeout_decorator.timeout(10)
+    def test_adaptive_schedule_backs_off_and_resets(self):
+        self.scan_counter = multiprocessing.Value('i', 0)
+
+        mock_scanner = DummyScanner()
+        mock_scanner.scan = MagicMock()
+
+        def _scan():
+            self.scan_counter.value += 1
+            return [SystemFile("a", 100, False)]
+        mock_scanner.scan.side_effect = _scan
+
+        self.process = ScannerProcess(scanner=mock_scanner,
+                                      schedule=AdaptiveScanSchedule(min_interval_in_ms=10,
+                                                                    max_interval_in_ms=2000,
+                                                                    jitter=0.0))
+        self.assertEqual(10, self.process.get_interval_in_ms())
+        self.process.start()
+        # Unchanged results stretch the interval to the max
+        while self.process.get_interval_in_ms() < 2000:
+            pass
+        # A forced scan snaps it back to the min
+        self.process.force_scan()
+        while self.process.get_interval_in_ms() != 10:
+            pass
+
+    def test_requires_interval_or_schedule(self):
+        with self.assertRaises(ValueError):
+            ScannerProcess(scanner=DummyScanner())
+        with self.assertRaises(ValueError):
+            ScannerProcess(scanner=DummyScanner(), interval_in_ms=100, schedule=FixedScanSchedule(100))
+
+    @timeout_decorator.timeout(10)
+    def test_passes_results_through_shared_memory(self):
+        self.scan_signal = multiprocessing.Value('i', 0)
+        self.scan_counter = multiprocessing.Value('i', 0)
+
+        mock_scanner = DummyScanner()
+        mock_scanner.scan = MagicMock()
+
+        def _scan():
+            self.scan_counter.value += 1
+            return [SystemFile("a", 100 + self.scan_signal.value, False)]
+        mock_scanner.scan.side_effect = _scan
+
+        self.process = ScannerProcess(scanner=mock_scanner,
+                                      interval_in_ms=10,
+                                      shared_memory=True)
+        self.process.start()
+        # The result is queued after the scan returns, so wait for it
+        while True:
+            result = self.process.pop_latest_result()
+            if result:
+                break
+        self.assertEqual([SystemFile("a", 100, False)], result.files)
+
+        # Superseded results are freed without being read
+        for i in range(1, 4):
+            self.scan_signal.value = i
+            orig_counter = self.scan_counter.value
+            while self.scan_counter.value < orig_counter + 2:
+                pass
+        while True:
+            result = self.process.pop_latest_result()
+            if result and result.files[0].size == 103:
+                break
+        self.assertEqual([SystemFile("a", 103, False)], result.files)
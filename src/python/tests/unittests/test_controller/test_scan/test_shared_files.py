@@ -0,0 +1,63 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import unittest
+from datetime import datetime
+from multiprocessing import shared_memory
+
+from controller import SharedScanFiles, SharedFilesError, ScannerResult
+from system import SystemFile
+
+
+class TestSharedScanFiles(unittest.TestCase):
+    @staticmethod
+    def create_files():
+        a = SystemFile("a", 100, True, time_modified_ns=1541799619123456789)
+        a.add_child(SystemFile("aa", 60, False))
+        a.add_child(SystemFile("ab", 40, False))
+        return [a, SystemFile("déģķ", 10, False)]
+
+    def assert_freed(self, name: str):
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    def test_round_trip(self):
+        files = TestSharedScanFiles.create_files()
+        shared_files = SharedScanFiles.create(files, 1)
+        self.assertEqual(files, shared_files.load())
+        self.assert_freed(shared_files.name)
+
+    def test_round_trip_wire_encoding(self):
+        files = TestSharedScanFiles.create_files()
+        shared_files = SharedScanFiles.create(files, 1, encoding=SharedScanFiles.ENCODING_WIRE)
+        self.assertEqual(files, shared_files.load())
+        self.assert_freed(shared_files.name)
+
+    def test_round_trip_empty(self):
+        shared_files = SharedScanFiles.create([], 1)
+        self.assertEqual([], shared_files.load())
+
+    def test_discard(self):
+        shared_files = SharedScanFiles.create(TestSharedScanFiles.create_files(), 1)
+        shared_files.discard()
+        self.assert_freed(shared_files.name)
+        # Discarding twice is harmless
+        shared_files.discard()
+        with self.assertRaises(SharedFilesError):
+            shared_files.load()
+
+    def test_fails_on_generation_mismatch(self):
+        shared_files = SharedScanFiles.create(TestSharedScanFiles.create_files(), 1)
+        with self.assertRaises(SharedFilesError):
+            SharedScanFiles(shared_files.name, shared_files.size, 2).load()
+        self.assert_freed(shared_files.name)
+
+    def test_result_decodes_lazily(self):
+        files = TestSharedScanFiles.create_files()
+        shared_files = SharedScanFiles.create(files, 1)
+        result = ScannerResult(timestamp=datetime.now(), files=None, shared_files=shared_files)
+        self.assertEqual(files, result.files)
+        self.assert_freed(shared_files.name)
+        # Files are kept after the segment is freed
+        self.assertEqual(files, result.files)
+        result.discard()
+        self.assertEqual(files, result.files)
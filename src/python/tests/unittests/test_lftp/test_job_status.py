@@ -123,6 +123,26 @@ class TestLftpJobStatus(unittest.TestCase):
             set(status.get_active_file_transfer_states()),
         )
 
+    def test_active_transfer_state_by_name(self):
+        status = LftpJobStatus(
+            job_id=-1,
+            job_type=LftpJobStatus.Type.MIRROR,
+            state=LftpJobStatus.State.RUNNING,
+            name="",
+            flags="",
+        )
+        status.add_active_file_transfer_state(
+            "a", LftpJobStatus.TransferState(10, 20, 50, 0, 0)
+        )
+        status.add_active_file_transfer_state(
+            "b/c", LftpJobStatus.TransferState(25, 100, 25, 0, 0)
+        )
+        self.assertEqual(
+            LftpJobStatus.TransferState(25, 100, 25, 0, 0),
+            status.get_active_file_transfer_state("b/c"),
+        )
+        self.assertIsNone(status.get_active_file_transfer_state("c"))
+
     def test_active_transfer_state_fails_on_queued(self):
         status = LftpJobStatus(
             job_id=-1,
@@ -1,6 +1,7 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
 import unittest
+from unittest.mock import patch
 from datetime import datetime
 
 from model import Model, ModelFile, ModelDiff, ModelDiffUtil
@@ -115,3 +116,14 @@ class TestModelDiffUtil(unittest.TestCase):
         updated = [d for d in diffs if d.change == ModelDiff.Change.UPDATED]
         self.assertEqual(1, len(updated))
         self.assertEqual(ModelDiff(ModelDiff.Change.UPDATED, c1, c2), updated[0])
+
+    def test_same_file_object(self):
+        model_before = Model()
+        model_after = Model()
+        a = ModelFile("a", False)
+        model_before.add_file(a)
+        model_after.add_file(a)
+        with patch.object(ModelFile, "__eq__") as mock_eq:
+            diffs = ModelDiffUtil.diff_models(model_before, model_after)
+            mock_eq.assert_not_called()
+        self.assertEqual([], diffs)
@@ -253,3 +253,80 @@ class TestModelFile(unittest.TestCase):
         self.assertIsNone(a.parent)
         self.assertEqual(a, aa.parent)
         self.assertEqual(aa, aaa.parent)
+
+    def test_content_hash(self):
+        a1 = ModelFile("a", True)
+        a1.add_child(ModelFile("aa", False))
+        a1.add_child(ModelFile("ab", False))
+        # Order of the children does not matter
+        a2 = ModelFile("a", True)
+        a2.add_child(ModelFile("ab", False))
+        a2.add_child(ModelFile("aa", False))
+        self.assertEqual(a1.content_hash, a2.content_hash)
+
+        # Timestamp of the update does not matter
+        a2.update_timestamp = datetime(2018, 11, 9, 21, 40, 18)
+        self.assertEqual(a1.content_hash, a2.content_hash)
+
+        # Changes anywhere below are picked up
+        a1.get_children()[0].state = ModelFile.State.DOWNLOADED
+        self.assertNotEqual(a1.content_hash, a2.content_hash)
+        a2.get_children()[1].state = ModelFile.State.DOWNLOADED
+        self.assertEqual(a1.content_hash, a2.content_hash)
+        a2.add_child(ModelFile("ac", False))
+        self.assertNotEqual(a1.content_hash, a2.content_hash)
+
+        # Fields are not mixed up
+        b1 = ModelFile("b", False)
+        b1.local_size = 100
+        b2 = ModelFile("b", False)
+        b2.remote_size = 100
+        self.assertNotEqual(b1.content_hash, b2.content_hash)
+
+    def test_content_hash_deep_tree(self):
+        def build(depth: int) -> ModelFile:
+            root = ModelFile("root", True)
+            parent = root
+            for i in range(depth):
+                child = ModelFile("dir{}".format(i), True)
+                parent.add_child(child)
+                parent = child
+            parent.add_child(ModelFile("file", False))
+            return root
+
+        # Deeper than the recursion limit
+        self.assertEqual(build(5000), build(5000))
+        self.assertNotEqual(build(5000), build(5001))
+
+    def test_freeze(self):
+        a = ModelFile("a", True)
+        aa = ModelFile("aa", False)
+        a.add_child(aa)
+        self.assertFalse(a.is_frozen)
+        a.freeze()
+        self.assertTrue(a.is_frozen)
+        self.assertTrue(aa.is_frozen)
+
+        with self.assertRaises(TypeError) as context:
+            aa.local_size = 100
+        self.assertTrue(str(context.exception).startswith("Cannot modify a frozen file"))
+        with self.assertRaises(TypeError):
+            a.state = ModelFile.State.QUEUED
+        with self.assertRaises(TypeError):
+            a.update_timestamp = datetime.now()
+        with self.assertRaises(TypeError):
+            a.add_child(ModelFile("ab", False))
+        self.assertIsNone(aa.local_size)
+        self.assertEqual(["aa"], [f.name for f in a.get_children()])
+
+        # Frozen files cannot join another tree
+        b = ModelFile("b", True)
+        with self.assertRaises(TypeError) as context:
+            b.add_child(aa)
+        self.assertTrue(str(context.exception).startswith("Cannot add a frozen file as a child"))
+        self.assertEqual(a, aa.parent)
+
+        # Frozen trees are still compared by content
+        a2 = ModelFile("a", True)
+        a2.add_child(ModelFile("aa", False))
+        self.assertEqual(a, a2)
@@ -0,0 +1,86 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import unittest
+
+from common import overrides
+from model import Model, ModelFile, ModelJournal, ModelJournalEntry
+
+
+class TestModelJournal(unittest.TestCase):
+    @overrides(unittest.TestCase)
+    def setUp(self):
+        self.model = Model()
+        self.journal = ModelJournal(self.model, capacity=3)
+        self.model.add_listener(self.journal)
+
+    def test_entries(self):
+        file_a = ModelFile("a", True)
+        self.model.add_file(file_a)
+        file_a_new = ModelFile("a", True)
+        file_a_new.local_size = 100
+        self.model.update_file(file_a_new)
+        self.model.remove_file("a")
+        entries = self.journal.get_entries(0)
+        self.assertEqual(3, len(entries))
+        self.assertEqual(1, entries[0].seq)
+        self.assertEqual(ModelJournalEntry.Change.ADDED, entries[0].change)
+        self.assertEqual(None, entries[0].old_file)
+        self.assertEqual(file_a, entries[0].new_file)
+        self.assertEqual(2, entries[1].seq)
+        self.assertEqual(ModelJournalEntry.Change.UPDATED, entries[1].change)
+        self.assertEqual(file_a, entries[1].old_file)
+        self.assertEqual(file_a_new, entries[1].new_file)
+        self.assertEqual(3, entries[2].seq)
+        self.assertEqual(ModelJournalEntry.Change.REMOVED, entries[2].change)
+        self.assertEqual(file_a_new, entries[2].old_file)
+        self.assertEqual(None, entries[2].new_file)
+
+    def test_entries_after_seq(self):
+        self.assertEqual([], self.journal.get_entries(0))
+        self.model.add_file(ModelFile("a", True))
+        self.model.add_file(ModelFile("b", True))
+        self.assertEqual([1, 2], [e.seq for e in self.journal.get_entries(0)])
+        self.assertEqual([2], [e.seq for e in self.journal.get_entries(1)])
+        self.assertEqual([], self.journal.get_entries(2))
+
+    def test_future_seq(self):
+        self.assertIsNone(self.journal.get_entries(1))
+        self.model.add_file(ModelFile("a", True))
+        self.assertIsNone(self.journal.get_entries(2))
+
+    def test_evicted_seq(self):
+        for name in ["a", "b", "c", "d", "e"]:
+            self.model.add_file(ModelFile(name, True))
+        # Only the last 3 remain
+        self.assertIsNone(self.journal.get_entries(0))
+        self.assertIsNone(self.journal.get_entries(1))
+        self.assertEqual([3, 4, 5], [e.seq for e in self.journal.get_entries(2)])
+        self.assertEqual([5], [e.seq for e in self.journal.get_entries(4)])
+
+    def test_starts_from_model_seq(self):
+        self.model.add_file(ModelFile("a", True))
+        journal = ModelJournal(self.model)
+        self.model.add_listener(journal)
+        self.assertIsNone(journal.get_entries(0))
+        self.assertEqual([], journal.get_entries(1))
+        self.model.add_file(ModelFile("b", True))
+        self.assertEqual([2], [e.seq for e in journal.get_entries(1)])
+
+    def test_continues_from_snapshot(self):
+        self.model.add_file(ModelFile("a", True))
+        self.model.publish_snapshot()
+        self.model.add_file(ModelFile("b", True))
+        snapshot = self.model.get_snapshot()
+        self.assertEqual(["a"], [f.name for f in snapshot.files])
+        entries = self.journal.get_entries(snapshot.seq)
+        self.assertEqual(["b"], [e.new_file.name for e in entries])
+
+    def test_event_ids(self):
+        self.assertEqual(5, self.journal.from_event_id(self.journal.to_event_id(5)))
+        self.assertEqual(0, self.journal.from_event_id(self.journal.to_event_id(0)))
+        self.assertIsNone(self.journal.from_event_id(""))
+        self.assertIsNone(self.journal.from_event_id("5"))
+        self.assertIsNone(self.journal.from_event_id(self.journal.to_event_id(5) + "x"))
+        # Ids of another journal, e.g. from before a restart
+        other_journal = ModelJournal(Model())
+        self.assertIsNone(self.journal.from_event_id(other_journal.to_event_id(5)))
@@ -2,11 +2,12 @@
 
 import logging
 import sys
+import threading
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from common import overrides
-from model import Model, ModelFile, IModelListener, ModelError
+from model import Model, ModelFile, IModelListener, ModelError, ModelPatch
 
 
 class DummyModelListener(IModelListener):
@@ -138,3 +139,141 @@ class TestLftpModel(unittest.TestCase):
         self.model.update_file(new_file)
         # noinspection PyUnresolvedReferences
         listener.file_updated.assert_called_once_with(old_file, new_file)
+
+    def test_listener_file_patched(self):
+        listener = DummyModelListener()
+        self.model.add_listener(listener)
+
+        listener.file_updated = MagicMock()
+        listener.file_patched = MagicMock()
+
+        old_file = ModelFile("test", True)
+        old_file.add_child(ModelFile("child", False))
+        self.model.add_file(old_file)
+        new_file = ModelFile("test", True)
+        new_child = ModelFile("child", False)
+        new_child.local_size = 200
+        new_file.add_child(new_child)
+        self.model.update_file(new_file)
+        # noinspection PyUnresolvedReferences
+        listener.file_patched.assert_called_once_with(old_file, new_file, [
+            ModelPatch(ModelPatch.Change.UPDATED, "test/child", fields={"local_size": 200})
+        ])
+        # noinspection PyUnresolvedReferences
+        listener.file_updated.assert_not_called()
+
+    @patch("model.model.ModelPatchUtil.diff_files")
+    def test_patches_not_computed_without_patch_listener(self, mock_diff_files):
+        listener = DummyModelListener()
+        self.model.add_listener(listener)
+        listener.file_updated = MagicMock()
+
+        self.model.add_file(ModelFile("test", True))
+        new_file = ModelFile("test", True)
+        new_file.local_size = 100
+        self.model.update_file(new_file)
+        # noinspection PyUnresolvedReferences
+        listener.file_updated.assert_called_once_with(ModelFile("test", True), new_file)
+        mock_diff_files.assert_not_called()
+
+    def test_seq(self):
+        self.assertEqual(0, self.model.seq)
+        self.model.add_file(ModelFile("a", False))
+        self.model.add_file(ModelFile("b", False))
+        self.assertEqual(2, self.model.seq)
+        self.model.update_file(ModelFile("a", False))
+        self.model.remove_file("b")
+        self.assertEqual(4, self.model.seq)
+
+    def test_snapshot(self):
+        snapshot = self.model.get_snapshot()
+        self.assertEqual(0, snapshot.seq)
+        self.assertEqual((), snapshot.files)
+
+        a = ModelFile("a", False)
+        self.model.add_file(a)
+        # Not published yet
+        self.assertIs(snapshot, self.model.get_snapshot())
+
+        self.model.publish_snapshot()
+        snapshot = self.model.get_snapshot()
+        self.assertEqual(1, snapshot.seq)
+        self.assertEqual((a,), snapshot.files)
+
+        # Nothing new to publish
+        self.model.publish_snapshot()
+        self.assertIs(snapshot, self.model.get_snapshot())
+
+        self.model.remove_file("a")
+        self.model.publish_snapshot()
+        self.assertEqual(2, self.model.get_snapshot().seq)
+        self.assertEqual((), self.model.get_snapshot().files)
+        # Old snapshot is unchanged
+        self.assertEqual((a,), snapshot.files)
+
+    def test_get_snapshot_and_add_listener(self):
+        a = ModelFile("a", False)
+        self.model.add_file(a)
+        self.model.publish_snapshot()
+
+        listener = DummyModelListener()
+        listener.file_added = MagicMock()
+        listener.file_removed = MagicMock()
+        snapshot = self.model.get_snapshot_and_add_listener(listener)
+        self.assertEqual((a,), snapshot.files)
+
+        b = ModelFile("b", False)
+        self.model.add_file(b)
+        listener.file_added.assert_called_once_with(b)
+
+        # Removed by the listener it was added with
+        self.model.remove_listener(listener)
+        self.model.remove_file("a")
+        listener.file_removed.assert_not_called()
+
+    def test_get_snapshot_and_add_listener_during_changes(self):
+        a = ModelFile("a", False)
+        self.model.add_file(a)
+        self.model.publish_snapshot()
+        # Batch in progress
+        b = ModelFile("b", False)
+        self.model.add_file(b)
+
+        listener = DummyModelListener()
+        listener.file_added = MagicMock()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.model.get_snapshot_and_add_listener(listener)))
+        thread.start()
+        # Waits for the snapshot of the batch
+        thread.join(timeout=0.1)
+        self.assertTrue(thread.is_alive())
+
+        # Rest of the batch is already in the snapshot
+        c = ModelFile("c", False)
+        self.model.add_file(c)
+        self.model.publish_snapshot()
+        thread.join(timeout=1.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual({"a", "b", "c"}, {f.name for f in result[0].files})
+        listener.file_added.assert_not_called()
+
+        # Later changes are passed through
+        d = ModelFile("d", False)
+        self.model.add_file(d)
+        listener.file_added.assert_called_once_with(d)
+
+    def test_listeners_changed_while_notifying(self):
+        listener_2 = DummyModelListener()
+        listener_2.file_added = MagicMock()
+
+        class AddingListener(DummyModelListener):
+            def file_added(_self, file: ModelFile):
+                self.model.add_listener(listener_2)
+
+        self.model.add_listener(AddingListener())
+        self.model.add_file(ModelFile("a", False))
+        # Added during the notification, so only sees the next change
+        listener_2.file_added.assert_not_called()
+        b = ModelFile("b", False)
+        self.model.add_file(b)
+        listener_2.file_added.assert_called_once_with(b)
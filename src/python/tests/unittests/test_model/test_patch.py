@@ -0,0 +1,92 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import unittest
+
+from model import ModelFile, ModelPatch, ModelPatchUtil
+
+
+class TestModelPatchUtil(unittest.TestCase):
+    @staticmethod
+    def __build_tree() -> ModelFile:
+        a = ModelFile("a", True)
+        aa = ModelFile("aa", True)
+        a.add_child(aa)
+        aaa = ModelFile("aaa.rar", False)
+        aaa.local_size = 10
+        aaa.remote_size = 100
+        aa.add_child(aaa)
+        aab = ModelFile("aab", False)
+        aab.remote_size = 200
+        aa.add_child(aab)
+        ab = ModelFile("ab", False)
+        ab.remote_size = 300
+        a.add_child(ab)
+        return a
+
+    @staticmethod
+    def __get_file(root: ModelFile, path: str) -> ModelFile:
+        file = root
+        for name in path.split("/")[1:]:
+            file = next(f for f in file.get_children() if f.name == name)
+        return file
+
+    def test_no_change(self):
+        self.assertEqual([], ModelPatchUtil.diff_files(self.__build_tree(), self.__build_tree()))
+
+    def test_updated_fields(self):
+        old_file = self.__build_tree()
+        new_file = self.__build_tree()
+        self.__get_file(new_file, "a/aa/aaa.rar").local_size = 50
+        self.__get_file(new_file, "a/aa/aaa.rar").state = ModelFile.State.DOWNLOADING
+        self.assertEqual([
+            ModelPatch(ModelPatch.Change.UPDATED, "a/aa/aaa.rar", fields={
+                "state": ModelFile.State.DOWNLOADING,
+                "local_size": 50
+            })
+        ], ModelPatchUtil.diff_files(old_file, new_file))
+
+        new_file.state = ModelFile.State.DOWNLOADING
+        patches = ModelPatchUtil.diff_files(old_file, new_file)
+        self.assertEqual(2, len(patches))
+        self.assertIn(ModelPatch(ModelPatch.Change.UPDATED, "a", fields={"state": ModelFile.State.DOWNLOADING}),
+                      patches)
+
+    def test_added_and_removed(self):
+        old_file = self.__build_tree()
+        new_file = ModelFile("a", True)
+        new_aa = ModelFile("aa", True)
+        new_file.add_child(new_aa)
+        new_aaa = ModelFile("aaa.rar", False)
+        new_aaa.local_size = 10
+        new_aaa.remote_size = 100
+        new_aa.add_child(new_aaa)
+        new_ac = ModelFile("ac", True)
+        new_ac.add_child(ModelFile("aca", False))
+        new_file.add_child(new_ac)
+        patches = ModelPatchUtil.diff_files(old_file, new_file)
+        self.assertEqual(3, len(patches))
+        self.assertIn(ModelPatch(ModelPatch.Change.REMOVED, "a/ab"), patches)
+        self.assertIn(ModelPatch(ModelPatch.Change.REMOVED, "a/aa/aab"), patches)
+        self.assertIn(ModelPatch(ModelPatch.Change.ADDED, "a/ac", new_file=new_ac), patches)
+
+    def test_replaced(self):
+        old_file = self.__build_tree()
+        new_ab = ModelFile("ab", True)
+        new_file = ModelFile("a", True)
+        new_file.add_child(self.__get_file(self.__build_tree(), "a/aa"))
+        new_file.add_child(new_ab)
+        self.assertEqual([
+            ModelPatch(ModelPatch.Change.REMOVED, "a/ab"),
+            ModelPatch(ModelPatch.Change.ADDED, "a/ab", new_file=new_ab)
+        ], ModelPatchUtil.diff_files(old_file, new_file))
+
+    def test_skips_unchanged_subtrees(self):
+        old_file = self.__build_tree()
+        new_file = self.__build_tree()
+        self.__get_file(new_file, "a/ab").local_size = 1
+        aa = self.__get_file(new_file, "a/aa")
+        # The unchanged subtree is never read beyond its hash
+        aa.get_children = None
+        self.assertEqual([
+            ModelPatch(ModelPatch.Change.UPDATED, "a/ab", fields={"local_size": 1})
+        ], ModelPatchUtil.diff_files(old_file, new_file))
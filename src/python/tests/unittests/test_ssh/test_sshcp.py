@@ -5,9 +5,12 @@ import os
 import tempfile
 import shutil
 import filecmp
+import json
 import logging
 import sys
+from unittest.mock import patch
 
+import pexpect
 import timeout_decorator
 from parameterized import parameterized
 
@@ -184,3 +187,296 @@ class TestSshcp(unittest.TestCase):
         with self.assertRaises(SshcpError) as ctx:
             sshcp.shell("./some_bad_command.sh".format(self.local_dir))
         self.assertTrue("./some_bad_command.sh" in str(ctx.exception))
+
+    @parameterized.expand(_PARAMS)
+    @timeout_decorator.timeout(5)
+    def test_shell_stream(self, _, password):
+        sshcp = Sshcp(host=self.host, port=self.port, user=self.user, password=password)
+        chunks = []
+        sshcp.shell_stream("cd {}; pwd".format(self.local_dir), chunks.append)
+        self.assertEqual(self.local_dir, b"".join(chunks).decode())
+
+    @timeout_decorator.timeout(5)
+    def test_shell_stream_error_bad_password(self):
+        sshcp = Sshcp(host=self.host, port=self.port, user=self.user, password="wrong password")
+        with self.assertRaises(SshcpError) as ctx:
+            sshcp.shell_stream("cd {}; pwd".format(self.local_dir), lambda data: None)
+        self.assertEqual("Incorrect password", str(ctx.exception))
+
+    @parameterized.expand(_PARAMS)
+    @timeout_decorator.timeout(5)
+    def test_shell_stream_error_bad_host(self, _, password):
+        sshcp = Sshcp(host="badhost", port=self.port, user=self.user, password=password)
+        with self.assertRaises(SshcpError) as ctx:
+            sshcp.shell_stream("cd {}; pwd".format(self.local_dir), lambda data: None)
+        self.assertTrue("Bad hostname" in str(ctx.exception))
+
+    @parameterized.expand(_PARAMS)
+    @timeout_decorator.timeout(5)
+    def test_shell_stream_error_bad_port(self, _, password):
+        sshcp = Sshcp(host=self.host, port=6666, user=self.user, password=password)
+        with self.assertRaises(SshcpError) as ctx:
+            sshcp.shell_stream("cd {}; pwd".format(self.local_dir), lambda data: None)
+        self.assertTrue("Connection refused by server" in str(ctx.exception))
+
+
+class TestSshcpShellStream(unittest.TestCase):
+    """
+    Streams the output of a local process through a real terminal, in place of ssh
+    """
+    # Every byte value, including newlines, surrounded by non-whitespace
+    DATA = b"X" + bytes(range(256)) * 1000 + b"Y"
+
+    def setUp(self):
+        self.script = None
+        real_spawn = pexpect.spawn
+
+        def local_spawn(command, **kwargs):
+            return real_spawn(sys.executable, args=["-c", self.script], **kwargs)
+        spawn_patcher = patch("ssh.sshcp.pexpect.spawn", side_effect=local_spawn)
+        self.addCleanup(spawn_patcher.stop)
+        spawn_patcher.start()
+
+    @timeout_decorator.timeout(5)
+    def test_output_is_not_translated(self):
+        self.script = "import sys, time\n" \
+                      "data = b'X' + bytes(range(256)) * 1000 + b'Y'\n" \
+                      "sys.stdout.buffer.write(b'\\r\\n  ' + data[:1000])\n" \
+                      "sys.stdout.flush()\n" \
+                      "time.sleep(0.1)\n" \
+                      "sys.stdout.buffer.write(data[1000:] + b'\\n')"
+        chunks = []
+        Sshcp(host="host", port=22, multiplex=False).shell_stream("command", chunks.append)
+        self.assertEqual(TestSshcpShellStream.DATA, b"".join(chunks))
+        self.assertGreater(len(chunks), 1)
+
+    @timeout_decorator.timeout(5)
+    def test_consumer_error_is_raised_after_success(self):
+        self.script = "import sys; sys.stdout.write('output')"
+
+        def consumer(data):
+            raise ValueError("bad data")
+        with self.assertRaises(ValueError):
+            Sshcp(host="host", port=22, multiplex=False).shell_stream("command", consumer)
+
+    @timeout_decorator.timeout(5)
+    def test_command_error_takes_precedence_over_consumer_error(self):
+        self.script = "import sys; sys.stdout.write('an error message'); sys.exit(1)"
+
+        def consumer(data):
+            raise ValueError("bad data")
+        with self.assertRaises(SshcpError) as ctx:
+            Sshcp(host="host", port=22, multiplex=False).shell_stream("command", consumer)
+        self.assertEqual("an error message", str(ctx.exception))
+
+
+# Stand-in for the ssh and scp commands, that runs commands locally and
+# logs the kind of each invocation
+_FAKE_SSH = """
+import getpass
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+prog = os.path.basename(sys.argv[0])
+options = {}
+positional = []
+args = sys.argv[1:]
+while args:
+    arg = args.pop(0)
+    if arg == "-o":
+        key, value = args.pop(0).split("=", 1)
+        options[key] = value
+    elif arg in ("-p", "-P", "-O"):
+        options[arg] = args.pop(0)
+    elif not arg.startswith("-"):
+        positional.append(arg)
+
+control_path = options.get("ControlPath")
+if "-O" in options:
+    kind = "check"
+elif options.get("ControlMaster") == "yes":
+    kind = "master"
+elif control_path and os.path.exists(control_path):
+    kind = "multiplexed"
+else:
+    kind = "direct"
+with open(os.environ["FAKE_SSH_LOG"], "a") as f:
+    f.write(json.dumps({"prog": prog, "kind": kind}) + "\\n")
+
+if kind == "check":
+    sys.exit(0 if os.path.exists(control_path) else 255)
+if kind == "master" and os.environ.get("FAKE_SSH_MASTER_ERROR"):
+    print(os.environ["FAKE_SSH_MASTER_ERROR"])
+    sys.exit(255)
+if kind != "multiplexed" and options.get("PubkeyAuthentication") == "no":
+    if options.get("BatchMode") == "yes":
+        print("Permission denied")
+        sys.exit(255)
+    while getpass.getpass("user@host's password: ") != os.environ["FAKE_SSH_PASSWORD"]:
+        pass
+if kind == "master":
+    open(control_path, "w").close()
+elif prog == "scp":
+    shutil.copy(positional[0], positional[1].split(":", 1)[1])
+else:
+    sys.exit(subprocess.call(positional[1], shell=True))
+"""
+
+
+class TestSshcpMultiplexing(unittest.TestCase):
+    """
+    Runs Sshcp against a local stand-in for ssh and scp, that emulates a
+    master connection with a control file
+    """
+    @overrides(unittest.TestCase)
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_sshcp_multiplexing")
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        bin_dir = os.path.join(self.temp_dir, "bin")
+        os.mkdir(bin_dir)
+        for prog in ("ssh", "scp"):
+            path = os.path.join(bin_dir, prog)
+            with open(path, "w") as f:
+                f.write("#!{}\n{}".format(sys.executable, _FAKE_SSH))
+            os.chmod(path, 0o755)
+        self.control_dir = os.path.join(self.temp_dir, "control")
+        self.log_path = os.path.join(self.temp_dir, "log")
+        env_patcher = patch.dict(os.environ, {
+            "PATH": bin_dir + os.pathsep + os.environ["PATH"],
+            "FAKE_SSH_LOG": self.log_path,
+            "FAKE_SSH_PASSWORD": _PASSWORD
+        })
+        self.addCleanup(env_patcher.stop)
+        env_patcher.start()
+
+    def create_sshcp(self, password: str = _PASSWORD, multiplex: bool = True) -> Sshcp:
+        return Sshcp(host="host", port=22, user="user", password=password,
+                     multiplex=multiplex, control_dir=self.control_dir)
+
+    def read_log(self):
+        with open(self.log_path, "r") as f:
+            return [(line["prog"], line["kind"]) for line in map(json.loads, f)]
+
+    @parameterized.expand(_PARAMS)
+    @timeout_decorator.timeout(10)
+    def test_commands_share_master(self, _, password):
+        sshcp = self.create_sshcp(password)
+        self.assertEqual(b"hello", sshcp.shell("echo hello"))
+        self.assertEqual(b"world", sshcp.shell("echo world"))
+        chunks = []
+        sshcp.shell_stream("echo stream", chunks.append)
+        self.assertEqual(b"stream", b"".join(chunks))
+        self.assertEqual([
+            ("ssh", "master"), ("ssh", "multiplexed"),
+            ("ssh", "check"), ("ssh", "multiplexed"),
+            ("ssh", "check"), ("ssh", "multiplexed"),
+        ], self.read_log())
+
+    @timeout_decorator.timeout(10)
+    def test_master_is_shared_across_instances(self):
+        self.assertEqual(b"1", self.create_sshcp().shell("echo 1"))
+        self.assertEqual(b"2", self.create_sshcp().shell("echo 2"))
+        self.assertEqual(1, self.read_log().count(("ssh", "master")))
+
+    @timeout_decorator.timeout(10)
+    def test_copy_uses_master(self):
+        local_path = os.path.join(self.temp_dir, "local")
+        remote_path = os.path.join(self.temp_dir, "remote")
+        with open(local_path, "w") as f:
+            f.write("content")
+        self.create_sshcp().copy(local_path, remote_path)
+        self.assertTrue(filecmp.cmp(local_path, remote_path))
+        self.assertEqual([("ssh", "master"), ("scp", "multiplexed")], self.read_log())
+
+    @timeout_decorator.timeout(10)
+    def test_restarts_dead_master(self):
+        sshcp = self.create_sshcp()
+        sshcp.shell("echo 1")
+        shutil.rmtree(self.control_dir)
+        self.assertEqual(b"2", sshcp.shell("echo 2"))
+        self.assertEqual([
+            ("ssh", "master"), ("ssh", "multiplexed"),
+            ("ssh", "master"), ("ssh", "multiplexed"),
+        ], self.read_log())
+
+    @timeout_decorator.timeout(10)
+    def test_connects_directly_if_master_fails(self):
+        os.environ["FAKE_SSH_MASTER_ERROR"] = "some error"
+        sshcp = self.create_sshcp()
+        self.assertEqual(b"1", sshcp.shell("echo 1"))
+        self.assertEqual(b"2", sshcp.shell("echo 2"))
+        # The master is not retried right away
+        self.assertEqual([("ssh", "master"), ("ssh", "direct"), ("ssh", "direct")], self.read_log())
+
+    @timeout_decorator.timeout(10)
+    def test_master_is_not_shared_with_other_passwords(self):
+        self.create_sshcp().shell("echo 1")
+        with self.assertRaises(SshcpError) as ctx:
+            self.create_sshcp(password="wrong password").shell("echo 2")
+        self.assertEqual("Incorrect password", str(ctx.exception))
+
+    @timeout_decorator.timeout(10)
+    def test_error_of_multiplexed_command(self):
+        sshcp = self.create_sshcp()
+        with self.assertRaises(SshcpError) as ctx:
+            sshcp.shell("echo error output; exit 1")
+        self.assertEqual("error output", str(ctx.exception))
+
+    @timeout_decorator.timeout(10)
+    def test_no_multiplexing(self):
+        sshcp = self.create_sshcp(multiplex=False)
+        self.assertEqual(b"1", sshcp.shell("echo 1"))
+        self.assertEqual([("ssh", "direct")], self.read_log())
+        self.assertFalse(os.path.exists(self.control_dir))
+
+    @timeout_decorator.timeout(10)
+    def test_latency_stats(self):
+        sshcp = self.create_sshcp()
+        sshcp.shell("echo 1")
+        sshcp.shell("echo 2")
+        stats = sshcp.latency_stats()
+        self.assertEqual(1, stats[Sshcp.LATENCY_CONNECT].count)
+        self.assertEqual(1, stats[Sshcp.LATENCY_CHECK].count)
+        self.assertEqual(2, stats[Sshcp.LATENCY_SHELL].count)
+        shell_stats = stats[Sshcp.LATENCY_SHELL]
+        self.assertGreater(shell_stats.last_in_s, 0)
+        self.assertGreaterEqual(shell_stats.max_in_s, shell_stats.mean_in_s)
+        self.assertAlmostEqual(shell_stats.total_in_s / 2, shell_stats.mean_in_s)
+
+    @parameterized.expand(_PARAMS)
+    @timeout_decorator.timeout(10)
+    def test_channel(self, _, password):
+        channel = self.create_sshcp(password).open_channel("cat")
+        # Input is not echoed, and the output is not translated
+        channel.send(b"line 1\n")
+        data = b""
+        while data != b"line 1\n":
+            data += channel.read(1024)
+        channel.send(b"line 2\n")
+        data = b""
+        while data != b"line 2\n":
+            data += channel.read(1024)
+        self.assertTrue(channel.is_alive())
+        channel.close()
+        self.assertFalse(channel.is_alive())
+
+    @timeout_decorator.timeout(10)
+    def test_channel_error_on_exit(self):
+        channel = self.create_sshcp().open_channel("echo error output; exit 1")
+        with self.assertRaises(SshcpError) as ctx:
+            while True:
+                channel.read(1024)
+        self.assertEqual("error output", str(ctx.exception))
+
+    @timeout_decorator.timeout(10)
+    def test_channel_read_available(self):
+        channel = self.create_sshcp().open_channel("cat")
+        self.assertEqual(b"", channel.read_available(1024, 0.1))
+        channel.send(b"line\n")
+        data = b""
+        while data != b"line\n":
+            data += channel.read_available(1024, 1)
+        channel.close()
@@ -0,0 +1,197 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from system import ScanAgent, ScanAgentError, ScanAgentResponseReader, ScanRequest, \
+    WireFormat, WireFormatDecoder
+
+
+class TestScanAgent(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_agent")
+        self.scan_dir = os.path.join(self.temp_dir, "scan")
+        os.makedirs(os.path.join(self.scan_dir, "a", "aa"))
+        with open(os.path.join(self.scan_dir, "a", "aa", "aaa"), "w") as f:
+            f.write("x" * 10)
+        with open(os.path.join(self.scan_dir, "b"), "w") as f:
+            f.write("x" * 20)
+        self.state_path = os.path.join(self.temp_dir, "state")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_agent(self, agent: ScanAgent, requests: list) -> bytes:
+        out = io.BytesIO()
+        agent.run(io.BytesIO(b"".join(r if isinstance(r, bytes) else r.to_line() for r in requests)), out)
+        return out.getvalue()
+
+    @staticmethod
+    def read_responses(output: bytes, num_responses: int, chunk_size: int = 1) -> list:
+        """
+        Read the output in chunks of chunk_size, and return (decoder, error) of each response
+        """
+        reader = ScanAgentResponseReader()
+        responses = []
+        pos = 0
+        for _ in range(num_responses):
+            decoder = WireFormatDecoder()
+            files = []
+            reader.start_response(lambda data: files.extend(decoder.feed(data)))
+            while not reader.done:
+                reader.feed(output[pos:pos+chunk_size])
+                pos += chunk_size
+            if reader.error is None:
+                decoder.close()
+            responses.append((files, decoder, reader.error))
+        return responses
+
+    def test_hello(self):
+        self.assertEqual(ScanAgent.HELLO, self.run_agent(ScanAgent(self.scan_dir), []))
+
+    def test_serves_requests(self):
+        output = self.run_agent(ScanAgent(self.scan_dir), [
+            ScanRequest(),
+            ScanRequest(compression=WireFormat.COMPRESSION_ZLIB, compression_level=9),
+        ])
+        responses = TestScanAgent.read_responses(output, 2)
+        for files, _, error in responses:
+            self.assertIsNone(error)
+            self.assertEqual(["a", "b"], [f.name for f in files])
+            self.assertEqual(10, files[0].size)
+        self.assertEqual(WireFormat.COMPRESSION_NONE, responses[0][1].compression)
+        self.assertEqual(WireFormat.COMPRESSION_ZLIB, responses[1][1].compression)
+
+    def test_reads_output_in_any_chunks(self):
+        output = self.run_agent(ScanAgent(self.scan_dir), [ScanRequest(), ScanRequest()])
+        for chunk_size in (1, 3, 64, len(output)):
+            responses = TestScanAgent.read_responses(output, 2, chunk_size)
+            self.assertEqual(["a", "b"], [f.name for f in responses[1][0]])
+
+    def test_subtree_request(self):
+        output = self.run_agent(ScanAgent(self.scan_dir), [ScanRequest(path="a")])
+        files, _, error = TestScanAgent.read_responses(output, 1)[0]
+        self.assertIsNone(error)
+        self.assertEqual(["aa"], [f.name for f in files])
+        self.assertEqual(["aaa"], [f.name for f in files[0].children])
+
+    def test_roots_request(self):
+        with open(os.path.join(self.scan_dir, ".c"), "w") as f:
+            f.write("x")
+        agent = ScanAgent(self.scan_dir, exclude_hidden=True, delta_state_path=self.state_path)
+        output = self.run_agent(agent, [ScanRequest(roots=["b", "a", "missing", ".c"]),
+                                        ScanRequest(roots=["a/aa"]),
+                                        ScanRequest(path="a", roots=["aa"])])
+        responses = TestScanAgent.read_responses(output, 3)
+        files, decoder, error = responses[0]
+        self.assertIsNone(error)
+        self.assertEqual(["a", "b"], [f.name for f in files])
+        self.assertEqual(10, files[0].size)
+        # Root scans are never deltas
+        self.assertIsNone(decoder.generation)
+        self.assertTrue(responses[1][2].startswith("ScanAgentError: Bad root name"))
+        self.assertTrue(responses[2][2].startswith("ScanAgentError: Malformed request"))
+
+    def test_delta_requests(self):
+        agent = ScanAgent(self.scan_dir, delta_state_path=self.state_path)
+        output = self.run_agent(agent, [ScanRequest()])
+        files, decoder, _ = TestScanAgent.read_responses(output, 1)[0]
+        self.assertEqual(2, len(files))
+        self.assertIsNone(decoder.base_generation)
+        generation = decoder.generation
+
+        with open(os.path.join(self.scan_dir, "b"), "w") as f:
+            f.write("x" * 30)
+        output = self.run_agent(agent, [ScanRequest(since=generation)])
+        files, decoder, _ = TestScanAgent.read_responses(output, 1)[0]
+        self.assertEqual(generation, decoder.base_generation)
+        self.assertEqual(["b"], [f.name for f in files])
+        self.assertEqual(30, files[0].size)
+
+    def test_subtree_request_is_never_a_delta(self):
+        agent = ScanAgent(self.scan_dir, delta_state_path=self.state_path)
+        output = self.run_agent(agent, [ScanRequest(), ScanRequest(path="a")])
+        responses = TestScanAgent.read_responses(output, 2)
+        self.assertIsNone(responses[1][1].generation)
+        self.assertEqual(["aa"], [f.name for f in responses[1][0]])
+
+    def test_cache_is_persisted(self):
+        cache_path = os.path.join(self.temp_dir, "cache")
+        output = self.run_agent(ScanAgent(self.scan_dir, cache_path=cache_path), [ScanRequest()])
+        self.assertTrue(os.path.isfile(cache_path))
+        expected = TestScanAgent.read_responses(output, 1)[0][0]
+
+        # A new agent starts from the cache, and still sees changes
+        with open(os.path.join(self.scan_dir, "a", "aa", "aab"), "w") as f:
+            f.write("x" * 5)
+        output = self.run_agent(ScanAgent(self.scan_dir, cache_path=cache_path), [ScanRequest(), ScanRequest()])
+        for files, _, error in TestScanAgent.read_responses(output, 2):
+            self.assertIsNone(error)
+            self.assertEqual(["a", "b"], [f.name for f in files])
+            self.assertEqual(15, files[0].size)
+            self.assertEqual(expected[1], files[1])
+
+    def test_error_responses(self):
+        output = self.run_agent(ScanAgent(self.scan_dir), [
+            ScanRequest(path="missing"),
+            ScanRequest(path="../outside"),
+            b"not json\n",
+            b'{"compression_level": 12}\n',
+            b"\n",
+            ScanRequest(),
+        ])
+        responses = TestScanAgent.read_responses(output, 5)
+        self.assertTrue(responses[0][2].startswith("SystemScannerError: "))
+        self.assertTrue(responses[1][2].startswith("ScanAgentError: Path is outside"))
+        self.assertTrue(responses[2][2].startswith("ScanAgentError: Malformed request"))
+        self.assertTrue(responses[3][2].startswith("ScanAgentError: Malformed request"))
+        # The agent keeps serving after errors, and skips blank lines
+        self.assertIsNone(responses[4][2])
+        self.assertEqual(["a", "b"], [f.name for f in responses[4][0]])
+
+    def test_request_round_trip(self):
+        request = ScanRequest(path="a/b", compression=WireFormat.COMPRESSION_ZLIB, compression_level=3, since="gen")
+        line = request.to_line()
+        self.assertTrue(line.endswith(b"\n"))
+        self.assertEqual(1, line.count(b"\n"))
+        parsed = ScanRequest.from_line(line)
+        self.assertEqual(("a/b", WireFormat.COMPRESSION_ZLIB, 3, "gen", None),
+                         (parsed.path, parsed.compression, parsed.compression_level, parsed.since, parsed.roots))
+        parsed = ScanRequest.from_line(ScanRequest(roots=["a\nb", "c"]).to_line())
+        self.assertEqual(["a\nb", "c"], parsed.roots)
+
+
+class TestScanAgentResponseReader(unittest.TestCase):
+    def test_skips_whitespace_before_hello(self):
+        reader = ScanAgentResponseReader()
+        reader.feed(b"\r\n ")
+        reader.feed(ScanAgent.HELLO[:2])
+        self.assertFalse(reader.has_hello)
+        reader.feed(ScanAgent.HELLO[2:])
+        self.assertTrue(reader.has_hello)
+
+    def test_fails_on_bad_hello(self):
+        reader = ScanAgentResponseReader()
+        with self.assertRaises(ScanAgentError):
+            reader.feed(b"usage: scan_fs.py [-h]")
+
+    def test_keeps_output_of_next_response(self):
+        reader = ScanAgentResponseReader()
+        received = []
+        reader.start_response(received.append)
+        reader.feed(ScanAgent.HELLO + b"D\x00\x00\x00\x01aE\x00\x00\x00\x00D\x00\x00\x00\x01b")
+        self.assertTrue(reader.done)
+        self.assertEqual([b"a"], received)
+        reader.start_response(received.append)
+        reader.feed(b"E\x00\x00\x00\x00")
+        self.assertTrue(reader.done)
+        self.assertEqual([b"a", b"b"], received)
+
+    def test_fails_on_unknown_chunk_type(self):
+        reader = ScanAgentResponseReader()
+        reader.start_response(lambda data: None)
+        with self.assertRaises(ScanAgentError):
+            reader.feed(ScanAgent.HELLO + b"Q\x00\x00\x00\x00")
@@ -0,0 +1,72 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from system import ScanDeltaState
+
+
+class TestScanDeltaState(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_delta")
+        self.state_path = os.path.join(self.temp_dir, "state")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_first_update_is_full(self):
+        state = ScanDeltaState(self.state_path)
+        delta = state.update([("a", b"frame a"), ("b", b"frame b")], None)
+        self.assertIsNotNone(delta.generation)
+        self.assertIsNone(delta.base_generation)
+        self.assertEqual([], delta.removed_names)
+        self.assertEqual([b"frame a", b"frame b"], delta.frames)
+
+    def test_delta_against_previous_generation(self):
+        state = ScanDeltaState(self.state_path)
+        delta1 = state.update([("a", b"frame a"), ("b", b"frame b"), ("c", b"frame c")], None)
+        delta2 = state.update([("b", b"frame b2"), ("c", b"frame c"), ("d", b"frame d")], delta1.generation)
+        self.assertNotEqual(delta1.generation, delta2.generation)
+        self.assertEqual(delta1.generation, delta2.base_generation)
+        self.assertEqual(["a"], delta2.removed_names)
+        self.assertEqual([b"frame b2", b"frame d"], delta2.frames)
+
+    def test_unchanged_scan_is_empty_delta(self):
+        state = ScanDeltaState(self.state_path)
+        delta1 = state.update([("a", b"frame a")], None)
+        delta2 = state.update([("a", b"frame a")], delta1.generation)
+        self.assertEqual(delta1.generation, delta2.base_generation)
+        self.assertEqual([], delta2.removed_names)
+        self.assertEqual([], delta2.frames)
+
+    def test_state_persists_across_instances(self):
+        delta1 = ScanDeltaState(self.state_path).update([("a", b"frame a")], None)
+        delta2 = ScanDeltaState(self.state_path).update([("a", b"frame a")], delta1.generation)
+        self.assertEqual(delta1.generation, delta2.base_generation)
+
+    def test_full_scan_on_generation_mismatch(self):
+        state = ScanDeltaState(self.state_path)
+        delta1 = state.update([("a", b"frame a")], None)
+        state.update([("a", b"frame a")], delta1.generation)
+        # reader did not receive the second scan
+        delta3 = state.update([("a", b"frame a")], delta1.generation)
+        self.assertIsNone(delta3.base_generation)
+        self.assertEqual([b"frame a"], delta3.frames)
+
+    def test_full_scan_on_corrupt_state(self):
+        state = ScanDeltaState(self.state_path)
+        delta1 = state.update([("a", b"frame a")], None)
+        with open(self.state_path, "w") as f:
+            f.write("{not json")
+        delta2 = state.update([("a", b"frame a")], delta1.generation)
+        self.assertIsNone(delta2.base_generation)
+        self.assertEqual([b"frame a"], delta2.frames)
+
+    def test_no_generation_if_state_cannot_be_saved(self):
+        state = ScanDeltaState(os.path.join(self.temp_dir, "missing", "state"))
+        delta = state.update([("a", b"frame a")], None)
+        self.assertIsNone(delta.generation)
+        self.assertIsNone(delta.base_generation)
+        self.assertEqual([b"frame a"], delta.frames)
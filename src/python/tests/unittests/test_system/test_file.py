@@ -1,5 +1,6 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
+import pickle
 import unittest
 from datetime import datetime
 
@@ -37,6 +38,24 @@ class TestSystemFile(unittest.TestCase):
         sf = SystemFile("", 0, True)
         self.assertIsNone(sf.timestamp_modified)
 
+    def test_time_ns(self):
+        sf = SystemFile("", 0, True, time_created_ns=1541799618123456789, time_modified_ns=1541799619000000000)
+        self.assertEqual(1541799618123456789, sf.timestamp_created_ns)
+        self.assertEqual(1541799619000000000, sf.timestamp_modified_ns)
+        self.assertEqual(datetime.fromtimestamp(1541799618).replace(microsecond=123456), sf.timestamp_created)
+        self.assertEqual(datetime.fromtimestamp(1541799619), sf.timestamp_modified)
+        sf = SystemFile("", 0, True)
+        self.assertIsNone(sf.timestamp_created_ns)
+        self.assertIsNone(sf.timestamp_modified_ns)
+
+    def test_time_datetime_round_trip(self):
+        dt = datetime(2018, 11, 9, 21, 40, 18, 654321)
+        sf = SystemFile("", 0, True, time_created=dt, time_modified=dt)
+        self.assertEqual(dt, sf.timestamp_created)
+        self.assertEqual(dt, sf.timestamp_modified)
+        self.assertEqual(int(datetime(2018, 11, 9, 21, 40, 18).timestamp()) * 10**9 + 654321000,
+                         sf.timestamp_modified_ns)
+
     def test_add_child(self):
         sf = SystemFile("", 0, True)
         sf.add_child(SystemFile("child1", 42, True))
@@ -83,3 +102,26 @@ class TestSystemFile(unittest.TestCase):
         self.assertTrue(a1 == a2)
         self.assertFalse(a1 == a3)
         self.assertFalse(a1 == a4)
+
+    def test_pickle(self):
+        a = SystemFile("a", 50, is_dir=True,
+                       time_created=datetime(2018, 11, 9, 21, 40, 18),
+                       time_modified_ns=1541799619123456789)
+        a.add_child(SystemFile("aa", 40, is_dir=False))
+        ab = SystemFile("ab", 10, is_dir=True)
+        ab.add_child(SystemFile("aba", 10, is_dir=False))
+        a.add_child(ab)
+        a.add_child(SystemFile("ac", 0, is_dir=True))
+
+        a2 = pickle.loads(pickle.dumps(a))
+        self.assertEqual(a, a2)
+        self.assertEqual(3, len(a2.children))
+        self.assertEqual(1, len(a2.children[1].children))
+        self.assertEqual(0, len(a2.children[2].children))
+        a2.children[2].add_child(SystemFile("aca", 1, is_dir=False))
+        self.assertEqual(1, len(a2.children[2].children))
+
+    def test_no_instance_dict(self):
+        sf = SystemFile("a", 50, is_dir=False)
+        self.assertFalse(hasattr(sf, "__dict__"))
+        self.assertEqual([], sf.children)
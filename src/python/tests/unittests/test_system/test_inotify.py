@@ -0,0 +1,65 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from system import Inotify, InotifyError
+
+
+@unittest.skipIf(not Inotify.is_supported(), "Inotify is not supported")
+class TestInotify(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_inotify")
+        self.inotify = Inotify()
+        self.inotify.open()
+
+    def tearDown(self):
+        self.inotify.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_no_events(self):
+        self.inotify.add_watch(self.temp_dir, Inotify.IN_CREATE)
+        self.assertEqual([], self.inotify.read_events())
+
+    def test_create_and_delete(self):
+        wd = self.inotify.add_watch(self.temp_dir, Inotify.IN_CREATE | Inotify.IN_DELETE)
+        with open(os.path.join(self.temp_dir, "a"), "w") as f:
+            f.write("a")
+        os.mkdir(os.path.join(self.temp_dir, "b"))
+        os.remove(os.path.join(self.temp_dir, "a"))
+        events = self.inotify.read_events(timeout_in_s=1)
+        self.assertEqual(3, len(events))
+        self.assertEqual([wd, wd, wd], [e.wd for e in events])
+        self.assertEqual(["a", "b", "a"], [e.name for e in events])
+        self.assertTrue(events[0].mask & Inotify.IN_CREATE)
+        self.assertFalse(events[0].mask & Inotify.IN_ISDIR)
+        self.assertTrue(events[1].mask & Inotify.IN_CREATE)
+        self.assertTrue(events[1].mask & Inotify.IN_ISDIR)
+        self.assertTrue(events[2].mask & Inotify.IN_DELETE)
+
+    def test_unicode_name(self):
+        self.inotify.add_watch(self.temp_dir, Inotify.IN_CREATE)
+        os.mkdir(os.path.join(self.temp_dir, "déģķ"))
+        events = self.inotify.read_events(timeout_in_s=1)
+        self.assertEqual(["déģķ"], [e.name for e in events])
+
+    def test_same_inode_returns_same_watch(self):
+        wd1 = self.inotify.add_watch(self.temp_dir, Inotify.IN_CREATE)
+        wd2 = self.inotify.add_watch(self.temp_dir + "/", Inotify.IN_CREATE)
+        self.assertEqual(wd1, wd2)
+
+    def test_deleted_dir_is_ignored(self):
+        path = os.path.join(self.temp_dir, "a")
+        os.mkdir(path)
+        wd = self.inotify.add_watch(path, Inotify.IN_DELETE_SELF)
+        os.rmdir(path)
+        events = self.inotify.read_events(timeout_in_s=1)
+        self.assertTrue(any(e.wd == wd and e.mask & Inotify.IN_IGNORED for e in events))
+        # Removing an already removed watch is not an error
+        self.inotify.rm_watch(wd)
+
+    def test_missing_path_fails(self):
+        with self.assertRaises(InotifyError):
+            self.inotify.add_watch(os.path.join(self.temp_dir, "missing"), Inotify.IN_CREATE)
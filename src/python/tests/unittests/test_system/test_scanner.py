@@ -3,8 +3,10 @@
 import os
 import shutil
 import tempfile
+import time
 import unittest
 from threading import Thread
+from unittest.mock import patch
 from datetime import datetime
 
 from system import SystemScanner, SystemScannerError
@@ -628,6 +630,17 @@ class TestSystemScanner(unittest.TestCase):
 
         self.assertEqual(datetime(2018, 11, 9, 21, 40, 18), a.timestamp_modified)
         self.assertEqual(datetime(2018, 11, 9, 21, 40, 17), c.timestamp_modified)
+        self.assertEqual(int(datetime(2018, 11, 9, 21, 40, 18).timestamp()) * 10**9, a.timestamp_modified_ns)
+        self.assertEqual(int(datetime(2018, 11, 9, 21, 40, 17).timestamp()) * 10**9, c.timestamp_modified_ns)
+
+    def test_scan_does_not_probe_for_status_files(self):
+        self.setup_default_tree()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        with patch("os.path.isfile", side_effect=os.path.isfile) as mock_isfile:
+            files = scanner.scan()
+            self.assertEqual(3, len(files))
+            # lftp status files are found by the directory listings
+            mock_isfile.assert_not_called()
 
     def test_scan_file_with_unicode_chars(self):
         tempdir = TestSystemScanner.temp_dir
@@ -660,3 +673,242 @@ class TestSystemScanner(unittest.TestCase):
         self.assertEqual("dir�dir", folder.name)
         self.assertEqual("file�file", file.name)
         self.assertEqual(128, file.size)
+
+    def test_incremental_scan_matches_full_scan(self):
+        self.setup_default_tree()
+        full_scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        self.assertEqual(full_scanner.scan(), scanner.scan())
+        # Second scan is served from the cache
+        self.assertEqual(full_scanner.scan(), scanner.scan())
+
+    def test_incremental_scan_reuses_unchanged_files(self):
+        self.setup_default_tree()
+        # Age all files so that they are not considered recently modified
+        old_time = datetime(2018, 11, 9, 21, 40, 18).timestamp()
+        for root, dirs, files in os.walk(TestSystemScanner.temp_dir):
+            for name in files:
+                os.utime(os.path.join(root, name), (old_time, old_time))
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        a1, b1, c1 = tuple(scanner.scan())
+        a2, b2, c2 = tuple(scanner.scan())
+        self.assertIs(a1, a2)
+        self.assertIs(b1, b2)
+        self.assertIs(c1, c2)
+
+    def test_incremental_scan_detects_changes(self):
+        self.setup_default_tree()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        a, b, c = tuple(scanner.scan())
+        self.assertEqual(12*1024+4+512, a.size)
+
+        # Add a file in a nested dir
+        my_touch(100, "a", "aa", "aac")
+        # Remove a file in another nested dir
+        os.remove(os.path.join(TestSystemScanner.temp_dir, "b", "ba", "baa"))
+        # Add a root
+        my_mkdir("d")
+        a, b, c, d = tuple(scanner.scan())
+        self.assertEqual(12*1024+4+512+100, a.size)
+        aa, ab = tuple(a.children)
+        self.assertEqual([".aaa", ".aab", "aac"], [f.name for f in aa.children])
+        ba, bb = tuple(b.children)
+        self.assertEqual(0, len(ba.children))
+        self.assertEqual(0, ba.size)
+        self.assertEqual("d", d.name)
+
+        # Remove a root
+        shutil.rmtree(os.path.join(TestSystemScanner.temp_dir, "d"))
+        files = scanner.scan()
+        self.assertEqual(["a", "b", "c"], [f.name for f in files])
+
+    def test_incremental_scan_detects_growing_files(self):
+        tempdir = TestSystemScanner.temp_dir
+        os.mkdir(os.path.join(tempdir, "t"))
+        path = os.path.join(tempdir, "t", "partial.mkv")
+        with open(path, 'wb') as f:
+            f.write(bytearray([0xff] * 100))
+        # Date the file well in the past so that only the lftp status pins it
+        old_time = datetime(2018, 11, 9, 21, 40, 18).timestamp()
+        os.utime(path, (old_time, old_time))
+        status_path = os.path.join(tempdir, "t", "partial.mkv.lftp-pget-status")
+        with open(status_path, "w") as f:
+            f.write("size=100\n0.pos=40\n0.limit=100\n")
+
+        scanner = SystemScanner(tempdir)
+        scanner.set_incremental(True)
+        files = scanner.scan()
+        self.assertEqual(40, files[0].children[0].size)
+
+        # Rewrite the status in place, this does not modify the directory
+        with open(status_path, "r+") as f:
+            f.write("size=100\n0.pos=90\n0.limit=100\n")
+        files = scanner.scan()
+        self.assertEqual(90, files[0].children[0].size)
+        self.assertEqual(90, files[0].size)
+
+    def test_incremental_scan_detects_excludes(self):
+        self.setup_default_tree()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        scanner.scan()
+        scanner.add_exclude_prefix(".")
+        a, b, c = tuple(scanner.scan())
+        aa, ab = tuple(a.children)
+        self.assertEqual(0, len(aa.children))
+
+    def create_cache_path(self) -> str:
+        # Kept outside of the scanned tree
+        cache_path = TestSystemScanner.temp_dir + ".cache"
+        self.addCleanup(lambda: os.path.exists(cache_path) and os.remove(cache_path))
+        return cache_path
+
+    def age_default_tree(self):
+        # Age all files so that they are not considered recently modified
+        old_time = datetime(2018, 11, 9, 21, 40, 18).timestamp()
+        for root, dirs, files in os.walk(TestSystemScanner.temp_dir):
+            for name in files:
+                os.utime(os.path.join(root, name), (old_time, old_time))
+
+    def test_saved_cache_is_reused(self):
+        self.setup_default_tree()
+        self.age_default_tree()
+        cache_path = self.create_cache_path()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        expected = scanner.scan()
+        scanner.save_cache(cache_path)
+
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        self.assertTrue(scanner.load_cache(cache_path))
+        listed_paths = []
+        orig_scandir = os.scandir
+
+        def scandir(path):
+            listed_paths.append(path)
+            return orig_scandir(path)
+        with patch("system.scanner.os.scandir", side_effect=scandir):
+            self.assertEqual(expected, scanner.scan())
+        # Nothing changed, so no directory was listed again
+        self.assertEqual([], listed_paths)
+
+        # Changes made between the runs are still found
+        my_touch(100, "a", "aa", "aac")
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        self.assertTrue(scanner.load_cache(cache_path))
+        a, b, c = tuple(scanner.scan())
+        self.assertEqual(12*1024+4+512+100, a.size)
+        self.assertEqual(SystemScanner(TestSystemScanner.temp_dir).scan(), [a, b, c])
+
+    def test_saved_cache_is_ignored_if_unusable(self):
+        self.setup_default_tree()
+        cache_path = self.create_cache_path()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        scanner.scan()
+        scanner.save_cache(cache_path)
+
+        # Different config
+        other_scanner = SystemScanner(TestSystemScanner.temp_dir)
+        other_scanner.add_exclude_prefix(".")
+        self.assertFalse(other_scanner.load_cache(cache_path))
+        # Missing file
+        self.assertFalse(scanner.load_cache(cache_path + ".missing"))
+        # Corrupt file
+        with open(cache_path, "wb") as f:
+            f.write(b"not a cache")
+        self.assertFalse(scanner.load_cache(cache_path))
+        # The scanner is still usable
+        self.assertEqual(["a", "b", "c"], [f.name for f in scanner.scan()])
+
+    def test_saved_cache_is_bounded(self):
+        self.setup_default_tree()
+        cache_path = self.create_cache_path()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        expected = scanner.scan()
+        scanner.save_cache(cache_path, max_entries=6)
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        self.assertTrue(scanner.load_cache(cache_path))
+        self.assertLess(len(scanner.get_cached_dir_paths()), 10)
+        # Directories left out of the cache are listed again
+        self.assertEqual(expected, scanner.scan())
+        self.assertEqual(10, len(scanner.get_cached_dir_paths()))
+
+    def test_incremental_scan_relists_old_directories(self):
+        self.setup_default_tree()
+        self.age_default_tree()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_incremental(True)
+        scanner.scan()
+        listed_paths = []
+        orig_scandir = os.scandir
+
+        def scandir(path):
+            listed_paths.append(path)
+            return orig_scandir(path)
+        with patch("system.scanner.os.scandir", side_effect=scandir):
+            scanner.scan()
+            self.assertEqual([], listed_paths)
+            # Two hours later every directory is listed again
+            now = time.time()
+            with patch("system.scanner.time.time", return_value=now + 2*60*60):
+                scanner.scan()
+        self.assertIn(os.path.join(TestSystemScanner.temp_dir, "b", "bb"), listed_paths)
+
+    def test_parallel_scan_matches_serial_scan(self):
+        self.setup_default_tree()
+        serial_scanner = SystemScanner(TestSystemScanner.temp_dir)
+        for num_workers in (2, 3, 8):
+            scanner = SystemScanner(TestSystemScanner.temp_dir)
+            scanner.set_num_workers(num_workers)
+            self.assertEqual(serial_scanner.scan(), scanner.scan())
+            self.assertEqual(serial_scanner.scan_single("b"), scanner.scan_single("b"))
+
+    def test_parallel_incremental_scan(self):
+        self.setup_default_tree()
+        serial_scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_num_workers(4)
+        scanner.set_incremental(True)
+        self.assertEqual(serial_scanner.scan(), scanner.scan())
+        my_touch(100, "b", "bb", "bbc", "bbcb")
+        self.assertEqual(serial_scanner.scan(), scanner.scan())
+        self.assertEqual(serial_scanner.scan(), scanner.scan())
+
+    def test_parallel_files_deleted_while_scanning(self):
+        self.setup_default_tree()
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        scanner.set_num_workers(4)
+
+        stop = False
+
+        # Make and delete files while test runs
+        def monkey_with_files():
+            orig = os.path.join(TestSystemScanner.temp_dir, "b")
+            dest = os.path.join(TestSystemScanner.temp_dir, "b_copy")
+            while not stop:
+                shutil.copytree(orig, dest)
+                shutil.rmtree(dest)
+        thread = Thread(target=monkey_with_files)
+        thread.start()
+
+        try:
+            for i in range(0, 500):
+                files = scanner.scan()
+                names = set([f.name for f in files])
+                self.assertTrue({"a", "b", "c"}.issubset(names))
+        finally:
+            stop = True
+            thread.join()
+
+    def test_num_workers_must_be_positive(self):
+        scanner = SystemScanner(TestSystemScanner.temp_dir)
+        with self.assertRaises(ValueError):
+            scanner.set_num_workers(0)
@@ -0,0 +1,145 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import timeout_decorator
+
+from system import ScanWatcher, ScanWatcherError, ScanWatcherReader, Inotify
+
+
+class PipeOutput(io.RawIOBase):
+    """
+    Output stream that hands the written data to the test thread
+    """
+    def __init__(self):
+        self.data = bytearray()
+        self.cond = threading.Condition()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        with self.cond:
+            self.data += b
+            self.cond.notify_all()
+        return len(b)
+
+    def wait_for(self, predicate, timeout_in_s: float = 5.0) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: predicate(bytes(self.data)), timeout_in_s)
+
+
+class TestScanWatcher(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="test_watcher")
+        os.makedirs(os.path.join(self.temp_dir, "a", "aa"))
+        with open(os.path.join(self.temp_dir, "b"), "w") as f:
+            f.write("b")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_watcher(self, watcher: ScanWatcher) -> PipeOutput:
+        input_read_fd, input_write_fd = os.pipe()
+        output = PipeOutput()
+        thread = threading.Thread(target=watcher.run, args=(input_read_fd, output))
+        thread.start()
+
+        def stop():
+            os.close(input_write_fd)
+            thread.join(timeout=5)
+            os.close(input_read_fd)
+            self.assertFalse(thread.is_alive())
+        self.addCleanup(stop)
+        self.assertTrue(output.wait_for(lambda data: data.startswith(ScanWatcher.HELLO)))
+        return output
+
+    def test_check_reports_changed_roots(self):
+        watcher = ScanWatcher(self.temp_dir)
+        watcher.start()
+        self.addCleanup(watcher.stop)
+        self.assertEqual([], watcher.check())
+
+        with open(os.path.join(self.temp_dir, "a", "aa", "aaa"), "w") as f:
+            f.write("aaa")
+        os.mkdir(os.path.join(self.temp_dir, "c"))
+        os.remove(os.path.join(self.temp_dir, "b"))
+        self.assertEqual(["a", "b", "c"], watcher.check())
+        self.assertEqual([], watcher.check())
+
+    def test_check_excludes_hidden(self):
+        watcher = ScanWatcher(self.temp_dir, exclude_hidden=True)
+        watcher.start()
+        self.addCleanup(watcher.stop)
+        os.mkdir(os.path.join(self.temp_dir, ".hidden"))
+        self.assertEqual([], watcher.check())
+
+    @unittest.skipUnless(Inotify.is_supported(), "requires inotify")
+    @timeout_decorator.timeout(10)
+    def test_reports_changes_with_inotify(self):
+        # Poll interval is too long to matter
+        watcher = ScanWatcher(self.temp_dir, poll_interval_in_s=60)
+        output = self.run_watcher(watcher)
+        self.assertTrue(watcher.is_using_inotify())
+
+        with open(os.path.join(self.temp_dir, "a", "aa", "aaa"), "w") as f:
+            f.write("aaa")
+        self.assertTrue(output.wait_for(lambda data: data.endswith(b'{"changed": ["a"]}\n')))
+        os.mkdir(os.path.join(self.temp_dir, "c"))
+        self.assertTrue(output.wait_for(lambda data: data.endswith(b'{"changed": ["c"]}\n')))
+
+    @unittest.skipUnless(Inotify.is_supported(), "requires inotify")
+    @timeout_decorator.timeout(10)
+    def test_does_not_poll_with_inotify(self):
+        watcher = ScanWatcher(self.temp_dir, poll_interval_in_s=0.05)
+        watcher.check = MagicMock(wraps=watcher.check)
+        self.run_watcher(watcher)
+        self.assertTrue(watcher.is_using_inotify())
+        time.sleep(0.3)
+        # Only the baseline scan
+        self.assertEqual(1, watcher.check.call_count)
+
+    @timeout_decorator.timeout(10)
+    def test_reports_changes_by_polling(self):
+        with patch("system.watcher.Inotify.is_supported", return_value=False):
+            watcher = ScanWatcher(self.temp_dir, poll_interval_in_s=0.1)
+            output = self.run_watcher(watcher)
+        self.assertFalse(watcher.is_using_inotify())
+
+        os.mkdir(os.path.join(self.temp_dir, "c"))
+        self.assertTrue(output.wait_for(lambda data: data.endswith(b'{"changed": ["c"]}\n')))
+
+    @timeout_decorator.timeout(10)
+    def test_no_output_without_changes(self):
+        watcher = ScanWatcher(self.temp_dir, poll_interval_in_s=0.05)
+        output = self.run_watcher(watcher)
+        time.sleep(0.3)
+        self.assertEqual(ScanWatcher.HELLO, bytes(output.data))
+
+
+class TestScanWatcherReader(unittest.TestCase):
+    def test_reads_notifications(self):
+        reader = ScanWatcherReader()
+        self.assertEqual([], reader.feed(b"\r\n" + ScanWatcher.HELLO[:3]))
+        self.assertFalse(reader.has_hello)
+        self.assertEqual([], reader.feed(ScanWatcher.HELLO[3:] + b'{"changed": ["a"'))
+        self.assertTrue(reader.has_hello)
+        self.assertEqual([["a", "b"], ["c"]], reader.feed(b', "b"]}\n{"changed": ["c"]}\n'))
+
+    def test_fails_on_bad_hello(self):
+        with self.assertRaises(ScanWatcherError):
+            ScanWatcherReader().feed(b"usage: scan_fs.py")
+
+    def test_fails_on_bad_notification(self):
+        reader = ScanWatcherReader()
+        with self.assertRaises(ScanWatcherError):
+            reader.feed(ScanWatcher.HELLO + b"{}\n")
+        with self.assertRaises(ScanWatcherError):
+            reader.feed(b'{"changed": "a"}\n')
@@ -0,0 +1,178 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import unittest
+from datetime import datetime
+
+from system import SystemFile, WireFormat, WireFormatDecoder, WireFormatError
+
+
+class TestWireFormat(unittest.TestCase):
+    @staticmethod
+    def create_tree():
+        aa = SystemFile("aa", 3072, True, time_modified_ns=1541799600000000000)
+        aa.add_child(SystemFile("aaa.part01.rar", 1024, False, time_modified_ns=1541799500000000001))
+        aa.add_child(SystemFile("aaa.part02.rar", 2048, False, time_modified_ns=1541799700000000000))
+        a = SystemFile("a", 3072 + 12, True,
+                       time_created=datetime(2018, 11, 9, 21, 40, 18),
+                       time_modified_ns=1541799619123456789)
+        a.add_child(aa)
+        a.add_child(SystemFile("ab", 12, False))
+        a.add_child(SystemFile("ac", 0, True))
+        b = SystemFile("b", 99999999999, False,
+                       time_created_ns=1541799618000000000,
+                       time_modified_ns=1541799619000000000)
+        return [a, b]
+
+    def test_round_trip(self):
+        files = TestWireFormat.create_tree()
+        self.assertEqual(files, WireFormat.decode(WireFormat.encode(files)))
+        self.assertEqual(files, WireFormat.decode(WireFormat.encode(files, share_prefixes=False)))
+
+    def test_round_trip_empty(self):
+        self.assertEqual([], WireFormat.decode(WireFormat.encode([])))
+
+    def test_round_trip_unicode_names(self):
+        d = SystemFile("déģķ", 256, True)
+        d.add_child(SystemFile("dőÀ×", 128, False))
+        d.add_child(SystemFile("dőÀ×ÿ", 128, False))
+        self.assertEqual([d], WireFormat.decode(WireFormat.encode([d])))
+
+    def test_round_trip_timestamps(self):
+        f = SystemFile("a", 0, False, time_modified=datetime(2018, 11, 9, 21, 40, 18, 123456))
+        decoded = WireFormat.decode(WireFormat.encode([f]))[0]
+        self.assertEqual(datetime(2018, 11, 9, 21, 40, 18, 123456), decoded.timestamp_modified)
+        self.assertIsNone(decoded.timestamp_created)
+
+    def test_directory_size_is_sum_of_children(self):
+        d = SystemFile("d", 0, True)
+        d.add_child(SystemFile("f1", 10, False))
+        d.add_child(SystemFile("f2", 20, False))
+        self.assertEqual(30, WireFormat.decode(WireFormat.encode([d]))[0].size)
+
+    def test_prefix_sharing_reduces_size(self):
+        d = SystemFile("d", 0, True)
+        for i in range(100):
+            d.add_child(SystemFile("a.long.common.file.name.prefix.{:03d}".format(i), 1, False))
+        self.assertLess(len(WireFormat.encode([d])), len(WireFormat.encode([d], share_prefixes=False)) / 3)
+
+    def test_decodes_memoryview(self):
+        files = TestWireFormat.create_tree()
+        data = b"junk" + WireFormat.encode(files)
+        self.assertEqual(files, WireFormat.decode(memoryview(data)[4:]))
+
+    def test_no_surrounding_whitespace(self):
+        files = [SystemFile(" ", 32, False, time_modified_ns=9)]
+        data = WireFormat.encode(files)
+        self.assertEqual(data, data.strip())
+
+    def test_fails_on_bad_header(self):
+        with self.assertRaises(WireFormatError):
+            WireFormat.decode(b"mangled data")
+        with self.assertRaises(WireFormatError):
+            WireFormat.decode(b"")
+
+    def test_fails_on_unknown_version(self):
+        data = bytearray(WireFormat.encode(TestWireFormat.create_tree()))
+        data[len(WireFormat.MAGIC)] = WireFormat.VERSION + 1
+        with self.assertRaises(WireFormatError) as ctx:
+            WireFormat.decode(bytes(data))
+        self.assertTrue("version" in str(ctx.exception))
+
+    def test_fails_on_truncated_data(self):
+        data = WireFormat.encode(TestWireFormat.create_tree())
+        for length in range(len(data)):
+            with self.assertRaises(WireFormatError):
+                WireFormat.decode(data[:length])
+
+    def test_round_trip_compressed(self):
+        files = TestWireFormat.create_tree()
+        for compression in WireFormat.supported_compressions():
+            data = b"".join(WireFormat.iter_compress(WireFormat.iter_encode(files), compression))
+            self.assertEqual(files, WireFormat.decode(data))
+            self.assertEqual(data, data.strip())
+            decoder = WireFormatDecoder()
+            self.assertEqual(files, decoder.feed(data))
+            decoder.close()
+            self.assertEqual(compression, decoder.compression)
+            self.assertEqual(len(data), decoder.num_bytes_received)
+            self.assertEqual(len(WireFormat.encode(files)), decoder.num_bytes_decoded)
+
+    def test_compression_reduces_size(self):
+        d = SystemFile("d", 0, True)
+        for i in range(1000):
+            d.add_child(SystemFile("file.{:04d}".format(i), 1000, False, time_modified_ns=1541799619000000000))
+        plain = WireFormat.encode([d])
+        compressed = b"".join(WireFormat.iter_compress([plain], WireFormat.COMPRESSION_ZLIB, 9))
+        self.assertLess(len(compressed), len(plain) / 2)
+
+    def test_fails_on_bad_compression_args(self):
+        with self.assertRaises(ValueError):
+            list(WireFormat.iter_compress([b""], "bogus"))
+        with self.assertRaises(ValueError):
+            list(WireFormat.iter_compress([b""], WireFormat.COMPRESSION_ZLIB, 10))
+
+    def test_incremental_decode(self):
+        files = TestWireFormat.create_tree()
+        for compression in WireFormat.supported_compressions():
+            data = b"".join(WireFormat.iter_compress(WireFormat.iter_encode(files), compression))
+            decoder = WireFormatDecoder()
+            decoded = []
+            for i in range(len(data)):
+                decoded += decoder.feed(data[i:i+1])
+            decoder.close()
+            self.assertEqual(files, decoded)
+
+    def test_incremental_decode_returns_completed_roots(self):
+        files = TestWireFormat.create_tree()
+        chunks = list(WireFormat.iter_encode(files))
+        decoder = WireFormatDecoder()
+        self.assertEqual([], decoder.feed(chunks[0]))
+        self.assertEqual([files[0]], decoder.feed(chunks[1]))
+        self.assertEqual([files[1]], decoder.feed(chunks[2]))
+        self.assertEqual([], decoder.feed(chunks[3]))
+        decoder.close()
+
+    def test_fails_on_truncated_compressed_data(self):
+        files = TestWireFormat.create_tree()
+        for compression in WireFormat.supported_compressions():
+            data = b"".join(WireFormat.iter_compress(WireFormat.iter_encode(files), compression))
+            for length in range(len(data)):
+                with self.assertRaises(WireFormatError):
+                    WireFormat.decode(data[:length])
+
+    def test_fails_on_corrupt_compressed_data(self):
+        data = bytearray(b"".join(WireFormat.iter_compress(WireFormat.iter_encode(TestWireFormat.create_tree()),
+                                                           WireFormat.COMPRESSION_ZLIB)))
+        data[len(WireFormat.COMPRESSED_MAGIC) + 3] ^= 0xff
+        with self.assertRaises(WireFormatError):
+            WireFormat.decode(bytes(data))
+
+    def test_round_trip_delta_meta(self):
+        files = TestWireFormat.create_tree()
+        data = b"".join(WireFormat.iter_stream([WireFormat.encode_frame(f) for f in files],
+                                               generation="gen2",
+                                               base_generation="gen1",
+                                               removed_names=["x", "déģķ"]))
+        decoder = WireFormatDecoder()
+        self.assertEqual(files, decoder.feed(data))
+        decoder.close()
+        self.assertEqual("gen2", decoder.generation)
+        self.assertEqual("gen1", decoder.base_generation)
+        self.assertEqual(["x", "déģķ"], decoder.removed_names)
+
+    def test_no_delta_meta_in_plain_scan(self):
+        decoder = WireFormatDecoder()
+        decoder.feed(WireFormat.encode(TestWireFormat.create_tree()))
+        decoder.close()
+        self.assertIsNone(decoder.generation)
+        self.assertIsNone(decoder.base_generation)
+        self.assertEqual([], decoder.removed_names)
+
+    def test_full_scan_meta_has_no_base_generation(self):
+        data = b"".join(WireFormat.iter_compress(WireFormat.iter_stream([], generation="gen1"),
+                                                 WireFormat.COMPRESSION_ZLIB))
+        decoder = WireFormatDecoder()
+        decoder.feed(data)
+        decoder.close()
+        self.assertEqual("gen1", decoder.generation)
+        self.assertIsNone(decoder.base_generation)
@@ -0,0 +1,99 @@
+# Copyright 2017, Inderpreet Singh, All rights reserved.
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+from common import overrides
+from model import Model, ModelFile, ModelJournal
+from web.serialize import SerializeModel
+from web.handler.stream_model import ModelStreamBroadcaster
+
+
+class TestModelStreamBroadcaster(unittest.TestCase):
+    @overrides(unittest.TestCase)
+    def setUp(self):
+        self.model = Model()
+        self.journal = ModelJournal(self.model, capacity=2)
+        self.model.add_listener(self.journal)
+        self.controller = MagicMock()
+        self.controller.get_model_journal.return_value = self.journal
+        self.broadcaster = ModelStreamBroadcaster(self.controller)
+
+    @patch("web.serialize.SerializeModel.model")
+    def test_serializes_model_once(self, mock_model):
+        mock_model.side_effect = lambda files, event_id: event_id
+        self.model.add_file(ModelFile("a", True))
+        self.model.publish_snapshot()
+        snapshot = self.model.get_snapshot()
+        self.assertEqual(self.journal.to_event_id(1), self.broadcaster.serialize_model(snapshot))
+        self.assertEqual(self.journal.to_event_id(1), self.broadcaster.serialize_model(snapshot))
+        mock_model.assert_called_once_with((ModelFile("a", True),), event_id=self.journal.to_event_id(1))
+
+        # A new snapshot is serialized again
+        self.model.add_file(ModelFile("b", True))
+        self.model.publish_snapshot()
+        new_snapshot = self.model.get_snapshot()
+        self.assertEqual(self.journal.to_event_id(2), self.broadcaster.serialize_model(new_snapshot))
+        self.assertEqual(2, mock_model.call_count)
+
+        # The older snapshot does not replace the newer one
+        self.assertEqual(self.journal.to_event_id(1), self.broadcaster.serialize_model(snapshot))
+        self.assertEqual(self.journal.to_event_id(2), self.broadcaster.serialize_model(new_snapshot))
+        self.assertEqual(3, mock_model.call_count)
+
+    @patch("web.serialize.SerializeModel.update_event")
+    def test_serializes_entries_once(self, mock_update_event):
+        mock_update_event.side_effect = lambda event, event_id: event_id
+        file_a = ModelFile("a", True)
+        self.model.add_file(file_a)
+        self.model.remove_file("a")
+        entry1, entry2 = self.journal.get_entries(0)
+        for _ in range(3):
+            self.assertEqual(self.journal.to_event_id(1), self.broadcaster.serialize_entry(entry1))
+            self.assertEqual(self.journal.to_event_id(2), self.broadcaster.serialize_entry(entry2))
+        self.assertEqual(2, mock_update_event.call_count)
+        event1 = mock_update_event.call_args_list[0][0][0]
+        self.assertEqual(SerializeModel.UpdateEvent.Change.ADDED, event1.change)
+        self.assertEqual(None, event1.old_file)
+        self.assertEqual(file_a, event1.new_file)
+        event2 = mock_update_event.call_args_list[1][0][0]
+        self.assertEqual(SerializeModel.UpdateEvent.Change.REMOVED, event2.change)
+        self.assertEqual(file_a, event2.old_file)
+        self.assertEqual(None, event2.new_file)
+
+    @patch("web.serialize.SerializeModel.update_event")
+    def test_evicts_least_recently_used_entries(self, mock_update_event):
+        mock_update_event.side_effect = lambda event, event_id: event_id
+        self.model.add_file(ModelFile("a", True))
+        self.model.add_file(ModelFile("b", True))
+        entry1, entry2 = self.journal.get_entries(0)
+        self.broadcaster.serialize_entry(entry1)
+        self.broadcaster.serialize_entry(entry2)
+        self.broadcaster.serialize_entry(entry1)
+        self.assertEqual(2, mock_update_event.call_count)
+
+        # Only as many as the journal holds are cached, entry2 goes first
+        self.model.add_file(ModelFile("c", True))
+        entry3, = self.journal.get_entries(2)
+        self.broadcaster.serialize_entry(entry3)
+        self.broadcaster.serialize_entry(entry1)
+        self.assertEqual(3, mock_update_event.call_count)
+        self.broadcaster.serialize_entry(entry2)
+        self.assertEqual(4, mock_update_event.call_count)
+
+    def test_serialized_values(self):
+        self.model.add_file(ModelFile("a", True))
+        self.model.publish_snapshot()
+        self.model.remove_file("a")
+        serialize = SerializeModel()
+        self.assertEqual(
+            serialize.model([ModelFile("a", True)], event_id=self.journal.to_event_id(1)),
+            self.broadcaster.serialize_model(self.model.get_snapshot())
+        )
+        entry, = self.journal.get_entries(1)
+        self.assertEqual(
+            serialize.update_event(SerializeModel.UpdateEvent(SerializeModel.UpdateEvent.Change.REMOVED,
+                                                              ModelFile("a", True), None),
+                                   event_id=self.journal.to_event_id(2)),
+            self.broadcaster.serialize_entry(entry)
+        )
@@ -7,7 +7,7 @@ from pytz import timezone
 
 from .test_serialize import parse_stream
 from web.serialize import SerializeModel
-from model import ModelFile
+from model import ModelFile, ModelPatch
 
 
 class TestSerializeModel(unittest.TestCase):
@@ -33,6 +33,37 @@ class TestSerializeModel(unittest.TestCase):
             ))
         )
         self.assertEqual("model-removed", out["event"])
+        out = parse_stream(
+            serialize.update_event(SerializeModel.UpdateEvent(
+                SerializeModel.UpdateEvent.Change.PATCHED, None, ModelFile("a", True), []
+            ))
+        )
+        self.assertEqual("model-patched", out["event"])
+
+    def test_event_ids(self):
+        serialize = SerializeModel()
+        out = parse_stream(serialize.model([]))
+        self.assertNotIn("id", out)
+        out = parse_stream(serialize.model([], event_id="abc-1"))
+        self.assertEqual("abc-1", out["id"])
+        out = parse_stream(
+            serialize.update_event(SerializeModel.UpdateEvent(
+                SerializeModel.UpdateEvent.Change.ADDED, None, None
+            ))
+        )
+        self.assertNotIn("id", out)
+        out = parse_stream(
+            serialize.update_event(SerializeModel.UpdateEvent(
+                SerializeModel.UpdateEvent.Change.ADDED, None, None
+            ), event_id="abc-2")
+        )
+        self.assertEqual("abc-2", out["id"])
+        out = parse_stream(
+            serialize.update_event(SerializeModel.UpdateEvent(
+                SerializeModel.UpdateEvent.Change.PATCHED, None, ModelFile("a", True), []
+            ), event_id="abc-3")
+        )
+        self.assertEqual("abc-3", out["id"])
 
     def test_model_is_a_list(self):
         serialize = SerializeModel()
@@ -332,3 +363,41 @@ class TestSerializeModel(unittest.TestCase):
         self.assertEqual("c/ca/caa", data[2]["children"][0]["children"][0]["full_path"])
         self.assertEqual("c/ca/cab", data[2]["children"][0]["children"][1]["full_path"])
         self.assertEqual("c/cb", data[2]["children"][1]["full_path"])
+
+    def test_patches(self):
+        serialize = SerializeModel()
+        new_file = ModelFile("a", True)
+        added = ModelFile("ab", True)
+        added.add_child(ModelFile("aba", False))
+        new_file.add_child(added)
+        patches = [
+            ModelPatch(ModelPatch.Change.UPDATED, "a/aa", fields={
+                "state": ModelFile.State.DOWNLOADED,
+                "local_size": 100,
+                "local_modified_timestamp": datetime(2018, 11, 9, 21, 40, 18, tzinfo=timezone('UTC'))
+            }),
+            ModelPatch(ModelPatch.Change.ADDED, "a/ab", new_file=added),
+            ModelPatch(ModelPatch.Change.REMOVED, "a/ac"),
+            # Not serialized, so dropped
+            ModelPatch(ModelPatch.Change.UPDATED, "a/ad", fields={"transferred_size": 100})
+        ]
+        out = parse_stream(serialize.update_event(SerializeModel.UpdateEvent(
+            SerializeModel.UpdateEvent.Change.PATCHED, None, new_file, patches
+        )))
+        data = json.loads(out["data"])
+        self.assertEqual("a", data["name"])
+        self.assertEqual(3, len(data["patches"]))
+        self.assertEqual({
+            "change": "updated",
+            "path": "a/aa",
+            "fields": {
+                "state": "downloaded",
+                "local_size": 100,
+                "local_modified_timestamp": str(1541799618.0)
+            }
+        }, data["patches"][0])
+        self.assertEqual("added", data["patches"][1]["change"])
+        self.assertEqual("a/ab", data["patches"][1]["path"])
+        self.assertEqual("ab", data["patches"][1]["file"]["name"])
+        self.assertEqual("a/ab/aba", data["patches"][1]["file"]["children"][0]["full_path"])
+        self.assertEqual({"change": "removed", "path": "a/ac"}, data["patches"][2])
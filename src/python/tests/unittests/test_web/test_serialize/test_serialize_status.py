@@ -97,3 +97,21 @@ class TestSerializeStatus(unittest.TestCase):
         out = parse_stream(serialize.status(status))
         data = json.loads(out["data"])
         self.assertEqual("remote server went boom", data["controller"]["latest_remote_scan_error"])
+
+    def test_controller_status_scan_intervals(self):
+        serialize = SerializeStatus()
+        status = Status()
+        out = parse_stream(serialize.status(status))
+        data = json.loads(out["data"])
+        self.assertIsNone(data["controller"]["remote_scan_interval_in_ms"])
+
+        status.controller.local_scan_interval_in_ms = 1000
+        status.controller.remote_scan_interval_in_ms = 30000
+        status.controller.active_scan_interval_in_ms = 500
+        status.controller.remote_active_scan_interval_in_ms = 600
+        out = parse_stream(serialize.status(status))
+        data = json.loads(out["data"])
+        self.assertEqual(1000, data["controller"]["local_scan_interval_in_ms"])
+        self.assertEqual(30000, data["controller"]["remote_scan_interval_in_ms"])
+        self.assertEqual(500, data["controller"]["active_scan_interval_in_ms"])
+        self.assertEqual(600, data["controller"]["remote_active_scan_interval_in_ms"])
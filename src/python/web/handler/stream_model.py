@@ -1,67 +1,128 @@
 # Copyright 2017, Inderpreet Singh, All rights reserved.
 
+import collections
+from threading import Lock
 from typing import Optional
 
+import bottle
+
 from ..web_app import IStreamHandler
-from ..utils import StreamQueue
 from ..serialize import SerializeModel
-from model import IModelListener, ModelFile
+from model import ModelJournalEntry, ModelSnapshot
 from common import overrides
 from controller import Controller
 
 
-class WebResponseModelListener(IModelListener, StreamQueue[SerializeModel.UpdateEvent]):
+class ModelStreamBroadcaster:
     """
-    Model listener used by streams to listen to model updates
-    One listener should be created for each new request
+    Serializes the model stream once for all the clients
+    Every stream sends the same events, so each event is serialized by the
+    first stream that sends it and then shared with the others. As many events
+    as the journal holds are cached, along with the latest model sent.
     """
-    def __init__(self):
-        super().__init__()
+    __UPDATE_CHANGES = {
+        ModelJournalEntry.Change.ADDED: SerializeModel.UpdateEvent.Change.ADDED,
+        ModelJournalEntry.Change.REMOVED: SerializeModel.UpdateEvent.Change.REMOVED,
+        ModelJournalEntry.Change.UPDATED: SerializeModel.UpdateEvent.Change.UPDATED
+    }
 
-    @overrides(IModelListener)
-    def file_added(self, file: ModelFile):
-        self.put(SerializeModel.UpdateEvent(change=SerializeModel.UpdateEvent.Change.ADDED,
-                                            old_file=None,
-                                            new_file=file))
+    def __init__(self, controller: Controller):
+        self.__controller = controller
+        self.__serialize = SerializeModel()
+        # Separate locks so that serializing a large model does not hold up the events
+        self.__model_lock = Lock()
+        self.__model_seq = None
+        self.__model_value = None
+        self.__events_lock = Lock()
+        self.__events = collections.OrderedDict()  # seq -> serialized event, least recently used first
 
-    @overrides(IModelListener)
-    def file_removed(self, file: ModelFile):
-        self.put(SerializeModel.UpdateEvent(change=SerializeModel.UpdateEvent.Change.REMOVED,
-                                            old_file=file,
-                                            new_file=None))
+    def serialize_model(self, snapshot: ModelSnapshot) -> str:
+        """
+        Returns the serialized model of the given snapshot
+        :param snapshot:
+        :return:
+        """
+        with self.__model_lock:
+            if snapshot.seq == self.__model_seq:
+                return self.__model_value
+            journal = self.__controller.get_model_journal()
+            value = self.__serialize.model(snapshot.files, event_id=journal.to_event_id(snapshot.seq))
+            # A stream may still send an older snapshot, which is not worth keeping
+            if self.__model_seq is None or snapshot.seq > self.__model_seq:
+                self.__model_seq = snapshot.seq
+                self.__model_value = value
+            return value
 
-    @overrides(IModelListener)
-    def file_updated(self, old_file: ModelFile, new_file: ModelFile):
-        self.put(SerializeModel.UpdateEvent(change=SerializeModel.UpdateEvent.Change.UPDATED,
-                                            old_file=old_file,
-                                            new_file=new_file))
+    def serialize_entry(self, entry: ModelJournalEntry) -> str:
+        """
+        Returns the serialized event of the given journal entry
+        :param entry:
+        :return:
+        """
+        with self.__events_lock:
+            value = self.__events.get(entry.seq, None)
+            if value is not None:
+                self.__events.move_to_end(entry.seq)
+                return value
+            journal = self.__controller.get_model_journal()
+            event = SerializeModel.UpdateEvent(change=ModelStreamBroadcaster.__UPDATE_CHANGES[entry.change],
+                                               old_file=entry.old_file,
+                                               new_file=entry.new_file)
+            value = self.__serialize.update_event(event, event_id=journal.to_event_id(entry.seq))
+            self.__events[entry.seq] = value
+            if len(self.__events) > journal.capacity:
+                self.__events.popitem(last=False)
+            return value
 
 
 class ModelStreamHandler(IStreamHandler):
-    def __init__(self, controller: Controller):
+    """
+    Streams the model from the controller's journal of model events
+    Every event carries the id of its model change. A client that reconnects
+    with the Last-Event-ID header gets only the events it missed, and the
+    whole model only if the journal no longer has them.
+    """
+    def __init__(self, controller: Controller, broadcaster: ModelStreamBroadcaster):
         self.controller = controller
-        self.serialize = SerializeModel()
-        self.model_listener = WebResponseModelListener()
-        self.initial_model_files = None
-        self.first_run = True
+        self.broadcaster = broadcaster
+        self.journal = None
+        # Sequence number of the last event sent, None until the model is sent
+        self.seq = None
+        self.pending_entries = collections.deque()
 
     @overrides(IStreamHandler)
     def setup(self):
-        self.initial_model_files = self.controller.get_model_files_and_add_listener(self.model_listener)
+        self.journal = self.controller.get_model_journal()
+        last_event_id = bottle.request.get_header("Last-Event-ID")
+        if last_event_id:
+            seq = self.journal.from_event_id(last_event_id)
+            if seq is not None and self.journal.get_entries(seq) is not None:
+                self.seq = seq
 
     @overrides(IStreamHandler)
     def get_value(self) -> Optional[str]:
-        if self.first_run:
-            self.first_run = False
-            return self.serialize.model(self.initial_model_files)
-        else:
-            event = self.model_listener.get_next_event()
-            if event is not None:
-                return self.serialize.update_event(event)
+        if self.seq is not None and not self.pending_entries:
+            entries = self.journal.get_entries(self.seq)
+            if entries is None:
+                # Fell behind the journal, start over from the model
+                self.seq = None
             else:
+                self.pending_entries.extend(entries)
+        if self.seq is None:
+            snapshot = self.controller.get_model_snapshot()
+            entries = self.journal.get_entries(snapshot.seq)
+            if entries is None:
+                # The journal is already past the snapshot, wait for the next one
                 return None
+            self.seq = snapshot.seq
+            self.pending_entries.extend(entries)
+            return self.broadcaster.serialize_model(snapshot)
+        if not self.pending_entries:
+            return None
+        entry = self.pending_entries.popleft()
+        self.seq = entry.seq
+        return self.broadcaster.serialize_entry(entry)
 
     @overrides(IStreamHandler)
     def cleanup(self):
-        if self.model_listener:
-            self.controller.remove_model_listener(self.model_listener)
+        pass
@@ -5,7 +5,7 @@ import json
 from typing import List, Optional
 
 from .serialize import Serialize
-from model import ModelFile
+from model import ModelFile, ModelPatch
 
 
 class SerializeModel(Serialize):
@@ -19,21 +19,47 @@ class SerializeModel(Serialize):
             ADDED = 0
             REMOVED = 1
             UPDATED = 2
+            PATCHED = 3
 
-        def __init__(self, change: Change, old_file: Optional[ModelFile], new_file: Optional[ModelFile]):
+        def __init__(self,
+                     change: Change,
+                     old_file: Optional[ModelFile],
+                     new_file: Optional[ModelFile],
+                     patches: Optional[List[ModelPatch]] = None):
+            """
+            :param change:
+            :param old_file:
+            :param new_file:
+            :param patches: changes within the file's tree, for PATCHED events only
+            """
             self.change = change
             self.old_file = old_file
             self.new_file = new_file
+            self.patches = patches
 
     # Event keys
     __EVENT_INIT = "model-init"
     __EVENT_UPDATE = {
         UpdateEvent.Change.ADDED: "model-added",
         UpdateEvent.Change.REMOVED: "model-removed",
-        UpdateEvent.Change.UPDATED: "model-updated"
+        UpdateEvent.Change.UPDATED: "model-updated",
+        UpdateEvent.Change.PATCHED: "model-patched"
     }
     __KEY_UPDATE_OLD_FILE = "old_file"
     __KEY_UPDATE_NEW_FILE = "new_file"
+    __KEY_UPDATE_NAME = "name"
+    __KEY_UPDATE_PATCHES = "patches"
+
+    # Patch keys
+    __KEY_PATCH_CHANGE = "change"
+    __VALUES_PATCH_CHANGE = {
+        ModelPatch.Change.ADDED: "added",
+        ModelPatch.Change.REMOVED: "removed",
+        ModelPatch.Change.UPDATED: "updated"
+    }
+    __KEY_PATCH_PATH = "path"
+    __KEY_PATCH_FILE = "file"
+    __KEY_PATCH_FIELDS = "fields"
 
     # Model file keys
     __KEY_FILE_NAME = "name"
@@ -60,6 +86,21 @@ class SerializeModel(Serialize):
     __KEY_FILE_FULL_PATH = "full_path"
     __KEY_FILE_CHILDREN = "children"
 
+    # Keys of the ModelFile properties that patches can update
+    # Note: transferred size is not serialized
+    __KEYS_PATCH_FIELD = {
+        "state": __KEY_FILE_STATE,
+        "remote_size": __KEY_FILE_REMOTE_SIZE,
+        "local_size": __KEY_FILE_LOCAL_SIZE,
+        "downloading_speed": __KEY_FILE_DOWNLOADING_SPEED,
+        "eta": __KEY_FILE_ETA,
+        "is_extractable": __KEY_FILE_IS_EXTRACTABLE,
+        "local_created_timestamp": __KEY_FILE_LOCAL_CREATED_TIMESTAMP,
+        "local_modified_timestamp": __KEY_FILE_LOCAL_MODIFIED_TIMESTAMP,
+        "remote_created_timestamp": __KEY_FILE_REMOTE_CREATED_TIMESTAMP,
+        "remote_modified_timestamp": __KEY_FILE_REMOTE_MODIFIED_TIMESTAMP
+    }
+
     @staticmethod
     def __model_file_to_json_dict(model_file: ModelFile) -> dict:
         json_dict = dict()
@@ -85,17 +126,54 @@ class SerializeModel(Serialize):
             json_dict[SerializeModel.__KEY_FILE_CHILDREN].append(SerializeModel.__model_file_to_json_dict(child))
         return json_dict
 
-    def model(self, model_files: List[ModelFile]) -> str:
+    @staticmethod
+    def __patch_fields_to_json_dict(fields: dict) -> dict:
+        """
+        Serialize the fields of an updated patch, with the same keys and values
+        as the files. Fields that files do not serialize are dropped.
+        """
+        json_dict = dict()
+        for field, value in fields.items():
+            key = SerializeModel.__KEYS_PATCH_FIELD.get(field, None)
+            if key is None:
+                continue
+            if field == "state":
+                value = SerializeModel.__VALUES_FILE_STATE[value]
+            elif field.endswith("_timestamp"):
+                value = str(value.timestamp()) if value else None
+            json_dict[key] = value
+        return json_dict
+
+    @staticmethod
+    def __patch_to_json_dict(patch: ModelPatch) -> Optional[dict]:
+        json_dict = dict()
+        json_dict[SerializeModel.__KEY_PATCH_CHANGE] = SerializeModel.__VALUES_PATCH_CHANGE[patch.change]
+        json_dict[SerializeModel.__KEY_PATCH_PATH] = patch.path
+        if patch.change == ModelPatch.Change.ADDED:
+            json_dict[SerializeModel.__KEY_PATCH_FILE] = SerializeModel.__model_file_to_json_dict(patch.new_file)
+        elif patch.change == ModelPatch.Change.UPDATED:
+            fields = SerializeModel.__patch_fields_to_json_dict(patch.fields)
+            if not fields:
+                return None
+            json_dict[SerializeModel.__KEY_PATCH_FIELDS] = fields
+        return json_dict
+
+    def model(self, model_files: List[ModelFile], event_id: Optional[str] = None) -> str:
         """
         Serialize the model
+        :param model_files:
+        :param event_id: SSE id of the event, that clients resume from
         :return:
         """
         model_json_list = [SerializeModel.__model_file_to_json_dict(f) for f in model_files]
         model_json = json.dumps(model_json_list)
         return self._sse_pack(event=SerializeModel.__EVENT_INIT,
-                              data=model_json)
+                              data=model_json,
+                              event_id=event_id)
 
-    def update_event(self, event: UpdateEvent):
+    def update_event(self, event: UpdateEvent, event_id: Optional[str] = None):
+        if event.change == SerializeModel.UpdateEvent.Change.PATCHED:
+            return self.__patch_event(event, event_id)
         model_file_json_dict = {
             SerializeModel.__KEY_UPDATE_OLD_FILE:
                 SerializeModel.__model_file_to_json_dict(event.old_file) if event.old_file else None,
@@ -104,4 +182,25 @@ class SerializeModel(Serialize):
         }
         model_file_json = json.dumps(model_file_json_dict)
         return self._sse_pack(event=SerializeModel.__EVENT_UPDATE[event.change],
-                              data=model_file_json)
+                              data=model_file_json,
+                              event_id=event_id)
+
+    def __patch_event(self, event: UpdateEvent, event_id: Optional[str]):
+        """
+        Patch events carry the changes within the file's tree instead of the
+        whole old and new files
+        Patches address files by their full paths
+        """
+        patches_json_list = []
+        for patch in event.patches:
+            patch_json_dict = SerializeModel.__patch_to_json_dict(patch)
+            if patch_json_dict is not None:
+                patches_json_list.append(patch_json_dict)
+        patch_json_dict = {
+            SerializeModel.__KEY_UPDATE_NAME: event.new_file.name,
+            SerializeModel.__KEY_UPDATE_PATCHES: patches_json_list
+        }
+        patch_json = json.dumps(patch_json_dict)
+        return self._sse_pack(event=SerializeModel.__EVENT_UPDATE[event.change],
+                              data=patch_json,
+                              event_id=event_id)
@@ -16,6 +16,10 @@ class SerializeStatusJson:
     __KEY_CONTROLLER_LATEST_REMOTE_SCAN_TIME = "latest_remote_scan_time"
     __KEY_CONTROLLER_LATEST_REMOTE_SCAN_FAILED = "latest_remote_scan_failed"
     __KEY_CONTROLLER_LATEST_REMOTE_SCAN_ERROR = "latest_remote_scan_error"
+    __KEY_CONTROLLER_LOCAL_SCAN_INTERVAL_IN_MS = "local_scan_interval_in_ms"
+    __KEY_CONTROLLER_REMOTE_SCAN_INTERVAL_IN_MS = "remote_scan_interval_in_ms"
+    __KEY_CONTROLLER_ACTIVE_SCAN_INTERVAL_IN_MS = "active_scan_interval_in_ms"
+    __KEY_CONTROLLER_REMOTE_ACTIVE_SCAN_INTERVAL_IN_MS = "remote_active_scan_interval_in_ms"
 
     @staticmethod
     def status(status: Status) -> str:
@@ -38,6 +42,15 @@ class SerializeStatusJson:
             status.controller.latest_remote_scan_failed
         json_dict[SerializeStatusJson.__KEY_CONTROLLER][SerializeStatusJson.__KEY_CONTROLLER_LATEST_REMOTE_SCAN_ERROR] = \
             status.controller.latest_remote_scan_error
+        json_dict[SerializeStatusJson.__KEY_CONTROLLER][SerializeStatusJson.__KEY_CONTROLLER_LOCAL_SCAN_INTERVAL_IN_MS] = \
+            status.controller.local_scan_interval_in_ms
+        json_dict[SerializeStatusJson.__KEY_CONTROLLER][SerializeStatusJson.__KEY_CONTROLLER_REMOTE_SCAN_INTERVAL_IN_MS] = \
+            status.controller.remote_scan_interval_in_ms
+        json_dict[SerializeStatusJson.__KEY_CONTROLLER][SerializeStatusJson.__KEY_CONTROLLER_ACTIVE_SCAN_INTERVAL_IN_MS] = \
+            status.controller.active_scan_interval_in_ms
+        json_dict[SerializeStatusJson.__KEY_CONTROLLER][
+            SerializeStatusJson.__KEY_CONTROLLER_REMOTE_ACTIVE_SCAN_INTERVAL_IN_MS
+        ] = status.controller.remote_active_scan_interval_in_ms
 
         status_json = json.dumps(json_dict)
         return status_json
@@ -3,7 +3,7 @@
 from common import Context
 from controller import Controller, AutoQueuePersist
 from .web_app import WebApp
-from .handler.stream_model import ModelStreamHandler
+from .handler.stream_model import ModelStreamHandler, ModelStreamBroadcaster
 from .handler.stream_status import StatusStreamHandler
 from .handler.controller import ControllerHandler
 from .handler.server import ServerHandler
@@ -29,6 +29,7 @@ class WebAppBuilder:
         self.config_handler = ConfigHandler(context.config)
         self.auto_queue_handler = AutoQueueHandler(auto_queue_persist)
         self.status_handler = StatusHandler(context.status)
+        self.model_stream_broadcaster = ModelStreamBroadcaster(controller)
 
     def build(self) -> WebApp:
         web_app = WebApp(context=self.__context,
@@ -41,7 +42,8 @@ class WebAppBuilder:
                                   logger=self.__context.logger)
 
         ModelStreamHandler.register(web_app=web_app,
-                                    controller=self.__controller)
+                                    controller=self.__controller,
+                                    broadcaster=self.model_stream_broadcaster)
 
         self.controller_handler.add_routes(web_app)
         self.server_handler.add_routes(web_app)